@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+
+"""
+Clock synchronization between the processes of a pyacq system.
+
+The common timebase is the monotonic clock (``time.perf_counter()``) of the
+process running the :class:`Manager`. When the clock sync service is started
+with :func:`Manager.start_clock_sync`, the Manager periodically measures the
+offset of the clock of every Host and NodeGroup process, fits a linear model
+(offset and drift) to the recent measurements and sends it to the process.
+Each process can then convert its own clock to the common timebase with
+:func:`common_time`, which is what stream timestamps use.
+"""
+
+import time
+import logging
+import threading
+from collections import deque
+
+import numpy as np
+
+from .rpc import RPCClient
+
+logger = logging.getLogger(__name__)
+
+
+class ClockModel:
+    """Linear model of the clock of a remote process relative to the local
+    clock::
+
+        remote_time = local_time + offset + drift * (local_time - t_ref)
+
+    The model is fitted to the last *window* measurements added with
+    :func:`add`. Measurements whose round-trip time is more than twice the
+    median are discarded, as they are likely delayed in one direction.
+    """
+    def __init__(self, offset=0., drift=0., t_ref=0., window=32):
+        self.offset = offset
+        self.drift = drift
+        self.t_ref = t_ref
+        self.rtt = None
+        self.samples = deque(maxlen=window)
+
+    def add(self, local_time, offset, rtt):
+        """Add a measurement of the *offset* of the remote clock at
+        *local_time*, made with a round-trip time *rtt* (all in seconds), and
+        update the model.
+        """
+        self.samples.append((local_time, offset, rtt))
+        t, off, rtts = np.array(self.samples).T
+        mask = rtts <= 2 * np.median(rtts)
+        t, off = t[mask], off[mask]
+        self.t_ref = float(t[-1])
+        self.rtt = float(np.median(rtts))
+        if len(t) > 2 and t[-1] > t[0]:
+            drift, offset = np.polyfit(t - self.t_ref, off, 1)
+        else:
+            drift, offset = 0., off.mean()
+        self.drift, self.offset = float(drift), float(offset)
+
+    def to_remote(self, local_time):
+        """Convert a time of the local clock to the remote clock.
+        """
+        return local_time + self.offset + self.drift * (local_time - self.t_ref)
+
+    def to_local(self, remote_time):
+        """Convert a time of the remote clock to the local clock.
+        """
+        return (remote_time - self.offset + self.drift * self.t_ref) / (1. + self.drift)
+
+    def params(self):
+        return dict(offset=self.offset, drift=self.drift, t_ref=self.t_ref)
+
+
+# Model of the clock of this process relative to the common timebase (the
+# identity until the Manager sends one with set_clock()).
+_clock = ClockModel()
+
+
+def set_clock(offset, drift, t_ref):
+    """Set the model of this process' clock relative to the common timebase.
+
+    This is called by the clock sync service of the Manager.
+    """
+    global _clock
+    _clock = ClockModel(offset, drift, t_ref)
+
+
+def common_time(t=None):
+    """Return the common time corresponding to *t*, a time from this
+    process' ``time.perf_counter()`` clock (default: now).
+    """
+    if t is None:
+        t = time.perf_counter()
+    return _clock.to_local(t)
+
+
+class ClockSync(threading.Thread):
+    """Thread that periodically measures the clocks of remote processes and
+    sends them their :class:`ClockModel`.
+
+    Parameters
+    ----------
+    get_targets : callable
+        Returns a {name: rpc_address} dict of the processes to synchronize.
+        It is called before every round of measurements.
+    interval : float
+        Time (s) between two rounds of measurements.
+    window : int
+        Number of measurements used to fit each model.
+    """
+    def __init__(self, get_targets, interval=5., window=32):
+        threading.Thread.__init__(self, daemon=True)
+        self.get_targets = get_targets
+        self.interval = interval
+        self.window = window
+        self.models = {}  # name: ClockModel
+        self._stop_event = threading.Event()
+
+    def run(self):
+        try:
+            while not self._stop_event.is_set():
+                self.sync_once()
+                self._stop_event.wait(self.interval)
+        finally:
+            self._close_clients()
+
+    def sync_once(self):
+        """Measure all targets once and send them their updated model.
+        """
+        targets = self.get_targets()
+        for name in list(self.models):
+            if name not in targets:
+                del self.models[name]
+        for name, addr in targets.items():
+            try:
+                client = RPCClient.get_client(addr)
+                sample = client.measure_clock_diff(min_rtt=True)
+                model = self.models.setdefault(name, ClockModel(window=self.window))
+                model.add(*sample)
+                client._import('pyacq.core.clocksync').set_clock(_sync='off', **model.params())
+            except Exception:
+                # process closed or unreachable; try again next round
+                logger.debug("Clock sync failed for %s", name, exc_info=True)
+                self.models.pop(name, None)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _close_clients(self):
+        # RPC clients are per thread; do not leave them to a future thread
+        # that reuses this thread's id.
+        ident = threading.current_thread().ident
+        with RPCClient.clients_by_thread_lock:
+            for key in [k for k in RPCClient.clients_by_thread if k[0] == ident]:
+                RPCClient.clients_by_thread.pop(key).close()
@@ -7,6 +7,7 @@ import logging
 
 from .rpc import RPCServer, RPCClient, ProcessSpawner
 from .host import Host
+from .clocksync import ClockSync
 from .rpc import log as rpc_log
 
 
@@ -83,6 +84,8 @@ class Manager(object):
         self._next_nodegroup_name = 0
         self._next_node_name = 0
         
+        self._clock_sync = None
+        
         # publish with the RPC server if there is one
         server = RPCServer.get_server()
         if server is not None:
@@ -181,6 +184,67 @@ class Manager(object):
         for ng in self.nodegroups.values():
             ng.stop_all_nodes()
 
+    def stream_stats(self):
+        """Return the statistics of every stream in the system::
+        
+            {nodegroup_name: {node_name: {'inputs': {...}, 'outputs': {...}}}}
+        
+        See :func:`OutputStream.stats` and :func:`InputStream.stats`.
+        """
+        return {name: ng.stream_stats() for name, ng in self.nodegroups.items()
+                if ng not in self._closed_nodegroups}
+
+    def start_clock_sync(self, interval=5.):
+        """Start synchronizing the clocks of all hosts and nodegroups to the
+        clock of the Manager.
+        
+        Every *interval* seconds, a background thread measures the clock
+        offset of every process (like :func:`RPCClient.measure_clock_diff`,
+        but keeping the round trip with the shortest delay), updates a
+        filtered model of its offset and drift and sends the model to the
+        process. Stream timestamps (see the
+        ``timestamps`` stream parameter) and :func:`InputStream.index_to_time`
+        then use the clock of the Manager as a common timebase, so that
+        streams from several machines can be aligned.
+        
+        See :mod:`pyacq.core.clocksync`.
+        """
+        self.stop_clock_sync()
+        self._clock_sync = ClockSync(self._clock_sync_targets, interval=interval)
+        self._clock_sync.start()
+    
+    def stop_clock_sync(self):
+        """Stop the clock synchronization started with :func:`start_clock_sync`.
+        
+        Processes keep the last model they received.
+        """
+        if self._clock_sync is not None:
+            self._clock_sync.stop()
+            self._clock_sync.join()
+            self._clock_sync = None
+    
+    def clock_models(self):
+        """Return the current clock model of each synchronized process::
+        
+            {name: {'offset': s, 'drift': s/s, 't_ref': s, 'rtt': s}}
+        
+        where *name* is a nodegroup name or a host address. The clock of the
+        process is ``manager_time + offset + drift * (manager_time - t_ref)``,
+        where *t_ref* is the Manager time of the latest measurement used by
+        the model and *rtt* the median round-trip time of the measurements.
+        """
+        if self._clock_sync is None:
+            return {}
+        return {name: dict(model.params(), rtt=model.rtt)
+                for name, model in list(self._clock_sync.models.items())}
+    
+    def _clock_sync_targets(self):
+        targets = {addr: host._rpc_addr for addr, host in list(self.hosts.items())}
+        for name, ng in list(self.nodegroups.items()):
+            if ng not in self._closed_nodegroups:
+                targets[name] = ng._rpc_addr
+        return targets
+
     def close_all_nodegroups(self):
         for ng in self.nodegroups.values():
             if ng in self._closed_nodegroups:
@@ -200,4 +264,5 @@ class Manager(object):
         If a default host was created by this Manager, then it will be closed 
         as well.
         """
+        self.stop_clock_sync()
         self.close_all_nodegroups()
@@ -7,6 +7,7 @@ from pyqtgraph.util.mutex import Mutex
 
 from .nodelist import register_node_type
 from .stream import OutputStream, InputStream
+from .rpc import RPCServer
 from logging import info
 
 
@@ -134,6 +135,7 @@ class Node(object):
         self._configure(**kargs)
         with self.lock:
             self._configured = True
+        self._invalidate_proxies()
     
     def initialize(self):
         """Initialize the Node.
@@ -148,6 +150,14 @@ class Node(object):
         self._initialize()
         with self.lock:
             self._initialized = True
+        self._invalidate_proxies()
+
+    def _invalidate_proxies(self):
+        # Drop values of this node cached by remote proxies (see the 'cache'
+        # option of ObjectProxy).
+        server = RPCServer.current()
+        if server is not None:
+            server.invalidate(self)
 
     def start(self):
         """Start the Node.
@@ -181,6 +191,8 @@ class Node(object):
             'Cannot stop Node {} : the Node is not running'.format(self.name)
 
         self._stop()
+        for output in self.outputs.values():
+            output.flush()
         with self.lock:
             self._running = False
 
@@ -235,6 +247,19 @@ class Node(object):
         """
         raise(NotImplementedError)
     
+    def stream_stats(self):
+        """Return the :func:`stats() <InputStream.stats>` of all connected
+        inputs and configured outputs of this Node::
+        
+            {'inputs': {name: stats}, 'outputs': {name: stats}}
+        """
+        return {
+            'inputs': {name: input.stats() for name, input in self.inputs.items()
+                       if getattr(input, 'connected', False)},
+            'outputs': {name: output.stats() for name, output in self.outputs.items()
+                        if output.configured},
+        }
+    
     def check_input_specs(self):
         """This method is called during `Node.initialize()` and may be
         reimplemented by subclasses to ensure that inputs are correctly
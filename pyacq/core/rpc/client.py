@@ -8,6 +8,8 @@ import time
 import weakref
 import socket
 import concurrent.futures
+import contextlib
+import copy
 import threading
 import zmq
 import logging
@@ -115,6 +117,14 @@ class RPCClient(object):
         self.connect_established = False
         self.establishing_connect = False
         self._disconnected = False
+        
+        # requests queued by batch()
+        self._batch = None
+        self._batch_futures = None
+        
+        # {(obj_id, attributes): (value, time of retrieval)} values cached by
+        # proxies with the 'cache' option
+        self._value_cache = {}
 
         # For unserializing results returned from servers. This cannot be
         # used to send proxies of local objects unless there is also a server
@@ -209,6 +219,10 @@ class RPCClient(object):
                                                          | ref_id: proxy reference ID
         import   Import and return a proxy to a module   | module: name of module to import
         ping     Return 'pong'                           | 
+        batch    Process several requests in order       | requests: list of dicts with req_id,
+                 (see :func:`batch`)                     | action, return_type and frames (the
+                                                         | number of array frames sent after the
+                                                         | opts frame of the request)
         ======== ======================================= ==========================================
         
         """
@@ -217,6 +231,11 @@ class RPCClient(object):
         if self._disconnected:
             raise RuntimeError("Cannot send request; server has already disconnected.")
         
+        batched = self._batch is not None and action != 'close'
+        if batched and sync == 'sync':
+            # cannot wait for a result that will only be requested later
+            sync = 'async'
+        
         if sync == 'off':
             req_id = -1
         else:
@@ -226,14 +245,16 @@ class RPCClient(object):
                     self.address.decode(), req_id)
         logger.debug("    => sync=%s return=%s opts=%s", sync, return_type, opts)
         
-        if opts is None:
-            opts_str = b''
+        if batched:
+            # Serialize the request now: the caller may modify its arguments
+            # before the batch is sent. Array data is copied for the same
+            # reason.
+            opts_str, buffers = self._encode_opts(opts)
+            req = {'req_id': req_id, 'action': action,
+                   'return_type': return_type, 'frames': len(buffers)}
+            self._batch.append((req, [opts_str] + [buf.tobytes() for buf in buffers]))
         else:
-            opts_str = self.serializer.dumps(opts)
-        ser_type = self.serializer.type.encode()
-        
-        msg = [str(req_id).encode(), action.encode(), return_type.encode(), ser_type, opts_str]
-        self._socket.send_multipart(msg)
+            self._send_msg(req_id, action, return_type, opts, copy=(sync != 'sync'))
         
         if sync == 'off':
             return
@@ -243,6 +264,8 @@ class RPCClient(object):
             # for server closure we require a little special handling
             fut.add_done_callback(self._close_request_returned)
         self.futures[req_id] = fut
+        if batched:
+            self._batch_futures.append(fut)
         
         if sync == 'async':
             return fut
@@ -251,6 +274,76 @@ class RPCClient(object):
         else:
             raise ValueError('Invalid sync value: %s' % sync)
 
+    def _encode_opts(self, opts):
+        # Return serialized opts and the list of ndarray buffers that are
+        # sent in extra frames after them.
+        buffers = []
+        if opts is None:
+            opts_str = b''
+        else:
+            opts_str = self.serializer.dumps(opts, buffers)
+        return opts_str, buffers
+
+    def _send_msg(self, req_id, action, return_type, opts, copy, frames=None):
+        # ndarray data is sent in extra frames after opts; *frames*, if given,
+        # are sent after them.
+        opts_str, buffers = self._encode_opts(opts)
+        if frames is not None:
+            buffers.extend(frames)
+        ser_type = self.serializer.type.encode()
+        
+        msg = [str(req_id).encode(), action.encode(), return_type.encode(), ser_type, opts_str]
+        # A synchronous caller cannot modify its arrays before the request is
+        # sent, so their memory can be handed to zmq; otherwise copy once.
+        self._socket.send_multipart(msg + buffers, copy=copy)
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Context manager that sends all requests made inside its block in a
+        single message when the block exits::
+        
+            with client.batch() as futures:
+                for i, chan in enumerate(channels):
+                    viewer.set_channel_param(i, chan)   # returns a Future
+            results = [fut.result() for fut in futures]
+        
+        The server processes the requests in order. Inside the block,
+        synchronous requests (the default for proxy calls) return a
+        :class:`Future` instead of waiting for their result; the list of
+        all futures is given by the context manager. Results are not
+        available before the block exits, so a request cannot use the result
+        of a previous request of the same batch. Requests made from other
+        threads use other clients and are not batched.
+        
+        If the block raises an exception, the queued requests are not sent and
+        their futures are cancelled. Nested batches are merged into the
+        outermost one.
+        """
+        if self._batch is not None:
+            yield self._batch_futures
+            return
+        self._batch = []
+        self._batch_futures = []
+        futures = self._batch_futures
+        try:
+            yield futures
+        except:
+            for fut in futures:
+                self.futures.pop(fut.call_id, None)
+                concurrent.futures.Future.cancel(fut)
+            raise
+        else:
+            if len(self._batch) > 0:
+                # each request is followed by its serialized opts and array
+                # data, which were copied when the request was made
+                requests = [req for req, frames in self._batch]
+                frames = [f for req, frames in self._batch for f in frames]
+                self._send_msg(-1, 'batch', 'auto', {'requests': requests},
+                               copy=False, frames=frames)
+        finally:
+            self._batch = None
+            self._batch_futures = None
+
     def call_obj(self, obj, args=None, kwargs=None, **kwds):
         """Invoke a remote callable object.
         
@@ -282,6 +375,32 @@ class RPCClient(object):
         """
         return self.send('get_obj', opts={'obj': obj}, **kwds)
 
+    def get_cached_value(self, obj, cache):
+        """Return a copy of a remote object, using a cached value if possible.
+        
+        Parameters
+        ----------
+        obj : :class:`ObjectProxy`
+            A proxy that references an object owned by the connected RPCServer.
+        cache : float | 'frozen'
+            Time (s) during which the cached value is used, or 'frozen' to use
+            it until the server invalidates it (see :func:`RPCServer.invalidate`).
+        
+        Invalidation messages sent by the server are processed before the
+        cache is looked up. A copy of the cached value is returned, so
+        it can be modified by the caller.
+        """
+        if self._batch is not None:
+            return self.get_obj(obj, return_type='value')
+        self._read_and_process_all()
+        key = (obj._obj_id, obj._attributes)
+        now = time.perf_counter()
+        entry = self._value_cache.get(key, None)
+        if entry is None or (cache != 'frozen' and now - entry[1] > cache):
+            value = self.get_obj(obj, return_type='value')
+            entry = self._value_cache[key] = (value, now)
+        return copy.deepcopy(entry[0])
+
     def transfer(self, obj, **kwds):
         """Send an object to the remote process and return a proxy to it.
         
@@ -452,8 +571,8 @@ class RPCClient(object):
             # NOTE: docs say timeout can only be set before bind, but this
             # seems to work for now.
             self._socket.setsockopt(zmq.RCVTIMEO, timeout)
-            msg = self._socket.recv()
-            msg = self.serializer.loads(msg)
+            frames = self._socket.recv_multipart(copy=False)
+            msg = self.serializer.loads(frames[0].buffer, frames[1:])
         except zmq.error.Again:
             raise TimeoutError("Timeout waiting for Future result.")
         
@@ -486,6 +605,10 @@ class RPCClient(object):
                 fut.set_exception(exc)
             else:
                 fut.set_result(msg['rval'])
+        elif msg['action'] == 'invalidate':
+            obj_id = msg['obj_id']
+            for key in [k for k in self._value_cache if k[0] == obj_id]:
+                del self._value_cache[key]
         elif msg['action'] == 'disconnect':
             self._server_disconnected()
         else:
@@ -510,6 +633,7 @@ class RPCClient(object):
         # * another client requested that the server close and this client
         #   received a preemptive disconnect message from the server.
         self._disconnected = True
+        self._value_cache.clear()
         logger.debug("Received server disconnect from %s", self.address)
         exc = RuntimeError("Cannot send request; server has already disconnected.")
         for fut in self.futures.values():
@@ -543,18 +667,30 @@ class RPCClient(object):
             return True
         return self.send('close', sync=sync, timeout=timeout, **kwds)
 
-    def measure_clock_diff(self):
+    def measure_clock_diff(self, n=10, min_rtt=False):
         """Measure the clock offset between this host and the remote host.
+        
+        The remote ``time.perf_counter()`` is read *n* times. By default the
+        mean offset is returned. If *min_rtt* is True, only the round trip
+        with the shortest round-trip time is used (it is the least likely to
+        be delayed in one direction), and ``(local_time, offset, rtt)`` is
+        returned, all in seconds.
         """
         rcounter = self._import('time').perf_counter
         ltimes = []
         rtimes = []
-        for i in range(10):
+        for i in range(n):
             ltimes.append(time.perf_counter())
             rtimes.append(rcounter())
+        ltimes.append(time.perf_counter())
         ltimes = np.array(ltimes)
-        rtimes = np.array(rtimes[:-1])
-        dif = rtimes - ((ltimes[1:] + ltimes[:-1]) * 0.5)
+        rtimes = np.array(rtimes)
+        mid = (ltimes[1:] + ltimes[:-1]) * 0.5
+        dif = rtimes - mid
+        if min_rtt:
+            rtt = ltimes[1:] - ltimes[:-1]
+            i = np.argmin(rtt)
+            return float(mid[i]), float(dif[i]), float(rtt[i])
         # we can probably constrain this estimate a bit more by looking at
         # min/max times and excluding outliers.
         return dif.mean()
@@ -48,6 +48,9 @@ class ProcessSpawner(object):
         process.
     executable : str | None
         Optional python executable to invoke. The default value is `sys.executable`.
+    workers : int
+        Number of worker threads of the remote :class:`RPCServer` (see
+        :class:`RPCServer`). Not supported with ``qt=True``. Default is 0.
         
     Examples
     --------
@@ -66,7 +69,7 @@ class ProcessSpawner(object):
         proc.wait()
     """
     def __init__(self, name=None, address="tcp://127.0.0.1:*", qt=False, log_addr=None, 
-                 log_level=None, executable=None):
+                 log_level=None, executable=None, workers=0):
         #logger.warn("Spawning process: %s %s %s", name, log_addr, log_level)
         assert qt in (True, False)
         assert isinstance(address, (str, bytes))
@@ -75,6 +78,8 @@ class ProcessSpawner(object):
         if log_addr is None:
             log_addr = get_logger_address()
         assert log_level is None or isinstance(log_level, int)
+        if qt and workers > 0:
+            raise ValueError("RPC worker threads are not supported with qt=True")
         if log_level is None:
             log_level = logger.getEffectiveLevel()
         
@@ -92,6 +97,8 @@ class ProcessSpawner(object):
         # Spawn new process
         class_name = 'QtRPCServer' if qt else 'RPCServer'
         args = {'address': address}
+        if workers > 0:
+            args['workers'] = workers
         bootstrap_conf = dict(
             class_name=class_name, 
             args=args,
@@ -110,6 +110,7 @@ class ObjectProxy(object):
             'defer_getattr': True,   ## True, False
             'no_proxy_types': [type(None), str, int, float, tuple, list, dict, ObjectProxy],
             'auto_delete': False,
+            'cache': None,
         }
         
         self._set_proxy_options(**kwds)
@@ -193,6 +194,17 @@ class ObjectProxy(object):
         auto_delete : bool
             If True, then the proxy will automatically call
             `self._delete()` when it is collected by Python.
+        cache : None, float or 'frozen'
+            If not None, the value returned by :func:`_get_value` is cached by
+            the client and reused by all proxies to the same remote object and
+            attributes: for *cache* seconds, or if 'frozen' until the server
+            reports that the object has changed (see
+            :func:`RPCServer.invalidate`). Use this for values that are read
+            often but rarely change, such as stream parameters::
+            
+                params = output._deferred_attr('params', cache='frozen')
+                params._get_value()   # remote request
+                params._get_value()   # local copy
         """
         for k in kwds:
             if k not in self._proxy_options:
@@ -225,6 +237,8 @@ class ObjectProxy(object):
         """
         if self._client() is None:
             return self._server().unwrap_proxy(self)
+        elif self._proxy_options['cache'] is not None:
+            return self._client().get_cached_value(self, self._proxy_options['cache'])
         else:
             return self._client().get_obj(self, return_type='value')
         
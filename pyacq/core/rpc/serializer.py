@@ -24,6 +24,39 @@ all_serializers = {}  # type_str: class
 encode_key = '___type_name___'
 
 
+def encode_dtype(dtype):
+    """Return a json/msgpack-compatible description of a numpy dtype.
+    
+    Structured dtypes (including nested fields, sub-arrays and explicit
+    offsets) are described by a dict of names, formats, offsets and itemsize;
+    see :func:`decode_dtype`.
+    """
+    dtype = np.dtype(dtype)
+    if dtype.fields is not None:
+        names = list(dtype.names)
+        return {'names': names,
+                'formats': [encode_dtype(dtype.fields[name][0]) for name in names],
+                'offsets': [dtype.fields[name][1] for name in names],
+                'itemsize': dtype.itemsize}
+    if dtype.subdtype is not None:
+        base, shape = dtype.subdtype
+        return {'base': encode_dtype(base), 'shape': list(shape)}
+    return dtype.str
+
+
+def decode_dtype(desc):
+    """Inverse of :func:`encode_dtype`.
+    """
+    if isinstance(desc, str):
+        return np.dtype(desc)
+    if 'base' in desc:
+        return np.dtype((decode_dtype(desc['base']), tuple(desc['shape'])))
+    return np.dtype({'names': desc['names'],
+                     'formats': [decode_dtype(f) for f in desc['formats']],
+                     'offsets': desc['offsets'],
+                     'itemsize': desc['itemsize']})
+
+
 class Serializer:
     """Base serializer class on which msgpack and json serializers 
     (and potentially others) are built.
@@ -37,6 +70,11 @@ class Serializer:
     
     Note that tuples are converted to lists in transit. See:
     https://github.com/msgpack/msgpack-python/issues/98
+    
+    If a *buffers* list is given to :func:`dumps`, the data of ndarrays is not
+    serialized into the message but appended to this list, so that it can be
+    sent without copy as extra zmq frames; the message only references the
+    index of each frame. The same frames must then be given to :func:`loads`.
     """
     def __init__(self, server=None, client=None):
         self._server = server
@@ -47,23 +85,36 @@ class Serializer:
         if self._server is None:
             # get the current server for this thread, if one exists
             from .server import RPCServer
-            self._server = RPCServer.get_server()
+            self._server = RPCServer.current()
         return self._server
     
-    def dumps(self, obj):
+    def dumps(self, obj, buffers=None):
         """Convert obj to serialized string.
+        
+        If *buffers* is a list, the data of ndarrays is appended to it instead
+        of being included in the string.
         """
         raise NotImplementedError()
 
-    def loads(self, msg):
+    def loads(self, msg, frames=None):
         """Convert from serialized string to python object.
         
-        Proxies that reference objects owned by the server are converted back
-        into the local object. All other proxies are left as-is.
+        *frames* is the list of buffers that were produced by :func:`dumps`
+        along with *msg*. Proxies that reference objects owned by the server
+        are converted back into the local object. All other proxies are left
+        as-is.
         """
         raise NotImplementedError()
 
-    def encode(self, obj):
+    def loads_raw(self, msg):
+        """Convert from serialized string to python object without decoding
+        ndarrays, proxies or other special types, which are left as dicts.
+        
+        This is used to inspect a message without side effects.
+        """
+        raise NotImplementedError()
+
+    def encode(self, obj, buffers=None):
         """Convert various types to serializable objects.
         
         Provides support for ndarray, datetime, date, and None. Other types
@@ -72,11 +123,16 @@ class Serializer:
         if isinstance(obj, np.ndarray):
             if not obj.flags['C_CONTIGUOUS']:
                 obj = np.ascontiguousarray(obj)
-            assert(obj.flags['C_CONTIGUOUS'])
-            return {encode_key: 'ndarray',
-                    'data': obj.tobytes(),
-                    'dtype': str(obj.dtype),
-                    'shape': obj.shape}
+            ser = {encode_key: 'ndarray',
+                   'dtype': encode_dtype(obj.dtype),
+                   'shape': obj.shape}
+            if buffers is None:
+                ser['data'] = obj.tobytes()
+            else:
+                # sent as a separate frame; uint8 view for the buffer protocol
+                ser['frame'] = len(buffers)
+                buffers.append(obj.reshape(-1).view('uint8'))
+            return ser
         elif isinstance(obj, datetime.datetime):
             return {encode_key: 'datetime',
                     'data': obj.strftime('%Y-%m-%dT%H:%M:%S.%f')}
@@ -101,7 +157,7 @@ class Serializer:
             ser.update(obj._save())
             return ser
 
-    def decode(self, dct):
+    def decode(self, dct, frames=None):
         """Convert from serializable objects back to original types.
         """
         if isinstance(dct, dict):
@@ -109,13 +165,13 @@ class Serializer:
             if type_name is None:
                 return dct
             if type_name == 'ndarray':
-                dt = dct['dtype']
-                if dt.startswith('['):
-                    #small hack to have a list
-                    d = {}
-                    exec('dtype='+dt, None, d)
-                    dt = d['dtype']
-                return np.frombuffer(dct['data'], dtype=dt).reshape(dct['shape'])
+                if 'frame' in dct:
+                    # bytes, or zmq.Frame received with copy=False
+                    data = frames[dct['frame']]
+                else:
+                    data = dct['data']
+                dtype = decode_dtype(dct['dtype'])
+                return np.frombuffer(data, dtype=dtype).reshape(dct['shape'])
             elif type_name == 'datetime':
                 return datetime.datetime.strptime(dct['data'], '%Y-%m-%dT%H:%M:%S.%f')
             elif type_name == 'date':
@@ -154,12 +210,12 @@ class MsgpackSerializer(Serializer):
         assert HAVE_MSGPACK
         Serializer.__init__(self, server, client)
     
-    def dumps(self, obj):
+    def dumps(self, obj, buffers=None):
         """Convert obj to msgpack string.
         """
-        return msgpack.dumps(obj, use_bin_type=True, default=self.encode)
+        return msgpack.dumps(obj, use_bin_type=True, default=lambda o: self.encode(o, buffers))
 
-    def loads(self, msg):
+    def loads(self, msg, frames=None):
         """Convert from msgpack string to python object.
         
         Proxies that reference objects owned by the server are converted back
@@ -170,9 +226,12 @@ class MsgpackSerializer(Serializer):
         #return msgpack.loads(msg, encoding='utf8', use_list=False, object_hook=self.decode)
 
         #Return lists/tuples as lists because json can't be configured otherwise
-        return msgpack.loads(msg,  object_hook=self.decode)
+        return msgpack.loads(msg,  object_hook=lambda dct: self.decode(dct, frames))
         # encoding='utf8',
 
+    def loads_raw(self, msg):
+        return msgpack.loads(msg)
+
 
 class JsonSerializer(Serializer):
     
@@ -184,29 +243,38 @@ class JsonSerializer(Serializer):
         
         # We require a custom class to overrode json encode behavior.
         class EnhancedJSONEncoder(json.JSONEncoder):
+            def __init__(self2, buffers=None, **kwds):
+                json.JSONEncoder.__init__(self2, **kwds)
+                self2.buffers = buffers
+            
             def default(self2, obj):
-                obj2 = self.encode(obj)
+                obj2 = self.encode(obj, self2.buffers)
                 if obj is obj2:
                     return json.JSONEncoder.default(self, obj)
                 else:
                     return obj2
         self.EnhancedJSONEncoder = EnhancedJSONEncoder
     
-    def dumps(self, obj):
-        return json.dumps(obj, cls=self.EnhancedJSONEncoder).encode()
+    def dumps(self, obj, buffers=None):
+        return json.dumps(obj, cls=self.EnhancedJSONEncoder, buffers=buffers).encode()
     
-    def loads(self, msg):
-        return json.loads(msg.decode(), object_hook=self.decode)
+    def loads(self, msg, frames=None):
+        return json.loads(bytes(msg).decode(), object_hook=lambda dct: self.decode(dct, frames))
 
-    def encode(self, obj):
-        if isinstance(obj, np.ndarray):
+    def loads_raw(self, msg):
+        return json.loads(bytes(msg).decode())
+
+    def encode(self, obj, buffers=None):
+        if isinstance(obj, np.ndarray) and buffers is not None:
+            return Serializer.encode(self, obj, buffers)
+        elif isinstance(obj, np.ndarray):
             # JSON doesn't support bytes, so we use base64 encoding instead:
             if not obj.flags['C_CONTIGUOUS']:
                 obj = np.ascontiguousarray(obj)
             assert(obj.flags['C_CONTIGUOUS'])
             return {encode_key: 'ndarray',
                     'data': base64.b64encode(obj.data).decode(),
-                    'dtype': str(obj.dtype),
+                    'dtype': encode_dtype(obj.dtype),
                     'shape': obj.shape}
         elif isinstance(obj, bytes):
             return {encode_key: 'bytes',
@@ -214,18 +282,18 @@ class JsonSerializer(Serializer):
         elif obj is None:
             # JSON does support None/null:
             return None
-        return Serializer.encode(self, obj)
+        return Serializer.encode(self, obj, buffers)
 
-    def decode(self, dct):
+    def decode(self, dct, frames=None):
         if isinstance(dct, dict):
             type_name = dct.get(encode_key, None)
-            if type_name == 'ndarray':
+            if type_name == 'ndarray' and 'data' in dct:
                 data = base64.b64decode(dct['data'])
-                return np.frombuffer(data, dct['dtype']).reshape(dct['shape'])
+                return np.frombuffer(data, decode_dtype(dct['dtype'])).reshape(dct['shape'])
             elif type_name == 'bytes':
                 return base64.b64decode(dct['data'])
             
-            return Serializer.decode(self, dct)
+            return Serializer.decode(self, dct, frames)
         return dct
 
 
@@ -4,11 +4,13 @@
 
 import atexit
 import builtins
+import concurrent.futures
 import logging
 import sys
 import threading
 import time
 import traceback
+from collections import deque
 
 import numpy as np
 import zmq
@@ -41,7 +43,33 @@ class RPCServer(object):
       a separate thread, but then sent to the Qt event loop by signal and
       processed there. The server is registered as running in the Qt thread.
 
+    By default all requests are processed one at a time in the server's thread,
+    so a slow call delays every other request, including pings. With
+    ``workers > 0`` (only with `run_forever()`), requests are executed by a
+    pool of worker threads instead:
     
+    * Requests addressed to the same proxied object ('call_obj', 'get_obj'
+      and 'delete') are executed one at a time, in the order they were
+      received. A proxy is therefore only released after the calls sent
+      through it before. Requests addressed to different objects (for
+      example two Nodes of the same NodeGroup) run concurrently, so these
+      objects must not share unprotected state.
+    * Batched requests (see :func:`RPCClient.batch`) and requests to the
+      server namespace ('import', 'get_item' and 'set_item') from a client
+      are executed in order, in one queue per client. A batched request to
+      an object still waits for the requests that are running on the same
+      object.
+    * 'ping' and 'close' are processed immediately by the server thread, so
+      they are never delayed by slow calls.
+    
+    Requests that go to different queues are not ordered: asynchronous
+    requests sent by one client to two objects (``_sync='async'`` or
+    ``'off'``) may run in a different order than they were sent. Wait for the
+    result of the first request when the order matters.
+    
+    A worker that calls back into an object of this server that is busy
+    (including its own object) waits until that object is released; such
+    reentrant calls deadlock until the client timeout.
       
     Parameters
     ----------
@@ -52,6 +80,9 @@ class RPCServer(object):
         
         **Note:** binding RPCServer to a public IP address is a potential
         security hazard.
+    workers : int
+        Number of worker threads used to execute calls to proxied objects.
+        Default is 0 (all requests are processed in the server thread).
 
     Notes
     -----
@@ -98,6 +129,9 @@ class RPCServer(object):
     servers_by_thread = {}
     servers_by_thread_lock = threading.Lock()
     
+    # the server that dispatched the request processed by a worker thread
+    _worker_local = threading.local()
+    
     @staticmethod
     def get_server():
         """Return the server running in this thread, or None if there is no server.
@@ -105,6 +139,17 @@ class RPCServer(object):
         with RPCServer.servers_by_thread_lock:
             return RPCServer.servers_by_thread.get(threading.current_thread().ident, None)
     
+    @staticmethod
+    def current():
+        """Return the server running in this thread or, in a worker thread of
+        a server (see the *workers* argument), the server that dispatched the
+        request being processed. Return None if there is no such server.
+        """
+        srv = RPCServer.get_server()
+        if srv is None:
+            srv = getattr(RPCServer._worker_local, 'server', None)
+        return srv
+    
     @staticmethod
     def register_server(srv):
         """Register a server as the (only) server running in this thread.
@@ -140,8 +185,9 @@ class RPCServer(object):
         srv = RPCServer.get_server()
         return RPCClient.get_client(srv.address)
 
-    def __init__(self, address="tcp://127.0.0.1:*"):
-        self._socket = zmq.Context.instance().socket(zmq.ROUTER)
+    def __init__(self, address="tcp://127.0.0.1:*", workers=0):
+        context = zmq.Context.instance()
+        self._socket = context.socket(zmq.ROUTER)
         
         # socket will continue attempting to deliver messages up to 5 sec after
         # it has closed. (default is -1, which can cause processes to hang
@@ -186,6 +232,26 @@ class RPCServer(object):
         self._next_ref_id = 0  # uniquely identifies a proxy reference
         self._proxy_refs = {}  # obj_id: [object, set(refs)]
         self._proxy_id_map = {}  # id(obj): obj_id
+        self._proxy_lock = threading.RLock()
+        
+        # Optional pool of threads that execute requests to proxied objects.
+        self._pool = None
+        if workers > 0:
+            self._pool = concurrent.futures.ThreadPoolExecutor(
+                workers, thread_name_prefix='RPCWorker')
+            self._queues = {}  # key: deque of (caller, msg) waiting for a worker
+            self._queues_lock = threading.Lock()
+            # Held while a request to an object runs, so that batched
+            # requests are serialized with the queue of the object.
+            self._obj_locks = {}  # obj_id: RLock
+            # Workers may not use the ROUTER socket; they send their results
+            # through this socket and the server thread forwards them.
+            self._return_addr = 'inproc://rpc_return_%x' % id(self)
+            self._return_socket = context.socket(zmq.PULL)
+            self._return_socket.linger = 1000
+            self._return_socket.bind(self._return_addr)
+            self._worker_sockets = []
+            self._local = threading.local()
         
         # Make sure we inform clients of closure
         atexit.register(self._atexit)
@@ -195,13 +261,14 @@ class RPCServer(object):
         
         This proxy can be sent via RPC to any other node.
         """
-        rid = self._next_ref_id
-        self._next_ref_id += 1
-        oid = self._get_object_id(obj)
+        with self._proxy_lock:
+            rid = self._next_ref_id
+            self._next_ref_id += 1
+            oid = self._get_object_id(obj)
+            proxy_ref = self._proxy_refs.setdefault(oid, [obj, set()])
+            proxy_ref[1].add(rid)
         type_str = str(type(obj))
         proxy = ObjectProxy(self.address, oid, rid, type_str, attributes=(), **kwds)
-        proxy_ref = self._proxy_refs.setdefault(oid, [obj, set()])
-        proxy_ref[1].add(rid)
         #logging.debug("server %s add proxy %d: %s", self.address, oid, obj)
         return proxy
 
@@ -213,12 +280,31 @@ class RPCServer(object):
             self._proxy_id_map[id(obj)] = oid
         return oid
     
+    def invalidate(self, obj):
+        """Inform all clients that *obj* (or one of its attributes) has
+        changed, so that they discard any value of it they have cached (see
+        the ``cache`` option of :func:`ObjectProxy._set_proxy_options`).
+        
+        This does nothing if no proxy to *obj* has been sent.
+        """
+        oid = self._proxy_id_map.get(id(obj), None)
+        if oid is None:
+            return
+        data = {}
+        # may be called from a worker while the server thread adds clients
+        for client, ser_type in list(self._clients.items()):
+            if ser_type not in data:
+                ser = self._serializers[ser_type]
+                data[ser_type] = ser.dumps({'action': 'invalidate', 'obj_id': oid})
+            self._send_frames([client, data[ser_type]])
+    
     def unwrap_proxy(self, proxy):
         """Return the local python object referenced by *proxy*.
         """
         try:
             oid = proxy._obj_id
-            obj = self._proxy_refs[oid][0]
+            with self._proxy_lock:
+                obj = self._proxy_refs[oid][0]
         except KeyError:
             raise KeyError("Invalid proxy object ID %r. The object may have "
                            "been released already." % proxy.obj_id)
@@ -237,15 +323,18 @@ class RPCServer(object):
         
     @staticmethod
     def _read_one(socket):
-        name, req_id, action, return_type, ser_type, opts = socket.recv_multipart()
+        # Frames after opts hold ndarray data; they are received without copy
+        # and the arrays decoded from them point directly into zmq memory.
+        name, req_id, action, return_type, ser_type, opts, *frames = socket.recv_multipart(copy=False)
         msg = {
-            'req_id': int(req_id), 
-            'action': action.decode(), 
-            'return_type': return_type.decode(),
-            'ser_type': ser_type.decode(),
-            'opts': opts,
+            'req_id': int(req_id.bytes), 
+            'action': action.bytes.decode(), 
+            'return_type': return_type.bytes.decode(),
+            'ser_type': ser_type.bytes.decode(),
+            'opts': opts.bytes,
+            'frames': frames,
         }
-        return name, msg
+        return name.bytes, msg
         
     def _read_and_process_one(self):
         """Read one message from the rpc socket and invoke the requested
@@ -259,40 +348,175 @@ class RPCServer(object):
         
     def _process_one(self, caller, msg):
         """
-        Invoke the requested action.
+        Invoke the requested action, or queue it for the worker pool.
         
         This method sends back to the client either the return value or an
         error message.
         """
+        # remember this caller so we can deliver a disconnect message later
+        self._clients[caller] = msg['ser_type']
+        
+        if self._pool is not None:
+            key = self._dispatch_key(caller, msg)
+            if key is not None:
+                self._submit(key, caller, msg)
+                return
+            if msg['action'] == 'close':
+                self._drain_workers()
+        self._process_request(caller, msg)
+    
+    def _process_request(self, caller, msg, key=None):
+        # Decode the request, invoke the action and send back the result.
+        # *key* is the dispatch key of the request when it runs in a worker.
         ser_type = msg['ser_type']
         action = msg['action']
         req_id = msg['req_id']
         return_type = msg.get('return_type', 'auto')
         
-        # remember this caller so we can deliver a disconnect message later
-        self._clients[caller] = ser_type
-        
-        # Attempt to read message and invoke requested action
+        # Attempt to read message
         try:
             try:
                 serializer = self._serializers[ser_type]
             except KeyError:
                 raise ValueError("Unsupported serializer '%s'" % ser_type)
             opts = msg.pop('opts', None)
+            frames = msg.pop('frames', [])
             
             logging.debug("RPC recv '%s' from %s [req_id=%s]", action, caller.decode(), req_id)
             logging.debug("    => %s", msg)
             if opts == b'':
                 opts = None
             else:
-                opts = serializer.loads(opts)
+                opts = serializer.loads(opts, frames)
             logging.debug("    => opts: %s", opts)
-            
+        except:
+            self._send_return(caller, req_id, action, None, sys.exc_info())
+            return
+        
+        if action == 'batch':
+            # several requests sent in one message by RPCClient.batch();
+            # process them in order, each one gets its own response. The
+            # opts of each request are sent in one frame, followed by the
+            # frames of its arrays.
+            for req in opts['requests']:
+                nframes = req.pop('frames')
+                req['ser_type'] = ser_type
+                req['opts'] = bytes(frames[0])
+                req['frames'] = frames[1:nframes + 1]
+                frames = frames[nframes + 1:]
+                self._process_request(caller, req, self._dispatch_key(caller, req))
+            return
+        
+        lock = self._object_lock(key)
+        if lock is None:
+            self._invoke(caller, req_id, action, return_type, opts)
+        else:
+            with lock:
+                self._invoke(caller, req_id, action, return_type, opts)
+    
+    def _object_lock(self, key):
+        # Return the lock of the object addressed by a request, or None if
+        # the request is not processed by a worker or not addressed to an
+        # object.
+        if self._pool is None or key is None or isinstance(key, tuple):
+            return None
+        with self._queues_lock:
+            lock = self._obj_locks.get(key, None)
+            if lock is None:
+                lock = self._obj_locks[key] = threading.RLock()
+            return lock
+    
+    def _dispatch_key(self, caller, msg):
+        # Return the key of the worker queue that must process this request,
+        # or None if the request is processed in the server thread. Requests
+        # to a proxied object are queued by object ID; the message is decoded
+        # without unwrapping proxies, which must be done by the worker.
+        action = msg['action']
+        if action in ('batch', 'import', 'get_item', 'set_item'):
+            return ('client', caller)
+        if action not in ('call_obj', 'get_obj', 'delete'):
+            return None
+        try:
+            opts = self._serializers[msg['ser_type']].loads_raw(msg['opts'])
+            if action == 'delete':
+                return opts['obj_id']
+            return opts['obj']['obj_id']
+        except Exception:
+            # let _process_request report the error
+            return None
+    
+    def _submit(self, key, caller, msg):
+        # Queue a request; start a worker for its queue if none is running.
+        with self._queues_lock:
+            queue = self._queues.get(key, None)
+            if queue is None:
+                self._queues[key] = deque([(caller, msg)])
+                self._pool.submit(self._run_queue, key)
+            else:
+                queue.append((caller, msg))
+    
+    def _run_queue(self, key):
+        # Process the requests of one queue in order, in a worker thread.
+        RPCServer._worker_local.server = self
+        while True:
+            with self._queues_lock:
+                queue = self._queues[key]
+                if len(queue) == 0:
+                    del self._queues[key]
+                    return
+                caller, msg = queue.popleft()
+            try:
+                self._process_request(caller, msg, key)
+            except Exception:
+                logger.exception("RPC worker failed to process request")
+    
+    def _drain_workers(self):
+        # Wait for all queued requests to be processed and forward their
+        # results, then stop the worker pool.
+        while True:
+            with self._queues_lock:
+                busy = len(self._queues) > 0
+            if self._return_socket.poll(10 if busy else 0):
+                self._forward_returns()
+            elif not busy:
+                break
+        self._pool.shutdown(wait=True)
+    
+    def _forward_returns(self):
+        # Send the results queued by worker threads to the clients.
+        while True:
+            try:
+                frames = self._return_socket.recv_multipart(zmq.NOBLOCK, copy=False)
+            except zmq.Again:
+                break
+            self._socket.send_multipart(frames, copy=False)
+    
+    def _send_frames(self, frames):
+        # Send a message to a client from the server thread or a worker thread.
+        if self._pool is None or threading.current_thread().ident == self._thread:
+            self._socket.send_multipart(frames)
+            return
+        sock = getattr(self._local, 'socket', None)
+        if sock is None:
+            sock = zmq.Context.instance().socket(zmq.PUSH)
+            sock.linger = 1000
+            sock.connect(self._return_addr)
+            self._local.socket = sock
+            with self._queues_lock:
+                self._worker_sockets.append(sock)
+        sock.send_multipart(frames)
+    
+    def _invoke(self, caller, req_id, action, return_type, opts):
+        # Invoke the requested action and send back the result
+        try:
             result = self.process_action(action, opts, return_type, caller)
             exc = None
         except:
+            result = None
             exc = sys.exc_info()
-
+        self._send_return(caller, req_id, action, result, exc, return_type)
+    
+    def _send_return(self, caller, req_id, action, result, exc, return_type='auto'):
         # Send result or error back to client
         if req_id >= 0:
             if exc is None:
@@ -336,9 +560,12 @@ class RPCServer(object):
         # Select the correct serializer for this client
         serializer = self._serializers[self._clients[caller]]
         
-        # Serialize and return the result
-        data = serializer.dumps(result)
-        self._socket.send_multipart([caller, data])
+        # Serialize and return the result; ndarray data goes in extra frames.
+        # These are copied once because the result may be a view of data that
+        # is modified after this call returns.
+        buffers = []
+        data = serializer.dumps(result, buffers)
+        self._send_frames([caller, data] + buffers)
 
     def process_action(self, action, opts, return_type, caller):
         """Invoke a single action and return the result.
@@ -360,11 +587,16 @@ class RPCServer(object):
         elif action == 'get_obj':
             result = opts['obj']
         elif action == 'delete':
-            proxy_ref = self._proxy_refs[opts['obj_id']]
-            proxy_ref[1].remove(opts['ref_id'])
-            if len(proxy_ref[1]) == 0:
-                del self._proxy_refs[opts['obj_id']]
-                del self._proxy_id_map[id(proxy_ref[0])]
+            with self._proxy_lock:
+                proxy_ref = self._proxy_refs[opts['obj_id']]
+                proxy_ref[1].remove(opts['ref_id'])
+                if len(proxy_ref[1]) == 0:
+                    del self._proxy_refs[opts['obj_id']]
+                    del self._proxy_id_map[id(proxy_ref[0])]
+                    if self._pool is not None:
+                        # object IDs are not reused
+                        with self._queues_lock:
+                            self._obj_locks.pop(opts['obj_id'], None)
             result = None
         elif action =='get_item':
             result = self[opts['name']]
@@ -432,6 +664,10 @@ class RPCServer(object):
 
     def _final_close(self):
         # Called after the server has closed and sent its disconnect messages.
+        if self._pool is not None:
+            for sock in self._worker_sockets:
+                sock.close()
+            self._return_socket.close()
         self._socket.close()
 
     def running(self):
@@ -447,9 +683,22 @@ class RPCServer(object):
 
         logging.info("RPC start server: %s@%s", name, self.address.decode())
         RPCServer.register_server(self)
+        if self._pool is None:
+            while self.running():
+                name, msg = self._read_one(self._socket)
+                self._process_one(name, msg)
+            return
+        
+        poller = zmq.Poller()
+        poller.register(self._socket, zmq.POLLIN)
+        poller.register(self._return_socket, zmq.POLLIN)
         while self.running():
-            name, msg = self._read_one(self._socket)
-            self._process_one(name, msg)
+            socks = dict(poller.poll())
+            if self._return_socket in socks:
+                self._forward_returns()
+            if self._socket in socks:
+                name, msg = self._read_one(self._socket)
+                self._process_one(name, msg)
             
     def run_lazy(self):
         """Register this server as being active for the current thread, but do
@@ -463,6 +712,8 @@ class RPCServer(object):
         """
         name = ('%s.%s.%s' % (log.get_host_name(), log.get_process_name(), 
                               log.get_thread_name()))
+        if self._pool is not None:
+            raise RuntimeError("RPCServer with workers must be run with run_forever().")
         logging.info("RPC lazy-start server: %s@%s", name, self.address.decode())
         RPCServer.register_server(self)
 
@@ -598,6 +849,9 @@ class QtPollThread(QtCore.QThread):
 
         self.new_request.connect(server._process_one)
         
+        # serializers used by this thread to answer pings
+        self.serializers = {ser.type: ser(server=server) for ser in all_serializers.values()}
+        
     def run(self):
         poller = zmq.Poller()
         poller.register(self.rpc_socket, zmq.POLLIN)
@@ -610,15 +864,23 @@ class QtPollThread(QtCore.QThread):
             socks = dict(poller.poll(timeout=100))
             
             if self.return_socket in socks:
-                name, data = self.return_socket.recv_multipart()
-                #logger.debug("poller return %s %s", name, data)
-                if name == 'STOP':
+                frames = self.return_socket.recv_multipart(copy=False)
+                #logger.debug("poller return %s", frames)
+                if frames[0].bytes == b'STOP':
                     break
-                self.rpc_socket.send_multipart([name, data])
+                self.rpc_socket.send_multipart(frames, copy=False)
                 
             if self.rpc_socket in socks:
                 name, msg = RPCServer._read_one(self.rpc_socket)
                 #logger.debug("poller recv %s %s", name, msg)
+                if msg['action'] == 'ping' and msg['req_id'] >= 0 and msg['ser_type'] in self.serializers:
+                    # answer liveness checks here so that they are not delayed
+                    # by slow requests running in the Qt thread
+                    ser = self.serializers[msg['ser_type']]
+                    data = ser.dumps({'action': 'return', 'req_id': msg['req_id'],
+                                      'rval': 'pong', 'error': None})
+                    self.rpc_socket.send_multipart([name, data])
+                    continue
                 self.new_request.emit(name, msg)
 
         #logger.error("poller exit.")
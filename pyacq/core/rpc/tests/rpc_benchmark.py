@@ -28,6 +28,19 @@ def test_async_poingrate(cli, dur=2.0, buffer=500):
         
     print("Async ping rate: %0.0f/sec" % (count/dur))
 
+
+def test_batch_poingrate(cli, dur=2.0, batch=100):
+    start = time.time()
+    count = 0
+    while time.time() < start + dur:
+        with cli.batch() as futs:
+            for i in range(batch):
+                cli.send('ping')
+        assert all(fut.result() == 'pong' for fut in futs)
+        count += batch
+        
+    print("Batch ping rate: %0.0f/sec" % (count/dur))
+
     
     
 
@@ -40,6 +53,7 @@ thread.start()
 cli = rpc.RPCClient(server.address)
 test_poingrate(cli)
 test_async_poingrate(cli)
+test_batch_poingrate(cli)
 
 cli.close_server()
 
@@ -53,6 +67,7 @@ thread.start()
 cli = rpc.RPCClient(server.address)
 test_poingrate(cli)
 test_async_poingrate(cli)
+test_batch_poingrate(cli)
 
 cli.close_server()
 
@@ -62,6 +77,7 @@ print("=========== TCP to spawned process ============")
 proc = rpc.ProcessSpawner()
 test_poingrate(proc.client)
 test_async_poingrate(proc.client)
+test_batch_poingrate(proc.client)
 
 
 # process
@@ -69,4 +85,5 @@ print("=========== TCP to spawned Qt process ============")
 proc = rpc.ProcessSpawner(qt=True)
 test_poingrate(proc.client)
 test_async_poingrate(proc.client)
+test_batch_poingrate(proc.client)
 
@@ -60,6 +60,10 @@ def test_rpc():
     
         def type(self, x):
             return type(x).__name__
+        
+        def set_name(self, name):
+            self.name = name
+            RPCServer.get_server().invalidate(self)
     
     
     server1 = RPCServer()
@@ -113,6 +117,17 @@ def test_rpc():
     assert not fut.done()
     assert fut.result() is None
 
+    logger.info("-- Test value cache --")
+    name = obj._deferred_attr('name', cache='frozen')
+    assert name._get_value() == 'obj1'
+    server1['my_object'].name = 'renamed'  # changed without invalidation
+    assert name._get_value() == 'obj1'
+    name_ttl = obj._deferred_attr('name', cache=0.1)
+    time.sleep(0.15)
+    assert name_ttl._get_value() == 'renamed'
+    obj.set_name('obj1')  # invalidates the cache
+    assert name._get_value() == 'obj1'
+
     logger.info("-- Test no return --")
     assert obj.add(1, 2, _sync='off') is None
 
@@ -195,6 +210,38 @@ def test_rpc():
     assert b.result() == 7
     assert a.result() == 3
 
+    logger.info("-- Test batch --")
+    add = obj.add
+    with client.batch() as futures:
+        for i in range(100):
+            add(i, 1)
+        add(1, 'x')  # raises remotely
+        add(1, 2, _sync='off')
+    assert len(futures) == 101
+    assert [fut.result() for fut in futures[:100]] == list(range(1, 101))
+    try:
+        futures[100].result()
+        assert False, "Should have raised RemoteCallException."
+    except RemoteCallException:
+        pass
+    
+    # requests are not sent if the block raises
+    try:
+        with client.batch() as futures:
+            add(1, 2)
+            raise ValueError()
+    except ValueError:
+        pass
+    assert futures[0].cancelled()
+    
+    # arguments are serialized when the request is made, not when sent
+    buf = np.empty(4)
+    with client.batch() as futures:
+        for i in range(3):
+            buf[:] = i
+            add(buf, 0)
+    assert [fut.result().tolist() for fut in futures] == [[i] * 4 for i in range(3)]
+
     
     logger.info("-- Test transfer --")
     arr = np.ones(10, dtype='float32')
@@ -203,6 +250,16 @@ def test_rpc():
     print(arr_prox, arr_prox.shape)
     assert arr_prox.shape._get_value() == [10]
 
+    logger.info("-- Test large and structured arrays --")
+    rnp = client._import('numpy')
+    arr = np.random.normal(size=(1000, 256)).astype('float32')
+    arr2 = rnp.ascontiguousarray(arr[:, ::2])
+    assert arr2.dtype == arr.dtype
+    assert np.all(arr2 == arr[:, ::2])
+    sarr = np.zeros(100, dtype=[('index', 'int64'), ('pos', 'float32', (2,))])
+    sarr['index'] = np.arange(100)
+    assert np.all(rnp.copy(sarr) == sarr)
+
 
     logger.info("-- Test import --")
     import os.path as osp
@@ -388,9 +445,57 @@ def test_disconnect():
     server_proc.kill()
 
 
+def test_rpc_workers():
+    proc = ProcessSpawner(workers=3)
+    cli = proc.client
+    
+    # a slow call does not delay pings or calls to other objects
+    rtime = cli._import('time')
+    ros = cli._import('os')
+    fut = rtime.sleep(0.5, _sync='async')
+    start = time.perf_counter()
+    assert cli.ping() == 'pong'
+    assert ros.getpid() == proc.proc.pid
+    assert time.perf_counter() - start < 0.3
+    fut.result()
+    
+    # calls to the same object are executed one at a time
+    start = time.perf_counter()
+    futs = [rtime.sleep(0.2, _sync='async') for i in range(2)]
+    [f.result() for f in futs]
+    assert time.perf_counter() - start >= 0.4
+    
+    # ... and in order
+    lst = cli._import('builtins').list(_return_type='proxy')
+    for i in range(20):
+        lst.append(i, _sync='off')
+    assert lst._get_value() == list(range(20))
+    
+    # a proxy is released after the calls queued before
+    ev = cli._import('threading').Event(_return_type='proxy')
+    futs = [ev.wait(0.1, _sync='async') for i in range(2)]
+    ev._delete()
+    assert [f.result() for f in futs] == [False, False]
+    
+    # a batched call and a plain call to the same object do not overlap
+    ev = cli._import('threading').Event(_return_type='proxy')
+    start = time.perf_counter()
+    fut = ev.wait(0.5, _sync='async')
+    with cli.batch() as futs:
+        ev.wait(0.5)
+    assert [fut.result(), futs[0].result()] == [False, False]
+    assert time.perf_counter() - start >= 1.0
+    
+    # code running in a worker thread can find its server
+    assert cli._import('pyacq.core.rpc').RPCServer.current() is not None
+    
+    cli.close_server()
+    proc.wait()
+
 
 if __name__ == '__main__':
     #~ test_rpc()
     test_qt_rpc()
     #~ test_disconnect()
+    #~ test_rpc_workers()
     
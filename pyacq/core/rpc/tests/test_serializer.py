@@ -6,7 +6,8 @@ import numpy as np
 import datetime
 import pytest
 
-from pyacq.core.rpc.serializer import JsonSerializer, MsgpackSerializer, HAVE_MSGPACK
+from pyacq.core.rpc.serializer import (JsonSerializer, MsgpackSerializer, HAVE_MSGPACK,
+                                       encode_dtype, decode_dtype)
 from pyacq.core.rpc import ObjectProxy, ProcessSpawner
 
 proc = ProcessSpawner()
@@ -34,8 +35,16 @@ def test_json():
     check_serializer(JsonSerializer())
 
 def check_serializer(serializer):
-    s = serializer.dumps(test_data)
-    d2 = serializer.loads(s)
+    check_serializer_frames(serializer, None)
+    check_serializer_frames(serializer, [])
+
+def check_serializer_frames(serializer, buffers):
+    s = serializer.dumps(test_data, buffers)
+    if buffers is not None:
+        # ndarray data is sent out-of-band
+        assert len(buffers) == 1
+        assert test_data['ndarray'].tobytes() not in s
+    d2 = serializer.loads(s, buffers)
     for k in test_data:
         v1 = test_data[k]
         v2 = d2[k]
@@ -46,6 +55,29 @@ def check_serializer(serializer):
             assert v1 == v2
 
 
+def test_dtype_codec():
+    dtypes = ['float32', '>i2', 'datetime64[ms]', ('float64', (2, 3)),
+              [('index', 'int64'), ('label', 'S12'), ('pos', 'float32', (2,)),
+               ('sub', [('a', 'u1'), ('b', '<f8')])],
+              np.dtype({'names': ['x', 'y'], 'formats': ['i4', 'f8'], 'offsets': [0, 8], 'itemsize': 24}),
+              ]
+    for dt in dtypes:
+        dt = np.dtype(dt)
+        assert decode_dtype(encode_dtype(dt)) == dt
+    
+    # structured arrays go through both serializers
+    dt = np.dtype(dtypes[4])
+    arr = np.zeros(5, dtype=dt)
+    arr['index'] = np.arange(5)
+    arr['sub']['b'] = 1.5
+    for serializer in (JsonSerializer(), MsgpackSerializer()):
+        for buffers in (None, []):
+            arr2 = serializer.loads(serializer.dumps(arr, buffers), buffers)
+            assert arr2.dtype == dt
+            assert np.all(arr2 == arr)
+
+
 if __name__ == '__main__':
     test_msgpack()
     test_json()
+    test_dtype_codec()
@@ -6,8 +6,9 @@ from .stream import InputStream, OutputStream
 from .ringbuffer import RingBuffer
 from .sharedarray import SharedArray
 from .streamhelpers import all_transfermodes, register_transfermode
-from .compression import compression_methods
+from .compression import compression_methods, register_compression
 
 # import transfer modes so they register their helper classes
 from . import plaindatastream
 from . import sharedmemstream
+from . import localstream
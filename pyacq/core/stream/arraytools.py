@@ -2,6 +2,7 @@
 # Copyright (c) 2016, French National Center for Scientific Research (CNRS)
 # Distributed under the (new) BSD License. See LICENSE for more info.
 
+import functools
 import numpy as np
 from pyacq.core.rpc.proxy import ObjectProxy
 
@@ -67,16 +68,42 @@ def decompose_array(data):
     
     If the input array is discontiguous, it will be copied using axis_order_copy().
     """
-    if not is_contiguous(data):
+    if data.flags['C_CONTIGUOUS']:
+        # common case: nothing to analyze
+        return data, 0, data.strides
+    
+    contiguous, order, ind = _layout_plan(data.shape, data.strides, data.itemsize)
+    if not contiguous:
         # socket.send requires a contiguous buffer
         data = axis_order_copy(data)
-        
-    buf = normalized_array(data)
+        contiguous, order, ind = _layout_plan(data.shape, data.strides, data.itemsize)
+    
+    buf = data.transpose(order)[ind]
     offset = data.__array_interface__['data'][0] - buf.__array_interface__['data'][0]
     
     return buf, offset, data.strides
 
 
+@functools.lru_cache(maxsize=256)
+def _layout_plan(shape, strides, itemsize):
+    """Return (contiguous, order, ind) for an array layout, where *contiguous*
+    is the result of is_contiguous() and *order*, *ind* are the transposition
+    and reversal used by normalized_array().
+    
+    The result only depends on shape and strides, so it is memoized for
+    streams that send chunks with a fixed layout.
+    """
+    order = np.argsort(np.abs(strides))[::-1]
+    nstrides = np.array(strides)[order]
+    nshape = np.array(shape)[order]
+    contiguous = abs(nstrides[-1]) == itemsize
+    for i in range(len(shape)-1):
+        if abs(nstrides[i]) != abs(nstrides[i+1] * nshape[i+1]):
+            contiguous = False
+    ind = tuple((slice(None, None, -1) if nstrides[i] < 0 else slice(None) for i in range(len(shape))))
+    return contiguous, tuple(int(i) for i in order), ind
+
+
 def normalized_array(data):
     """Return *data* with axis order and direction normalized.
     
@@ -90,6 +117,53 @@ def normalized_array(data):
     return data[ind]
 
 
+def convert_into(dest, data, scale=None, offset=None):
+    """Write ``offset + scale * data`` into *dest*.
+    
+    The values are computed with the dtype given by numpy's type promotion
+    of *data*, *scale* and *offset*, then cast once to the dtype of *dest*
+    (unsafe casting) and written with its memory layout, so a conversion of
+    dtype, scaling and axis order costs a single pass over the data. *scale*
+    and *offset* may be None, scalars or arrays that broadcast against *dest*
+    (for example one value per channel).
+    
+    No intermediate array is allocated, except when both *scale* and
+    *offset* are given and *dest* has another dtype than the computation
+    (for example an integer *dest*): rounding ``scale * data`` to that dtype
+    before adding *offset* would round twice.
+    """
+    if scale is None and offset is None:
+        np.copyto(dest, data, casting='unsafe')
+    elif offset is None:
+        np.multiply(data, scale, out=dest, casting='unsafe')
+    elif scale is None:
+        np.add(data, offset, out=dest, casting='unsafe')
+    else:
+        dtype = np.result_type(data, scale, offset)
+        if dest.dtype == dtype:
+            np.multiply(data, scale, out=dest)
+            np.add(dest, offset, out=dest)
+        else:
+            np.add(np.multiply(data, scale, dtype=dtype), offset, out=dest, casting='unsafe')
+
+
+def channels_to_slice(channels):
+    """Return a slice selecting the same elements as the list of *channels*,
+    or None if they are not increasing and regularly spaced.
+    
+    Indexing an array with the slice returns a view instead of a copy.
+    """
+    channels = [int(c) for c in channels]
+    if len(channels) == 0 or min(channels) < 0:
+        return None
+    if len(channels) == 1:
+        return slice(channels[0], channels[0] + 1)
+    step = channels[1] - channels[0]
+    if step <= 0 or any(b - a != step for a, b in zip(channels[:-1], channels[1:])):
+        return None
+    return slice(channels[0], channels[-1] + 1, step)
+
+
 def fix_struct_dtype(dt):
     """
       fix when due to serialization dtype 
@@ -1,43 +1,381 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+
+import struct
+import threading
+import numpy as np
+
+#: list of all usable compression methods (names accepted by the
+#: ``compression`` stream parameter)
 compression_methods = ['']
 
+#: {name: (compress_func, decompress_func)} for all registered methods
+all_compressions = {}
 
-_blosc_methods = ['blosc-blosclz', 'blosc-lz4']
-try:
-    import blosc
-    HAVE_BLOSC = True
-    compression_methods.extend(_blosc_methods)
-except ImportError:
-    HAVE_BLOSC = False
+# methods that would be available if an optional package were installed
+_optional_methods = {}
 
 
-def compress(data, method, *args, **kwds):
+def register_compression(name, compress_func, decompress_func):
+    """Register a compression method that can be used by the ``compression``
+    parameter of plaindata streams.
+
+    Parameters
+    ----------
+    name : str
+        Name of the method.
+    compress_func : callable
+        ``compress_func(data, itemsize, **opts)`` must return a bytes-like
+        object. *data* is a 1D uint8 array, *itemsize* is the size of one
+        element of the original array and *opts* are the
+        ``compression_opts`` stream parameters plus ``rowsize``, the number
+        of items in one row (usually one time sample) of the data as laid out
+        in memory.
+    decompress_func : callable
+        ``decompress_func(data, itemsize, out=None, **opts)`` must return a
+        bytes-like object or, if *out* is given, write into this C-contiguous
+        array and return it. *opts* are the ``compression_opts`` stream
+        parameters.
+
+    The receiving side of a stream must have registered the same method.
+    """
+    all_compressions[name] = (compress_func, decompress_func)
+    if name not in compression_methods:
+        compression_methods.append(name)
+
+
+def compress(data, method, itemsize=1, **opts):
     if method == '':
         return data
     _check_method(method)
-    
-    if method.startswith('blosc-'):
-        kwds['cname'] = method[6:]
-        data = blosc.compress(data, *args, **kwds)
-    else:
-        raise ValueError("Unknown compression method '%s'" % method)
-    
-    return data
+    return all_compressions[method][0](data, itemsize, **opts)
+
+
+def decompress(data, method, itemsize=1, out=None, **opts):
+    """Decompress *data*.
 
+    If *out* is given, it must be a C-contiguous array large enough to hold
+    the decompressed data, which is then written into it directly.
+    """
+    if out is not None and not out.flags['C_CONTIGUOUS']:
+        raise ValueError("Output array for decompression must be C-contiguous")
 
-def decompress(data, method, *args, **kwds):
     if method == '':
+        if out is not None:
+            _copy_to(data, out)
+            return out
         return data
     _check_method(method)
-    
-    if method.startswith('blosc-'):
-        return blosc.decompress(data)
-    else:
-        raise ValueError("Unknown compression method '%s'" % method)
+    return all_compressions[method][1](data, itemsize, out=out, **opts)
+
+
+def check_compression(method):
+    """Raise ValueError if *method* cannot be used in this process.
+    """
+    if method != '':
+        _check_method(method)
 
 
 def _check_method(method):
-    if method not in compression_methods:
-        if method in _blosc_methods:
-            raise ValueError("Cannot use %s compression; blosc package is not importable." % method)
+    if method not in all_compressions:
+        if method in _optional_methods:
+            raise ValueError("Cannot use %s compression; %s package is not importable." %
+                             (method, _optional_methods[method]))
         else:
             raise ValueError('Unknown compression method "%s"' % method)
+
+
+def _copy_to(data, out):
+    out.reshape(-1).view('uint8')[:] = np.frombuffer(data, dtype='uint8')
+
+
+def byte_shuffle(data, itemsize):
+    """Group the bytes of *data* by significance: first the first byte of
+    every item, then the second byte, etc.
+
+    For slowly varying integer signals this puts the (mostly constant) high
+    bytes together, which makes the data much more compressible.
+    """
+    data = np.frombuffer(data, dtype='uint8')
+    if itemsize == 1:
+        return data
+    return data.reshape(-1, itemsize).T.copy().reshape(-1)
+
+
+def byte_unshuffle(data, itemsize, out=None):
+    """Inverse of :func:`byte_shuffle`.
+    """
+    data = np.frombuffer(data, dtype='uint8')
+    if out is None:
+        out = np.empty(data.size, dtype='uint8')
+    flat = out.reshape(-1).view('uint8')
+    if itemsize == 1:
+        flat[:] = data
+    else:
+        flat.reshape(-1, itemsize)[:] = data.reshape(itemsize, -1).T
+    return out
+
+
+def _with_shuffle(compress_func, decompress_func):
+    # wrap a codec with byte_shuffle / byte_unshuffle
+    def shuffle_compress(data, itemsize, **opts):
+        return compress_func(byte_shuffle(data, itemsize), 1, **opts)
+
+    def shuffle_decompress(data, itemsize, out=None, **opts):
+        return byte_unshuffle(decompress_func(data, 1, **opts), itemsize, out=out)
+
+    return shuffle_compress, shuffle_decompress
+
+
+# blosc
+_blosc_methods = ['blosc-blosclz', 'blosc-lz4', 'blosc-lz4hc', 'blosc-zstd']
+try:
+    import blosc
+    HAVE_BLOSC = True
+except ImportError:
+    HAVE_BLOSC = False
+
+
+def _blosc_compress(cname):
+    def compress_func(data, itemsize, clevel=9, shuffle=None, nthreads=None, **opts):
+        if nthreads is not None:
+            # note: this is a global blosc setting
+            blosc.set_nthreads(nthreads)
+        if shuffle is None:
+            shuffle = blosc.SHUFFLE
+        return blosc.compress(data, itemsize, clevel=clevel, shuffle=shuffle, cname=cname)
+    return compress_func
+
+
+def _blosc_decompress(data, itemsize, out=None, nthreads=None, **opts):
+    if nthreads is not None:
+        blosc.set_nthreads(nthreads)
+    if out is not None:
+        blosc.decompress_ptr(data, out.__array_interface__['data'][0])
+        return out
+    return blosc.decompress(data)
+
+
+for _name in _blosc_methods:
+    if HAVE_BLOSC and _name[6:] in blosc.cnames:
+        register_compression(_name, _blosc_compress(_name[6:]), _blosc_decompress)
+    else:
+        _optional_methods[_name] = 'blosc'
+
+
+# zstandard
+try:
+    import zstandard
+    HAVE_ZSTD = True
+except ImportError:
+    HAVE_ZSTD = False
+
+# ZstdCompressor objects are reused, but must not be used by several threads
+# at once; keep one {(level, nthreads): compressor} dict per thread.
+_zstd_local = threading.local()
+
+
+def _zstd_compress(data, itemsize, level=3, nthreads=0, **opts):
+    compressors = getattr(_zstd_local, 'compressors', None)
+    if compressors is None:
+        compressors = _zstd_local.compressors = {}
+    key = (level, nthreads)
+    if key not in compressors:
+        compressors[key] = zstandard.ZstdCompressor(level=level, threads=nthreads)
+    return compressors[key].compress(data)
+
+
+def _zstd_decompress(data, itemsize, out=None, **opts):
+    data = zstandard.ZstdDecompressor().decompress(data)
+    if out is not None:
+        _copy_to(data, out)
+        return out
+    return data
+
+
+# lz4 frame
+try:
+    import lz4.frame
+    HAVE_LZ4 = True
+except ImportError:
+    HAVE_LZ4 = False
+
+
+def _lz4_compress(data, itemsize, level=0, **opts):
+    return lz4.frame.compress(data, compression_level=level)
+
+
+def _lz4_decompress(data, itemsize, out=None, **opts):
+    data = lz4.frame.decompress(data)
+    if out is not None:
+        _copy_to(data, out)
+        return out
+    return data
+
+
+for _name, _have, _funcs, _package in [('zstd', HAVE_ZSTD, (_zstd_compress, _zstd_decompress), 'zstandard'),
+                                       ('lz4', HAVE_LZ4, (_lz4_compress, _lz4_decompress), 'lz4')]:
+    if _have:
+        register_compression(_name, *_funcs)
+        register_compression('shuffle-' + _name, *_with_shuffle(*_funcs))
+    else:
+        _optional_methods[_name] = _package
+        _optional_methods['shuffle-' + _name] = _package
+
+
+# Delta coding for integer signals.
+#
+# Each row (one sample of all channels, as laid out in memory) is replaced by
+# its difference with the previous row, the differences are zigzag-mapped to
+# small unsigned integers and then bit-packed per column (or passed to a
+# generic codec). All operations are vectorized over (rows, columns).
+# Every chunk is self-contained (its first row is coded against zero) so
+# that chunks dropped by the stream or late-joining receivers do not break
+# decoding.
+
+_delta_header = struct.Struct('!QQB')  # nrows, rowsize, flags
+_DELTA_RAW = 1  # data could not be delta coded and is stored as is
+
+
+def delta_encode(data, itemsize, rowsize):
+    """Return the zigzag-coded row differences of *data* as a 2D unsigned
+    array, or None if *data* cannot be viewed as rows of integers.
+    """
+    if itemsize not in (1, 2, 4, 8) or rowsize == 0:
+        return None
+    x = np.frombuffer(data, dtype='i%d' % itemsize)
+    if x.size % rowsize != 0:
+        return None
+    x = x.reshape(-1, rowsize)
+    d = np.empty_like(x)
+    d[:1] = x[:1]
+    # integer overflow wraps, which is exactly what is needed here
+    np.subtract(x[1:], x[:-1], out=d[1:])
+    z = (d << 1) ^ (d >> (itemsize * 8 - 1))
+    return z.view('u%d' % itemsize)
+
+
+def delta_decode(z, itemsize, out=None):
+    """Inverse of :func:`delta_encode`; returns a 2D signed array (or *out*).
+    """
+    sdtype = np.dtype('i%d' % itemsize)
+    d = (z >> 1).view(sdtype) ^ -(z & 1).view(sdtype)
+    if out is None:
+        return np.cumsum(d, axis=0, dtype=sdtype)
+    np.cumsum(d, axis=0, dtype=sdtype, out=out.reshape(-1).view(sdtype).reshape(d.shape))
+    return out
+
+
+# number of rows that bit_pack() and bit_unpack() process at once. It bounds
+# their temporary arrays and is a multiple of 8, so that each block of rows
+# ends on a byte boundary.
+_BITPACK_ROWS = 4096
+
+
+def bit_pack(z):
+    """Pack each column of the unsigned 2D array *z* with the minimum number
+    of bits required by that column. The per-column bit widths are
+    written first, followed by the columns of each width.
+    
+    Return None if packing would not make the data smaller.
+    """
+    nrows, ncols = z.shape
+    widths = np.array([int(v).bit_length() for v in z.max(axis=0)], dtype='uint8') \
+        if nrows > 0 else np.zeros(ncols, dtype='uint8')
+    groups = [(b, widths == b) for b in np.unique(widths) if b > 0]
+    size = ncols + sum((nrows * int(mask.sum()) * int(b) + 7) // 8 for b, mask in groups)
+    if size >= z.nbytes:
+        return None
+    
+    # bits are taken from the little-endian bytes of each value
+    z = z.astype(z.dtype.newbyteorder('<'), copy=False)
+    parts = [widths.tobytes()]
+    for b, mask in groups:
+        cols = z[:, mask]
+        for i in range(0, nrows, _BITPACK_ROWS):
+            block = cols[i:i+_BITPACK_ROWS, :, None].view('uint8')
+            bits = np.unpackbits(block, axis=2, bitorder='little')
+            parts.append(np.packbits(bits[..., :b], axis=None).tobytes())
+    return b''.join(parts)
+
+
+def bit_unpack(data, nrows, rowsize, dtype):
+    """Inverse of :func:`bit_pack`.
+    """
+    data = np.frombuffer(data, dtype='uint8')
+    widths = data[:rowsize]
+    pos = rowsize
+    z = np.zeros((nrows, rowsize), dtype=dtype)
+    ledtype = z.dtype.newbyteorder('<')
+    nbits = z.dtype.itemsize * 8
+    for b in np.unique(widths):
+        if b == 0:
+            continue
+        mask = widths == b
+        ncols = int(mask.sum())
+        b = int(b)
+        cols = np.empty((nrows, ncols), dtype=ledtype)
+        for i in range(0, nrows, _BITPACK_ROWS):
+            n = min(_BITPACK_ROWS, nrows - i) * ncols * b
+            start = pos + i * ncols * b // 8
+            bits = np.zeros((n // (ncols * b), ncols, nbits), dtype='uint8')
+            bits[..., :b] = np.unpackbits(data[start:start+(n+7)//8], count=n).reshape(-1, ncols, b)
+            cols[i:i+_BITPACK_ROWS] = np.packbits(bits, axis=2, bitorder='little').view(ledtype)[..., 0]
+        pos += (nrows * ncols * b + 7) // 8
+        z[:, mask] = cols
+    return z
+
+
+def _delta_compress(entropy_compress):
+    def compress_func(data, itemsize, rowsize=1, **opts):
+        z = delta_encode(data, itemsize, rowsize)
+        packed = None if z is None else entropy_compress(z, itemsize, **opts)
+        if packed is None:
+            return _delta_header.pack(0, 0, _DELTA_RAW) + np.frombuffer(data, dtype='uint8').tobytes()
+        return _delta_header.pack(z.shape[0], rowsize, 0) + packed
+    return compress_func
+
+
+def _delta_decompress(entropy_decompress):
+    def decompress_func(data, itemsize, out=None, **opts):
+        data = memoryview(data)
+        nrows, rowsize, flags = _delta_header.unpack_from(data)
+        data = data[_delta_header.size:]
+        if flags & _DELTA_RAW:
+            return decompress(data, '', itemsize, out=out)
+        z = entropy_decompress(data, nrows, rowsize, itemsize, **opts)
+        res = delta_decode(z, itemsize, out=out)
+        return out if out is not None else res.reshape(-1).view('uint8')
+    return decompress_func
+
+
+def _bitpack_compress(z, itemsize, **opts):
+    return bit_pack(z)
+
+
+def _bitpack_decompress(data, nrows, rowsize, itemsize, **opts):
+    return bit_unpack(data, nrows, rowsize, 'u%d' % itemsize)
+
+
+register_compression('delta-bitpack', _delta_compress(_bitpack_compress),
+                     _delta_decompress(_bitpack_decompress))
+
+
+def _delta_with_codec(name):
+    # delta coding followed by a generic codec on the byte-shuffled differences
+    def entropy_compress(z, itemsize, **opts):
+        return compress(byte_shuffle(z, itemsize), name, 1, **opts)
+
+    def entropy_decompress(data, nrows, rowsize, itemsize, **opts):
+        z = byte_unshuffle(decompress(data, name, 1, **opts), itemsize)
+        return z.view('u%d' % itemsize).reshape(nrows, rowsize)
+
+    return _delta_compress(entropy_compress), _delta_decompress(entropy_decompress)
+
+
+for _name in ('zstd', 'lz4'):
+    if _name in all_compressions:
+        register_compression('delta-' + _name, *_delta_with_codec(_name))
+    else:
+        _optional_methods['delta-' + _name] = _optional_methods[_name]
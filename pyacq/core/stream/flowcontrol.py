@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+
+"""
+Lossless, flow-controlled stream sockets.
+
+By default streams use zmq.PUB/SUB sockets: a receiver that cannot keep up
+silently loses chunks once the high-water mark is reached. When an output is
+configured with ``flow_control``, a ROUTER/DEALER pair is used instead:
+
+* every message carries a sequence number; receivers count gaps,
+* each receiver grants *credit* (the number of chunks it accepts in flight)
+  and the sender never sends more than that,
+* chunks that cannot be sent yet are queued by the sender, and when the
+  queue of a receiver is full the *policy* decides what happens:
+  'block' (wait for credit), 'drop-oldest' (discard the oldest queued chunk)
+  or 'spill' (keep queuing chunks in a temporary file).
+
+The socket classes are drop-in replacements for the zmq sockets used by
+OutputStream / InputStream, so all transfer modes work unchanged. Like other
+zmq sockets they are not thread-safe: OutputStream serializes their use by
+:func:`OutputStream.send` and by the background thread that delivers queued
+chunks when receivers grant credit.
+"""
+
+import time
+import struct
+import logging
+import tempfile
+from collections import deque
+
+import zmq
+
+logger = logging.getLogger(__name__)
+
+_seq_struct = struct.Struct('!Q')
+
+default_flow_control = dict(
+    credit=32,
+    queue_size=256,
+    policy='block',
+    spill_dir=None,
+    timeout=None,
+)
+
+flow_control_policies = ['block', 'drop-oldest', 'spill']
+
+
+def make_flow_control(flow_control):
+    """Return a complete flow control options dict from the ``flow_control``
+    stream parameter (True or a dict of options).
+    """
+    opts = dict(default_flow_control)
+    if isinstance(flow_control, dict):
+        for k in flow_control:
+            if k not in opts:
+                raise ValueError("Unknown flow_control option '%s'" % k)
+        opts.update(flow_control)
+    if opts['policy'] not in flow_control_policies:
+        raise ValueError("flow_control policy must be one of %s" % flow_control_policies)
+    assert opts['credit'] > 0 and opts['queue_size'] > 0
+    return opts
+
+
+def _send_multipart(socket, parts, flags=0, copy=True):
+    # zmq.Socket.send_multipart calls self.send, which the classes below
+    # override; send the frames with the base class method instead.
+    for part in parts[:-1]:
+        zmq.Socket.send(socket, part, zmq.SNDMORE | flags, copy=copy)
+    zmq.Socket.send(socket, parts[-1], flags, copy=copy)
+
+
+def _recv_multipart(socket, flags=0, copy=True):
+    parts = [zmq.Socket.recv(socket, flags, copy=copy)]
+    while socket.getsockopt(zmq.RCVMORE):
+        parts.append(zmq.Socket.recv(socket, flags, copy=copy))
+    return parts
+
+
+def _snapshot(part):
+    # Return an immutable copy of a message part.
+    if isinstance(part, bytes):
+        return part
+    return bytes(memoryview(part))
+
+
+class _SpillFile:
+    """FIFO of multipart messages stored in a temporary file.
+    """
+    def __init__(self, spill_dir=None):
+        self.file = tempfile.TemporaryFile(prefix='pyacq_spill_', dir=spill_dir)
+        self.count = 0
+        self._read_pos = 0
+        self._write_pos = 0
+
+    def push(self, msg):
+        f = self.file
+        f.seek(self._write_pos)
+        f.write(struct.pack('!I', len(msg)))
+        for part in msg:
+            if isinstance(part, zmq.Frame):
+                part = part.buffer
+            part = memoryview(part)
+            f.write(struct.pack('!Q', part.nbytes))
+            f.write(part)
+        self._write_pos = f.tell()
+        self.count += 1
+
+    def pop(self):
+        f = self.file
+        f.seek(self._read_pos)
+        nparts, = struct.unpack('!I', f.read(4))
+        msg = []
+        for i in range(nparts):
+            n, = struct.unpack('!Q', f.read(8))
+            msg.append(f.read(n))
+        self._read_pos = f.tell()
+        self.count -= 1
+        if self.count == 0:
+            f.seek(0)
+            f.truncate()
+            self._read_pos = self._write_pos = 0
+        return msg
+
+    def close(self):
+        self.file.close()
+
+
+class _Peer:
+    def __init__(self, ident, credit):
+        self.ident = ident
+        self.credit = credit
+        self.queue = deque()
+        self.spill = None
+        self.dropped = 0
+        self.spilled = 0
+
+    def pending(self):
+        return len(self.queue) + (0 if self.spill is None else self.spill.count)
+
+
+class FlowControlSender(zmq.Socket):
+    """ROUTER socket that sends each message to all connected receivers,
+    respecting the credit they grant.
+
+    Use ``FlowControlSender(context, zmq.ROUTER)`` followed by
+    :func:`setup`.
+    """
+    opts = None
+    peers = None
+    seq = 0
+
+    def setup(self, opts):
+        self.opts = opts
+        self.peers = {}
+        self.seq = 0
+        self.router_mandatory = 1
+
+    def send(self, data, flags=0, copy=True, track=False):
+        return self.send_multipart([data], flags=flags, copy=copy, track=track)
+
+    def send_multipart(self, msg_parts, flags=0, copy=True, track=False):
+        self.process_control()
+        msg = (_seq_struct.pack(self.seq), copy, list(msg_parts))
+        self.seq += 1
+        queued = []
+        for peer in list(self.peers.values()):
+            self._enqueue(peer, msg)
+            self._flush(peer)
+            if len(peer.queue) > 0 and peer.queue[-1] is msg:
+                queued.append(peer)
+        if copy and len(queued) > 0:
+            # The message will be sent after this call returns, when the
+            # caller may have reused its buffers: queue a snapshot instead.
+            snapshot = (msg[0], False, [_snapshot(part) for part in msg[2]])
+            for peer in queued:
+                peer.queue[-1] = snapshot
+
+    def ready(self):
+        """Return True if a message can be sent without blocking.
+        """
+        self.process_control()
+        if self.opts['policy'] != 'block':
+            return True
+        return all(peer.pending() < self.opts['queue_size'] for peer in self.peers.values())
+
+    def process_control(self, timeout=0):
+        """Handle the credit / connection messages sent by receivers.
+
+        Wait at most *timeout* ms for the first message. Return True if any
+        message was handled.
+        """
+        handled = False
+        while zmq.Socket.poll(self, timeout, zmq.POLLIN):
+            timeout = 0
+            ident, cmd, arg = _recv_multipart(self)
+            n, = _seq_struct.unpack(arg)
+            if cmd == b'hello':
+                self.peers[ident] = _Peer(ident, n)
+            elif cmd == b'credit':
+                if ident in self.peers:
+                    self.peers[ident].credit += n
+            elif cmd == b'bye':
+                self._remove_peer(ident)
+            handled = True
+        if handled:
+            for peer in list(self.peers.values()):
+                self._flush(peer)
+        return handled
+
+    def drain(self, timeout=None):
+        """Wait until all queued chunks are sent or *timeout* (ms) elapses.
+        
+        Return True if all queues are empty.
+        """
+        deadline = None if timeout is None else time.perf_counter() + timeout / 1000.
+        while True:
+            self.process_control()
+            if all(peer.pending() == 0 for peer in self.peers.values()):
+                return True
+            remaining = -1 if deadline is None else (deadline - time.perf_counter()) * 1000
+            if deadline is not None and remaining <= 0:
+                return False
+            self.process_control(timeout=remaining)
+
+    def pending(self):
+        """Return the number of chunks queued for all receivers.
+        """
+        return sum(peer.pending() for peer in self.peers.values())
+
+    def status(self):
+        """Return {receiver_id: dict(credit, queued, dropped, spilled)}.
+        """
+        return {peer.ident: dict(credit=peer.credit, queued=peer.pending(),
+                                 dropped=peer.dropped, spilled=peer.spilled)
+                for peer in self.peers.values()}
+
+    def _enqueue(self, peer, msg):
+        opts = self.opts
+        if peer.pending() < opts['queue_size'] and (peer.spill is None or peer.spill.count == 0):
+            peer.queue.append(msg)
+            return
+
+        policy = opts['policy']
+        if policy == 'block':
+            timeout = opts['timeout']
+            deadline = None if timeout is None else time.perf_counter() + timeout / 1000.
+            while peer.pending() >= opts['queue_size']:
+                remaining = -1 if deadline is None else max(0, (deadline - time.perf_counter()) * 1000)
+                if not self.process_control(timeout=remaining) and deadline is not None and \
+                        time.perf_counter() >= deadline:
+                    raise TimeoutError("Stream receiver did not grant credit within %s ms" % timeout)
+                if peer.ident not in self.peers:
+                    return
+            peer.queue.append(msg)
+        elif policy == 'drop-oldest':
+            peer.queue.popleft()
+            peer.queue.append(msg)
+            if peer.dropped == 0:
+                logger.warning("Stream receiver is too slow; dropping oldest chunks.")
+            peer.dropped += 1
+        elif policy == 'spill':
+            if peer.spill is None:
+                peer.spill = _SpillFile(opts['spill_dir'])
+            seq, copy, parts = msg
+            peer.spill.push([seq] + parts)
+            peer.spilled += 1
+
+    def _flush(self, peer):
+        while peer.credit > 0:
+            if len(peer.queue) == 0:
+                if peer.spill is None or peer.spill.count == 0:
+                    break
+                parts = peer.spill.pop()
+                peer.queue.append((parts[0], True, parts[1:]))
+            seq, copy, parts = peer.queue.popleft()
+            try:
+                _send_multipart(self, [peer.ident, seq] + parts, copy=copy)
+            except zmq.ZMQError as err:
+                if err.errno != zmq.EHOSTUNREACH:
+                    raise
+                # receiver disappeared
+                self._remove_peer(peer.ident)
+                return
+            peer.credit -= 1
+        # refill the memory queue from the spill file
+        if peer.spill is not None:
+            while peer.spill.count > 0 and len(peer.queue) < self.opts['queue_size']:
+                parts = peer.spill.pop()
+                peer.queue.append((parts[0], True, parts[1:]))
+
+    def _remove_peer(self, ident):
+        peer = self.peers.pop(ident, None)
+        if peer is not None and peer.spill is not None:
+            peer.spill.close()
+
+    def close(self, linger=None):
+        if self.peers is not None:
+            for ident in list(self.peers):
+                self._remove_peer(ident)
+        zmq.Socket.close(self, linger=linger)
+
+
+class FlowControlReceiver(zmq.Socket):
+    """DEALER socket that receives sequence-numbered messages from a
+    :class:`FlowControlSender` and grants it credit as messages are consumed.
+
+    Use ``FlowControlReceiver(context, zmq.DEALER)``, connect it, then call
+    :func:`setup`.
+    """
+    credit = 0
+    consumed = 0
+    expected_seq = None
+    missed_chunks = 0
+    gaps = 0
+
+    def setup(self, opts):
+        self.credit = opts['credit']
+        self.consumed = 0
+        self.expected_seq = None
+        self.missed_chunks = 0
+        self.gaps = 0
+        _send_multipart(self, [b'hello', _seq_struct.pack(self.credit)])
+
+    def recv(self, flags=0, copy=True, track=False):
+        return self.recv_multipart(flags=flags, copy=copy, track=track)[0]
+
+    def recv_multipart(self, flags=0, copy=True, track=False):
+        frames = _recv_multipart(self, flags=flags, copy=copy)
+        seq, = _seq_struct.unpack(frames[0] if copy else frames[0].bytes)
+        if self.expected_seq is not None and seq > self.expected_seq:
+            self.gaps += 1
+            self.missed_chunks += seq - self.expected_seq
+            logger.warning("Stream gap: %d chunks lost before chunk %d", seq - self.expected_seq, seq)
+        self.expected_seq = seq + 1
+
+        # give credit back in batches
+        self.consumed += 1
+        if self.consumed >= max(self.credit // 2, 1):
+            _send_multipart(self, [b'credit', _seq_struct.pack(self.consumed)])
+            self.consumed = 0
+        return frames[1:]
+
+    def close(self, linger=None):
+        if not self.closed:
+            try:
+                _send_multipart(self, [b'bye', _seq_struct.pack(0)], flags=zmq.NOBLOCK)
+            except zmq.ZMQError:
+                pass
+        zmq.Socket.close(self, linger=linger)
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+
+import struct
+import logging
+import threading
+import weakref
+from collections import deque
+
+import numpy as np
+
+from .streamhelpers import DataSender, DataReceiver, register_transfermode
+
+logger = logging.getLogger(__name__)
+
+# {interface: LocalSender} for all local senders in this process
+_local_senders = weakref.WeakValueDictionary()
+_notify_struct = struct.Struct('!Q')
+
+
+class LocalSender(DataSender):
+    """Stream sender that passes array references to receivers living in the
+    same process. Nothing is serialized; only the chunk index is sent over the
+    socket so that receivers can be polled like any other stream.
+
+    Note: this class is usually not instantiated directly; use
+    ``OutputStream.configure(protocol='inproc', transfermode='local')``.
+
+    Receivers get a read-only view of the sent array, so they cannot modify
+    data seen by other receivers (they must copy it to modify it). The
+    sender must not modify an array after it has been sent, unless the output
+    is configured with ``copy=True``, in which case each chunk is copied once
+    before being handed to receivers.
+
+    Extra parameters accepted when configuring the output stream:
+
+    * copy (bool) If True, send a copy of each chunk. Default False.
+    * queue_size (int) Maximum number of chunks kept for a receiver that is
+      not reading. Older chunks are discarded: :func:`LocalReceiver.recv`
+      then returns None in place of their data and counts them in
+      ``dropped_chunks``. Default 1000.
+    """
+    def __init__(self, socket, params):
+        DataSender.__init__(self, socket, params)
+        if params['protocol'] != 'inproc':
+            raise ValueError("transfermode='local' requires protocol='inproc'")
+        self.copy = params.get('copy', False)
+        self._receivers = weakref.WeakSet()
+        self._lock = threading.Lock()
+        _local_senders[params['interface']] = self
+
+    def _add_receiver(self, receiver):
+        with self._lock:
+            self._receivers.add(receiver)
+
+    def _remove_receiver(self, receiver):
+        with self._lock:
+            self._receivers.discard(receiver)
+
+    def send(self, index, data):
+        if self.copy:
+            data = data.copy()
+        else:
+            data = data.view()
+        data.flags.writeable = False
+        with self._lock:
+            receivers = list(self._receivers)
+        for receiver in receivers:
+            receiver._queue.append((index, data))
+        # wake up receivers
+        self.socket.send(_notify_struct.pack(index) + self.header_trailer(), copy=True)
+
+    def close(self):
+        if _local_senders.get(self.params['interface']) is self:
+            del _local_senders[self.params['interface']]
+
+
+class LocalReceiver(DataReceiver):
+    """Stream receiver for ``transfermode='local'``.
+
+    See :class:`LocalSender`. The number of chunks that were discarded from a
+    full queue before being received is accumulated in ``dropped_chunks``.
+    """
+    def __init__(self, socket, params):
+        DataReceiver.__init__(self, socket, params)
+        self._sender = _local_senders.get(params['interface'], None)
+        if self._sender is None:
+            raise ValueError("transfermode='local' stream must be connected "
+                             "from the process of its OutputStream")
+        self._queue = deque(maxlen=params.get('queue_size', 1000))
+        self.dropped_chunks = 0
+        self._sender._add_receiver(self)
+
+    def recv(self, return_data=True, out=None):
+        """Receive the next chunk.
+
+        Parameters
+        ----------
+        return_data : bool
+            If False, return None instead of the data.
+        out : ndarray | None
+            If given, the chunk is copied into this array, which is returned.
+            Otherwise a read-only view of the sent array is returned.
+        """
+        msg = self.socket.recv()
+        index, = _notify_struct.unpack_from(msg)
+        self.read_trailer(msg)
+
+        # Chunks sent before this receiver subscribed to the socket may be
+        # queued without notification; skip them. Later chunks stay queued.
+        data = None
+        while len(self._queue) > 0 and self._queue[0][0] <= index:
+            i, d = self._queue.popleft()
+            if i == index:
+                data = d
+                break
+        if data is None:
+            # the chunk was discarded from the full queue
+            if self.dropped_chunks == 0:
+                logger.warning("Local stream receiver is too slow; chunks were dropped.")
+            self.dropped_chunks += 1
+
+        if data is not None and out is not None:
+            out[...] = data
+            data = out
+        if not return_data:
+            data = None
+        return index, data
+
+    def queue_depth(self):
+        return len(self._queue)
+
+    def close(self):
+        if self._sender is not None:
+            self._sender._remove_receiver(self)
+            self._sender = None
+        self._queue.clear()
+
+
+register_transfermode('local', LocalSender, LocalReceiver)
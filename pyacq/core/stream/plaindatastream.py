@@ -3,11 +3,31 @@
 # Distributed under the (new) BSD License. See LICENSE for more info.
 
 import struct
+import functools
 import numpy as np
 
 from .streamhelpers import DataSender, DataReceiver, register_transfermode
-from .arraytools import is_contiguous, decompose_array, make_dtype
-from .compression import compress, decompress
+from .arraytools import decompose_array, make_dtype
+from .compression import compress, decompress, check_compression
+
+
+_ndim_struct = struct.Struct('!Q')
+
+
+@functools.lru_cache(maxsize=None)
+def header_struct(ndim):
+    """Return the precompiled struct for the part of a plaindata header that
+    follows the leading ndim field: index, offset, shape and strides.
+    """
+    return struct.Struct('!' + 'Q' * (ndim + 2) + 'q' * ndim)
+
+
+@functools.lru_cache(maxsize=None)
+def packet_header_struct(ndim):
+    """Return the precompiled struct for a full plaindata header:
+    ndim, index, offset, shape and strides.
+    """
+    return struct.Struct('!' + 'Q' * (ndim + 3) + 'q' * ndim)
 
 
 class PlainDataSender(DataSender):
@@ -17,10 +37,27 @@ class PlainDataSender(DataSender):
     ``OutputStream.configure(transfermode='plaindata')``.
     
     To avoid unnecessary copies (and thus optimize transmission speed), data is
-    sent exactly as it appears in memory including array strides.
+    sent exactly as it appears in memory including array strides. Each
+    uncompressed chunk is copied once into the zmq message, so the caller may
+    reuse its array as soon as :func:`send` returns. If the stream is
+    configured with ``copy=False``, large chunks are instead handed to zmq
+    without copy; the caller must then not modify a chunk after sending it,
+    as it may still be waiting in the socket queue.
     
-    This class supports compression.
+    This class supports compression: the ``compression`` stream parameter
+    selects any method registered with
+    :func:`register_compression() <stream.compression.register_compression>`
+    and ``compression_opts`` (dict) is passed to its compression function
+    (for example ``{'level': 5, 'nthreads': 2}``).
     """
+    def __init__(self, socket, params):
+        DataSender.__init__(self, socket, params)
+        self.compression = self.params['compression']
+        check_compression(self.compression)
+        self.compression_opts = self.params.get('compression_opts', None) or {}
+        # only skip the copy if explicitly requested
+        self.copy = self.params.get('copy', None) is not False
+    
     def send(self, index, data):
         # optional pre-processing before send
         if isinstance(data, np.ndarray):
@@ -28,22 +65,26 @@ class PlainDataSender(DataSender):
                 index, data = f(index, data)
                 
         # serialize
-        dtype = data.dtype
         shape = data.shape
         buf, offset, strides = decompose_array(data)
         
+        # number of items per row in memory (used by signal-aware codecs)
+        rowsize = buf.size // buf.shape[0] if buf.ndim > 0 and buf.shape[0] > 0 else 1
         
-        # compress
-        comp = self.params['compression']
-        buf = compress(buf, comp, data.itemsize)
+        # 1D uint8 view of the (contiguous) buffer; no copy is made.
+        # this trick avoid "does not support the buffer interface." for datetime[ms] dtype in python
+        buf = buf.reshape(-1).view('uint8')
         
+        # compress
+        if self.compression != '':
+            buf = compress(buf, self.compression, data.itemsize, rowsize=rowsize, **self.compression_opts)
         
         # Pack and send
-        stat = struct.pack('!' + 'Q' * (3+len(shape)) + 'q' * len(strides), len(shape), index, offset, *(shape + strides))
-        copy = self.params.get('copy', False)
-
-        # this trick avoid "does not support the buffer interface." for datetime[ms] dtype in python
-        buf = buf.flatten().view('uint8')
+        stat = packet_header_struct(len(shape)).pack(len(shape), index, offset, *(shape + strides))
+        if self.timestamps:
+            stat += self.header_trailer()
+        # compressed buffers are owned by this message and need no copy
+        copy = self.copy and self.compression == ''
         self.socket.send_multipart([stat, buf], copy=copy)
 
 
@@ -51,15 +92,40 @@ class PlainDataReceiver(DataReceiver):
     """Helper class to receive data serialized over socket.
     
     See PlainDataSender.
+    
+    Messages are received without copy: the returned array points directly
+    into the memory of the zmq message. Passing an *out* array to
+    :func:`recv` writes the chunk (decompressing if needed) into a
+    caller-supplied array instead.
     """
     def __init__(self, socket, params):
         DataReceiver.__init__(self, socket, params)
+        # resolved once per connection instead of for every packet
+        self.dtype = make_dtype(self.params['dtype'])
+        self.compression = self.params['compression']
+        # fail at connection time if this process lacks the sender's codec
+        check_compression(self.compression)
+        self.compression_opts = self.params.get('compression_opts', None) or {}
     
-    def recv(self, return_data=True):
+    def recv(self, return_data=True, out=None):
+        """Receive the next data chunk.
+        
+        Parameters
+        ----------
+        return_data : bool
+            If False, the data is not unpacked and None is returned in place of
+            the data.
+        out : np.ndarray or None
+            Optional array with the same shape and dtype as the received
+            chunk. If given, data is written into this array and *out* is
+            returned.
+        """
         # receive and unpack structure
-        stat, data = self.socket.recv_multipart()
-        ndim = struct.unpack('!Q', stat[:8])[0]
-        stat = struct.unpack('!' + 'Q' * (ndim + 2) + 'q' * ndim, stat[8:])
+        stat, frame = self.socket.recv_multipart(copy=False)
+        stat = stat.bytes
+        self.read_trailer(stat)
+        ndim = _ndim_struct.unpack_from(stat)[0]
+        stat = header_struct(ndim).unpack_from(stat, 8)
         index = stat[0]
         
         if not return_data:
@@ -69,15 +135,28 @@ class PlainDataReceiver(DataReceiver):
         shape = stat[2:2+ndim]
         strides = stat[-ndim:]
         
+        if out is not None:
+            if tuple(out.shape) != tuple(shape) or out.dtype != self.dtype:
+                raise ValueError("Output array has shape %s and dtype %s; expected %s and %s" %
+                                 (out.shape, out.dtype, shape, self.dtype))
+            if self.compression != '' and offset == 0 and out.strides == strides \
+                    and out.flags.c_contiguous:
+                # decompress straight into the caller's array
+                decompress(frame.buffer, self.compression, self.dtype.itemsize, out=out,
+                           **self.compression_opts)
+                return index, out
+        
         # uncompress
-        comp = self.params['compression']
-        data = decompress(data, comp)
+        buf = decompress(frame.buffer, self.compression, self.dtype.itemsize, **self.compression_opts)
         
         # convert to array
-        dtype = make_dtype(self.params['dtype']) # this avoid some bugs but is not efficient because this is call every sends...
-        #~ dtype = self.params['dtype']
-        data = np.ndarray(buffer=data, shape=shape,
-                          strides=strides, offset=offset, dtype=dtype)        
+        data = np.ndarray(buffer=buf, shape=shape,
+                          strides=strides, offset=offset, dtype=self.dtype)
+        if out is not None:
+            out[...] = data
+            return index, out
+        # The message memory may be shared with the sender (inproc); protect it.
+        data.flags.writeable = False
         return index, data
 
 
@@ -5,7 +5,12 @@
 import numpy as np
 
 from .sharedarray import SharedMem, SharedArray
-from .arraytools import make_dtype
+from .arraytools import make_dtype, convert_into
+
+
+# Size in bytes of the index header that precedes the buffer data in shared
+# memory: [read_index, write_index, generation, reserved]
+_header_nbytes = 32
 
 
 class RingBuffer:
@@ -16,13 +21,45 @@ class RingBuffer:
     received by the stream, up to a predefined length. Double ring buffers
     allow faster, copyless reads at the expense of doubled write time and memory
     footprint.
+    
+    A single writer may be used together with any number of readers (possibly
+    in other processes when the buffer lives in shared memory). Readers that
+    must not return partially overwritten data should use
+    ``get_data(..., validate=True)``; see :func:`get_data`.
+    
+    A reader may only expose some of the channels (axis 1) of an existing
+    buffer with the *channels* argument (a slice); the data it returns are
+    then strided views of the full buffer. Such a buffer must not be written.
+    
+    With ``double=False`` and *mirror_size*, the buffer is followed by a
+    mirror area of *mirror_size* samples that holds a second copy of only the
+    first *mirror_size* samples of the ring, just past the wrap point. Any
+    segment of up to *mirror_size* samples can then be read without copy,
+    while only ``mirror_size / shape[0]`` of the data is written twice.
     """
-    def __init__(self, shape, dtype, double=True, shmem=None, fill=None, axisorder=None):
+    
+    #: Maximum number of attempts made by ``get_data(validate=True)`` before
+    #: giving up.
+    max_read_retries = 10
+    
+    def __init__(self, shape, dtype, double=True, shmem=None, fill=None, axisorder=None, shm_options=None,
+                 scale=None, offset=None, channels=None, mirror_size=None):
+        if mirror_size is not None:
+            if double:
+                raise ValueError("mirror_size can only be used with double=False")
+            if not 0 < mirror_size < shape[0]:
+                raise ValueError("mirror_size must be between 1 and the buffer size - 1 "
+                                 "(got %d for buffer size %d)" % (mirror_size, shape[0]))
+            mirror_size = int(mirror_size)
         self.double = double
+        self.mirror_size = mirror_size
         self.shape = shape
         
         dtype = make_dtype(dtype) # fix dtype serialization
         
+        self.scale = self.offset = None
+        self._convert = False
+        
         # order of axes as written in memory. This does not affect the shape of the 
         # buffer as seen by the user, but can be used to make sure a specific axis
         # is contiguous in memory.
@@ -30,7 +67,10 @@ class RingBuffer:
             axisorder = np.arange(len(shape))
         self.axisorder = np.array(axisorder)
         
-        shape = (shape[0] * (2 if double else 1),) + shape[1:]
+        if double:
+            shape = (shape[0] * 2,) + shape[1:]
+        elif mirror_size is not None:
+            shape = (shape[0] + mirror_size,) + shape[1:]
         nativeshape = np.array(shape)[self.axisorder]
         
         # initialize int buffers with 0 and float buffers with nan
@@ -41,24 +81,44 @@ class RingBuffer:
         if shmem is None:
             self.buffer = np.empty(nativeshape, dtype=dtype).transpose(np.argsort(axisorder))
             self.buffer[:] = self._filler
-            self._indexes = np.zeros((2,), dtype='int64')
+            self._indexes = np.zeros((4,), dtype='int64')
             self._shmem = None
             self.shm_id = None
         else:
-            size = np.prod(shape) * make_dtype(dtype).itemsize + 16
+            size = np.prod(shape) * make_dtype(dtype).itemsize + _header_nbytes
             if shmem is True:
                 # create new shared memory buffer
-                self._shmem = SharedMem(nbytes=size)
+                shm_options = {} if shm_options is None else shm_options
+                self._shmem = SharedMem(nbytes=size, **shm_options)
             else:
                 self._shmem = SharedMem(nbytes=size, shm_id=shmem)
-            buf = self._shmem.to_numpy(offset=16, dtype=dtype, shape=nativeshape)
+            buf = self._shmem.to_numpy(offset=_header_nbytes, dtype=dtype, shape=nativeshape)
             self.buffer = buf.transpose(np.argsort(axisorder))
-            self._indexes = self._shmem.to_numpy(offset=0, dtype='int64', shape=(2,))
+            self._indexes = self._shmem.to_numpy(offset=0, dtype='int64', shape=(4,))
             self.shm_id = self._shmem.shm_id
         
         self.dtype = self.buffer.dtype
+        if scale is not None or offset is not None:
+            self.set_conversion(scale, offset)
+        
+        if channels is not None:
+            # read-only view of a subset of the channels
+            self.buffer = self.buffer[:, channels]
+            self.shape = (self.shape[0], self.buffer.shape[1]) + tuple(self.shape[2:])
+        
+        if double:
+            # view of the buffer as its two halves: (2, bsize, ...). Sample i is
+            # stored at [:, i % bsize], so both copies are written at once.
+            bsize = self.shape[0]
+            strides = self.buffer.strides
+            self._halves = np.lib.stride_tricks.as_strided(
+                self.buffer, shape=(2, bsize) + self.buffer.shape[1:],
+                strides=(bsize * strides[0],) + strides)
         
         if shmem in (None, True):
+            # Number of started + finished write operations (seqlock counter).
+            # The value is odd while a write is in progress.
+            self._indexes[2] = 0
             # Index of last writable sample + 1. This value is used to determine which
             # buffer indices map to which data indices (where buffer indices wrap
             # around to 0, but data indices always increase as data arrives).
@@ -75,6 +135,12 @@ class RingBuffer:
         #   2. new data is written over the old buffer data
         #   3. read_index is increased to indicate that the new data is now
         #      readable
+        # Each of these steps is a single aligned 8-byte store, and the whole
+        # sequence is bracketed by two increments of the generation counter
+        # (odd while the write is in progress). Python offers no explicit
+        # memory fence, so readers in other processes rely on stores becoming
+        # visible in program order (true on x86); get_data(validate=True)
+        # re-checks the indexes after copying to catch any overwrite.
 
         #
         #              write_index-bsize     break_index      read_index       write_index
@@ -88,12 +154,36 @@ class RingBuffer:
         #                               [....|......]                read with copy
         # 
         
+    def set_conversion(self, scale=None, offset=None):
+        """Convert incoming chunks while they are copied into the buffer.
+        
+        Chunks of any dtype are then accepted and cast to the buffer dtype
+        (with unsafe casting), and ``buffer = offset + scale * chunk`` is
+        stored. Each of *scale* and *offset* may be None, a scalar or an array
+        that broadcasts against shape[1:] (for example one value per channel).
+        """
+        # computed in the buffer dtype, unless it cannot hold the scale
+        dtype = self.dtype if np.issubdtype(self.dtype, np.inexact) else None
+        self.scale = None if scale is None else np.asarray(scale, dtype=dtype)
+        self.offset = None if offset is None else np.asarray(offset, dtype=dtype)
+        self._convert = True
+
     def index(self):
         return self._read_index
 
     def first_index(self):
         return self._read_index - self.shape[0]
 
+    def generation(self):
+        """Return the write generation counter.
+        
+        The counter is incremented once before and once after every write
+        to the buffer, so it is odd while a write is in progress and two
+        equal, even values read before and after a read guarantee that no
+        write happened in between.
+        """
+        return int(self._indexes[2])
+
     @property
     def _write_index(self):
         return self._indexes[1]
@@ -103,51 +193,107 @@ class RingBuffer:
         return self._indexes[0]
 
     def _set_write_index(self, i):
-        # what kind of protection do we need here?
+        # Only the writer modifies the indexes; readers detect concurrent
+        # modification through the generation counter (see get_data).
         self._indexes[1] = i
 
     def _set_read_index(self, i):
-        # what kind of protection do we need here?
         self._indexes[0] = i
     
+    def _begin_write(self):
+        self._indexes[2] += 1
+    
+    def _end_write(self):
+        self._indexes[2] += 1
+    
     def reset_index(self):
-        self._set_write_index(0)
-        self._set_read_index(0)
+        self._begin_write()
+        try:
+            self._set_write_index(0)
+            self._set_read_index(0)
+        finally:
+            self._end_write()
     
-    def new_chunk(self, data, index=None):
-        dsize = data.shape[0]
+    def new_chunk(self, data, index=None, casting='equiv'):
+        """Write a chunk of data ending at *index* (by default, the chunk
+        follows the previously written data).
+        
+        Skipped samples between the previous chunk and this one are filled
+        with the *fill* value. See :func:`new_chunks` for *casting*.
+        """
+        self.new_chunks([data], None if index is None else [index], casting=casting)
+    
+    def new_chunks(self, chunks, indices=None, casting='equiv'):
+        """Write several chunks of data in a single operation.
+        
+        This is equivalent to calling :func:`new_chunk` for each chunk, but
+        the indexes and the write generation are only updated once, and
+        chunks that would be overwritten by later chunks of the same call are
+        not written at all.
+        
+        Parameters
+        ----------
+        chunks : list of arrays
+            The chunks to write, in order.
+        indices : list of int | None
+            The index (last sample + 1) of each chunk. By default each chunk
+            follows the previous one.
+        casting : 'no' | 'equiv' | 'safe' | 'same_kind' | 'unsafe'
+            Casting allowed from the dtype of the chunks to the buffer dtype,
+            as for ``np.copyto``. By default chunks must have the buffer dtype.
+            This is ignored if :func:`set_conversion` was called.
+        """
         bsize = self.shape[0]
-        if dsize > bsize:
-            raise ValueError("Data chunk size %d is too large for ring "
-                            "buffer of size %d." % (dsize, bsize))
-        if data.dtype != self.dtype:
-            raise TypeError("Data has incorrect dtype %s (buffer requires %s)" %
-                            (data.dtype, self.dtype))
-        
-        # by default, index advances by the size of the chunk
-        if index is None:
-            index = self._write_index + dsize
-        
-        assert dsize <= index - self._write_index, ("Data size is %d, but index "
-                                                    "only advanced by %d. (index=%d, self._write_index=%d)" % 
-                                                    (dsize, index-self._write_index, index, self._write_index)) 
-
+        
+        # check all chunks and compute their index span before writing anything
+        plan = []
+        index = int(self._write_index)
+        for k, data in enumerate(chunks):
+            dsize = data.shape[0]
+            if dsize > bsize:
+                raise ValueError("Data chunk size %d is too large for ring "
+                                "buffer of size %d." % (dsize, bsize))
+            if not self._convert and not np.can_cast(data.dtype, self.dtype, casting):
+                raise TypeError("Data has incorrect dtype %s (buffer requires %s)" %
+                                (data.dtype, self.dtype))
+            
+            # by default, index advances by the size of the chunk
+            prev_index = index
+            if indices is None or indices[k] is None:
+                index = prev_index + dsize
+            else:
+                index = int(indices[k])
+            assert dsize <= index - prev_index, ("Data size is %d, but index "
+                                                 "only advanced by %d. (index=%d, self._write_index=%d)" % 
+                                                 (dsize, index-prev_index, index, prev_index)) 
+            plan.append((index - dsize, index, data))
+        if len(plan) == 0:
+            return
+        
+        # samples before this index are overwritten by the end of the batch
+        oldest = index - bsize
+        
         revert_inds = [self._read_index, self._write_index]
+        self._begin_write()
         try:
             # advance write index. This immediately prevents other processes from
             # accessing memory that is about to be overwritten.
             self._set_write_index(index)
             
-            # decide if any skipped data needs to be filled in
-            fill_start = max(self._read_index, self._write_index - bsize)
-            fill_stop = self._write_index - dsize
-            
-            if fill_stop > fill_start:
-                # data was skipped; fill in missing regions with 0 or nan.
-                self._write(fill_start, fill_stop, self._filler)
-                revert_inds[1] = fill_stop
-                
-            self._write(self._write_index - dsize, self._write_index, data)
+            # end of the valid data written so far
+            filled = max(int(self._read_index), oldest)
+            for start, stop, data in plan:
+                if stop <= oldest:
+                    continue
+                if start < oldest:
+                    data = data[oldest-start:]
+                    start = oldest
+                if start > filled:
+                    # data was skipped; fill in missing regions with 0 or nan.
+                    self._write(filled, start, self._filler)
+                    revert_inds[1] = start
+                self._write(start, stop, data, casting)
+                filled = stop
                 
             self._set_read_index(index)
         except:
@@ -155,29 +301,57 @@ class RingBuffer:
             self._set_read_index(revert_inds[0])
             self._set_write_index(revert_inds[1])
             raise
+        finally:
+            self._end_write()
 
-    def _write(self, start, stop, value):
-        # get starting index
+    def _write(self, start, stop, value, casting='equiv'):
+        # Write value (array or scalar) at indexes [start, stop), which span
+        # at most one buffer size, in one or two stores (around the break
+        # index). In double mode both copies are written by the same store.
         bsize = self.shape[0]
         dsize = stop - start
         i = start % bsize
         
+        # array values are converted only once, while being stored
+        is_array = hasattr(value, '__len__')
+        convert = self._convert and is_array
+        
         if self.double:
-            self.buffer[i:i+dsize] = value
-            i += bsize
+            buf = self._halves
+            pre = (slice(None),)
+        else:
+            buf = self.buffer
+            pre = ()
         
-        if i + dsize <= self.buffer.shape[0]:
-            self.buffer[i:i+dsize] = value
+        if i + dsize <= bsize:
+            self._store(buf[pre + (slice(i, i+dsize),)], value, convert, casting)
         else:
-            n = self.buffer.shape[0]-i
+            n = bsize - i
+            self._store(buf[pre + (slice(i, bsize),)], value[:n] if is_array else value, convert, casting)
+            self._store(buf[pre + (slice(None, dsize-n),)], value[n:] if is_array else value, convert, casting)
+        
+        if self.mirror_size is not None:
+            # copy the samples written at the beginning of the ring to the
+            # mirror area that follows the end of the ring
+            m = self.mirror_size
+            for a, b in ((i, min(i+dsize, bsize)), (0, i+dsize-bsize)):
+                b = min(b, m)
+                if a < b:
+                    np.copyto(buf[bsize+a:bsize+b], buf[a:b])
+
+    def _store(self, dest, value, convert, casting):
+        # dest may have an extra leading axis (both halves of a double
+        # buffer); value is broadcast across it.
+        if not convert:
             if hasattr(value, '__len__'):
-                # case array
-                self.buffer[i:] = value[:n]
-                self.buffer[:dsize-n] = value[n:]
+                np.copyto(dest, value, casting=casting)
             else:
-                # case value is a scalar (when self._filler)
-                self.buffer[i:] = value
-                self.buffer[:dsize-n] = value
+                # scalar fill value
+                dest[...] = value
+            return
+        # scale and offset are applied in the destination memory without
+        # allocating an intermediate converted chunk
+        convert_into(dest, value, self.scale, self.offset)
 
     def __getitem__(self, item):
         if isinstance(item, tuple):
@@ -203,7 +377,7 @@ class RingBuffer:
         
         return data
 
-    def get_data(self, start, stop, copy=False, join=True):
+    def get_data(self, start, stop, copy=False, join=True, validate=False):
         """Return a segment of the ring buffer.
         
         Parameters
@@ -223,7 +397,37 @@ class RingBuffer:
             for the beginning and end of the requested segment. This can be
             used to avoid an unnecessary copy when the buffer has double=False
             and the caller does not require a contiguous array.
+        validate : bool
+            If True, the data is copied and the buffer indexes are checked
+            again after the copy to ensure that no part of the segment was
+            overwritten by a concurrent writer (for example another process
+            writing to a shared memory buffer). The read is retried up to
+            ``max_read_retries`` times; IndexError is raised if the segment
+            is no longer available. Default is False.
         """
+        if not validate:
+            return self._get_data(start, stop, copy=copy, join=join)
+        
+        bsize = self.shape[0]
+        for i in range(self.max_read_retries):
+            gen = self.generation()
+            write_index = int(self._write_index)
+            if start < write_index - bsize:
+                raise IndexError("Requested segment (%d, %d) has already been "
+                                 "overwritten in ring buffer (write index is %d)." %
+                                 (start, stop, write_index))
+            data = self._get_data(start, stop, copy=True, join=join)
+            if self.generation() == gen and gen % 2 == 0:
+                # no write happened during the copy
+                return data
+            new_write_index = int(self._write_index)
+            if write_index <= new_write_index and start >= new_write_index - bsize:
+                # writes happened, but they did not reach the requested segment
+                return data
+        raise IndexError("Requested segment (%d, %d) was overwritten while reading "
+                         "(%d attempts)." % (start, stop, self.max_read_retries))
+
+    def _get_data(self, start, stop, copy=False, join=True):
         first, last = self.first_index(), self.index()
         if start < first or stop > last:
             raise IndexError("Requested segment (%d, %d) is out of bounds for ring buffer. "
@@ -242,6 +446,11 @@ class RingBuffer:
             stop_ind = stop%bsize + bsize
             start_ind = stop_ind - (stop - start)
             
+            data = self.buffer[start_ind:stop_ind]
+        elif self.mirror_size is not None and stop - start <= self.mirror_size:
+            # if the segment wraps around, its end is read from the mirror area
+            start_ind = start % bsize
+            stop_ind = start_ind + (stop - start)
             data = self.buffer[start_ind:stop_ind]
         else:
             break_index = self._write_index - (self._write_index % bsize)
@@ -252,7 +461,7 @@ class RingBuffer:
             else:
                 # need to reconstruct from two pieces
                 newshape = np.array((stop-start,) + self.shape[1:])[self.axisorder]
-                a = self.buffer[start%bsize:]
+                a = self.buffer[start%bsize:bsize]
                 b = self.buffer[:stop%bsize]
                 if join is False:
                     if copy is True:
@@ -3,11 +3,22 @@
 # Distributed under the (new) BSD License. See LICENSE for more info.
 
 import numpy as np
-import sys, random, string, tempfile, mmap
+import sys, os, errno, random, string, tempfile, mmap, weakref
 
 
-# TODO
-# On POSIX system it can optionally the shm_open way to avoid mmap.
+def _random_name(prefix=u'pyacq_SharedMem_', n=24):
+    return prefix + ''.join(random.SystemRandom().choice(string.ascii_uppercase + string.digits) for _ in range(n))
+
+
+if sys.platform.startswith('win'):
+    shm_backends = ['windows']
+else:
+    shm_backends = ['tempfile']
+    if os.path.isdir('/dev/shm'):
+        shm_backends.insert(0, 'posix')
+    if hasattr(os, 'memfd_create') and os.path.isdir('/proc/self/fd'):
+        shm_backends.append('memfd')
+
 
 class SharedMem:
     """Class to create a shared memory buffer.
@@ -25,36 +36,112 @@ class SharedMem:
         The id of an existing SharedMem to open. If None, then a new shared
         memory file is created.
         On linux this is the filename, on Windows this is the tagname.
+    backend : str or None
+        The method used to create a new buffer (ignored when opening an
+        existing one):
+        
+        * 'posix': a file in ``/dev/shm`` (RAM-backed tmpfs). This is the
+          default when ``/dev/shm`` exists.
+        * 'memfd': an anonymous file from ``memfd_create()`` (linux only).
+          Other processes open it through ``/proc/<pid>/fd/<fd>``.
+        * 'tempfile': a file created in the default temporary directory.
+        * 'windows': a named mapping (the only backend on Windows).
+        
+        All registered backends are listed in `shm_backends`. The memory of
+        a new buffer is reserved when it is created, so OSError is raised if
+        the backend (for example a small ``/dev/shm``) does not have enough
+        space.
+    populate : bool
+        If True, pre-fault all pages of the mapping (``MAP_POPULATE``) so that
+        the first writes do not pay for page faults.
+    hugepages : bool
+        If True, request huge pages for the buffer (``MFD_HUGETLB`` for
+        'memfd', ``MADV_HUGEPAGE`` otherwise). For 'memfd' this requires
+        huge pages to be reserved by the system.
     
+    Files created by the 'posix' backend are unlinked by :func:`close` or
+    :func:`unlink`, or when the creating SharedMem is garbage collected.
+    Processes that already opened the buffer keep access to it.
     """
-    def __init__(self, nbytes, shm_id=None):
+    def __init__(self, nbytes, shm_id=None, backend=None, populate=False, hugepages=False):
         self.nbytes = nbytes
         self.mmap_size = (self.nbytes // mmap.PAGESIZE + 1) * mmap.PAGESIZE
         self.shm_id = shm_id
+        self._finalizer = None
+        
+        if shm_id is None:
+            if backend is None:
+                backend = shm_backends[0]
+            if backend not in shm_backends:
+                raise ValueError("Unsupported shared memory backend '%s' (available: %s)" %
+                                 (backend, ', '.join(shm_backends)))
+        self.backend = backend
         
         if sys.platform.startswith('win'):
             if shm_id is None:
-                self.shm_id = u'pyacq_SharedMem_'+''.join(random.SystemRandom().choice(string.ascii_uppercase + string.digits) for _ in range(128))
+                self.shm_id = _random_name(n=128)
                 self.mmap = mmap.mmap(-1, self.nbytes, self.shm_id, access=mmap.ACCESS_WRITE)
             else:
                 self.mmap = mmap.mmap(-1, self.nbytes, self.shm_id, access=mmap.ACCESS_READ)
         else:
+            flags = mmap.MAP_SHARED
+            if populate:
+                flags |= getattr(mmap, 'MAP_POPULATE', 0)
             if shm_id is None:
-                self._tmpFile = tempfile.NamedTemporaryFile(prefix=u'pyacq_SharedMem_')
-                self._tmpFile.write(b'\x00' * self.nbytes)
-                self._tmpFile.flush()  # I do not anderstand but this is needed....
-                self.shm_id = self._tmpFile.name
-                self.mmap = mmap.mmap(self._tmpFile.fileno(), self.nbytes, mmap.MAP_SHARED, mmap.PROT_WRITE)
+                if backend == 'posix':
+                    self.shm_id = os.path.join('/dev/shm', _random_name())
+                    fd = os.open(self.shm_id, os.O_CREAT | os.O_EXCL | os.O_RDWR, 0o600)
+                    self._file = os.fdopen(fd, 'r+b')
+                    self._finalizer = weakref.finalize(self, _unlink, self.shm_id)
+                elif backend == 'memfd':
+                    mfd_flags = 0
+                    if hugepages:
+                        mfd_flags |= os.MFD_HUGETLB
+                        # hugetlb files can only be sized by whole huge pages
+                        hpsize = _hugepage_size()
+                        self.nbytes = -(-self.nbytes // hpsize) * hpsize
+                    fd = os.memfd_create(_random_name(), mfd_flags)
+                    self._file = os.fdopen(fd, 'r+b')
+                    self.shm_id = '/proc/%d/fd/%d' % (os.getpid(), fd)
+                else:
+                    self._file = tempfile.NamedTemporaryFile(prefix=u'pyacq_SharedMem_')
+                    self.shm_id = self._file.name
+                try:
+                    _allocate(self._file.fileno(), self.nbytes)
+                except OSError:
+                    self._file.close()
+                    self.unlink()
+                    raise
+                self.mmap = mmap.mmap(self._file.fileno(), self.nbytes, flags, mmap.PROT_READ | mmap.PROT_WRITE)
+                if hugepages and backend != 'memfd' and hasattr(mmap, 'MADV_HUGEPAGE'):
+                    try:
+                        self.mmap.madvise(mmap.MADV_HUGEPAGE)
+                    except OSError:
+                        # transparent huge pages are not available for this file
+                        pass
             else:
-                self._tmpFile = open(self.shm_id, 'rb')
-                self.mmap = mmap.mmap(self._tmpFile.fileno(), self.nbytes, mmap.MAP_SHARED, mmap.PROT_READ)
+                self._file = open(self.shm_id, 'rb')
+                self.mmap = mmap.mmap(self._file.fileno(), self.nbytes, flags, mmap.PROT_READ)
                 
     def close(self):
         """Close this buffer.
+        
+        If this SharedMem created a 'posix' buffer, the file is also unlinked.
         """
         self.mmap.close()
-        if not sys.platform.startswith('win') and hasattr(self, '_tmpFile'):
-            self._tmpFile.close()
+        if hasattr(self, '_file'):
+            self._file.close()
+        self.unlink()
+    
+    def unlink(self):
+        """Remove the name of a buffer created with the 'posix' backend.
+        
+        The memory is released once all processes have closed the buffer, but
+        new processes can no longer open it. This has no effect for other
+        backends or for buffers opened from an existing *shm_id*.
+        """
+        if self._finalizer is not None:
+            self._finalizer()
     
     def to_dict(self):
         """Return a dict that can be serialized and sent to other processes to
@@ -67,9 +154,39 @@ class SharedMem:
         """
         return np.ndarray(buffer=self.mmap, shape=shape,
                           strides=strides, offset=offset, dtype=dtype)        
-        
 
 
+def _allocate(fd, nbytes):
+    # Size the file and reserve its storage. A sparse file (ftruncate) on a
+    # full tmpfs would only fail on the first write to a missing page, with
+    # SIGBUS; posix_fallocate raises OSError (ENOSPC) here instead.
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, nbytes)
+            return
+        except OSError as exc:
+            if exc.errno not in (errno.EOPNOTSUPP, errno.EINVAL):
+                raise
+    # file system without fallocate support
+    os.ftruncate(fd, nbytes)
+
+
+def _hugepage_size():
+    try:
+        with open('/proc/meminfo') as fh:
+            for line in fh:
+                if line.startswith('Hugepagesize:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 2**21
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
 
 
 class SharedArray:
@@ -7,7 +7,19 @@ import numpy as np
 
 from .streamhelpers import DataSender, DataReceiver, register_transfermode
 from .ringbuffer import RingBuffer
-from .arraytools import make_dtype
+from .arraytools import make_dtype, channels_to_slice
+
+
+# notification sent for each chunk: index, size, generation
+_notify_struct = struct.Struct('!QQQ')
+
+
+class StreamOverrunError(IndexError):
+    """Raised when data requested from a shared memory stream has already
+    been overwritten by the sender.
+    """
+    pass
+
 
 class SharedMemSender(DataSender):
     """Stream sender that uses shared memory for efficient interprocess
@@ -23,23 +35,74 @@ class SharedMemSender(DataSender):
     * double (bool) if True, then the buffer size is doubled and all frames are
       written to the buffer twice. This makes it possible to guarantee
       zero-copy reads by any connected InputStream.
+    * mirror_size (int) With double=False, guarantee zero-copy reads of up
+      to this many frames. Only the frames written at the beginning of the
+      buffer are written a second time, to a mirror area of this size that
+      follows the end of the buffer (see :class:`RingBuffer`).
     * axisorder (tuple) The order that buffer axes should be arranged in
       memory. This makes it possible to optimize for specific algorithms that
       expect either row-major or column-major alignment. The default is
       row-major; the time axis comes first in the axis order.
     * fill (float) Value used to fill the buffer where no data is available.
+    * shm_backend (str) The method used to allocate shared memory
+      (see :class:`SharedMem <stream.sharedarray.SharedMem>`). The default
+      is to use ``/dev/shm`` where available.
+    * populate (bool) If True, pre-fault the shared memory pages when the
+      buffer is created instead of on the first write.
+    * hugepages (bool) If True, request huge pages for the shared memory.
+    * view_of (dict) The params of another 'sharedmem' stream. Instead of
+      allocating a buffer, this stream publishes the *channels* of the shared
+      buffer of that stream: :func:`send` only notifies receivers of a chunk
+      that was already written there, and receivers read it as a strided
+      view. Use ``send(None, index=index, size=size)``. The buffer options
+      above are taken from *view_of*.
+    * channels (list) With *view_of*, the channels (axis 1) of the source
+      buffer that make up this stream. They must be increasing and regularly
+      spaced (for example ``[4, 5, 6, 7]`` or ``[0, 2, 4]``).
     """
     def __init__(self, socket, params):
         DataSender.__init__(self, socket, params)
+        self.view_of = self.params.get('view_of', None)
+        if self.view_of is not None:
+            self._init_view()
+            return
         self.size = self.params['buffer_size']
         shape = (self.size,) + tuple(self.params['shape'][1:])
+        shm_options = dict(backend=self.params.get('shm_backend', None),
+                           populate=self.params.get('populate', False),
+                           hugepages=self.params.get('hugepages', False))
         self._buffer = RingBuffer(shape=shape, dtype=make_dtype(self.params['dtype']),
                                   shmem=True, axisorder=self.params['axisorder'],
-                                  double=self.params['double'], fill=self.params['fill'])
+                                  double=self.params['double'], fill=self.params['fill'],
+                                  mirror_size=self.params.get('mirror_size'), shm_options=shm_options)
         self.params['shm_id'] = self._buffer.shm_id
     
-    def send(self, index, data):
-        assert data.dtype == self.params['dtype']
+    def _init_view(self):
+        source = self.view_of
+        if channels_to_slice(self.params['channels']) is None:
+            raise ValueError("channels of a sharedmem view must be increasing and "
+                             "regularly spaced; got %s" % self.params['channels'])
+        assert make_dtype(self.params['dtype']) == make_dtype(source['dtype'])
+        for k in ('shm_id', 'buffer_size', 'double', 'axisorder'):
+            self.params[k] = source[k]
+        self.params['mirror_size'] = source.get('mirror_size')
+        self.size = source['buffer_size']
+        shape = (self.size,) + tuple(source['shape'][1:])
+        self._buffer = RingBuffer(shape=shape, dtype=source['dtype'], double=source['double'],
+                                  shmem=source['shm_id'], axisorder=source['axisorder'],
+                                  mirror_size=self.params['mirror_size'])
+    
+    def send(self, index, data, size=None):
+        if self.view_of is not None:
+            # data is already in the source buffer
+            if size is None:
+                size = data.shape[0]
+            stat = _notify_struct.pack(index, size, self._buffer.generation()) + self.header_trailer()
+            self.socket.send_multipart([stat])
+            return
+        
+        if not self._buffer._convert:
+            assert data.dtype == self.params['dtype']
         shape = data.shape
         if self.params['shape'][0] != -1:
             assert shape == self.params['shape']
@@ -48,24 +111,51 @@ class SharedMemSender(DataSender):
  
         self._buffer.new_chunk(data, index)
         
-        stat = struct.pack('!' + 'QQ', index, shape[0])
+        stat = _notify_struct.pack(index, shape[0], self._buffer.generation()) + self.header_trailer()
         self.socket.send_multipart([stat])
     
     def reset_index(self):
-        self._buffer.reset_index()
+        if self.view_of is None:
+            self._buffer.reset_index()
 
 
 class SharedMemReceiver(DataReceiver):
+    """Stream receiver for the 'sharedmem' transfer mode.
+    
+    Each notification carries the index and size of the new chunk together
+    with the write generation of the shared ring buffer (see
+    :func:`RingBuffer.generation`).
+    
+    If a chunk has already been overwritten in the ring buffer by the time it
+    is read with ``recv(return_data=True)``, then either StreamOverrunError
+    is raised or the overwritten sample count is accumulated in
+    ``overrun_samples`` and None is returned in place of the data (see the
+    *on_overrun* argument of :func:`recv`, whose default can be set with the
+    ``on_overrun`` stream parameter). Use :func:`lag` to monitor how far
+    the consumer is behind the sender.
+    """
     def __init__(self, socket, params):
         # init data receiver with no ring buffer; we will implement our own from shm.
         DataReceiver.__init__(self, socket, params)
 
         self.size = self.params['buffer_size']
         shape = (self.size,) + tuple(self.params['shape'][1:])
+        channels = None
+        view_of = self.params.get('view_of', None)
+        if view_of is not None:
+            # channel subset of the buffer of another stream
+            shape = (self.size,) + tuple(view_of['shape'][1:])
+            channels = channels_to_slice(self.params['channels'])
         self.buffer = RingBuffer(shape=shape, dtype=self.params['dtype'], double=self.params['double'],
-                                 shmem=self.params['shm_id'], axisorder=self.params['axisorder'])
+                                 shmem=self.params['shm_id'], axisorder=self.params['axisorder'],
+                                 channels=channels, mirror_size=self.params.get('mirror_size'))
+        self.on_overrun = self.params.get('on_overrun', 'raise')
+        self.last_index = 0
+        self.last_size = 0
+        self.last_generation = 0
+        self.overrun_samples = 0
 
-    def recv(self, return_data=False):
+    def recv(self, return_data=False, on_overrun=None, validate=False):
         """Receive message indicating the index of the next data chunk.
         
         Parameters:
@@ -75,14 +165,63 @@ class SharedMemReceiver(DataReceiver):
             from the shared ring buffer). If False, then return None in place
             of data (the new data can still be accessed using __getitem__). The
             default is False.
+        on_overrun : 'raise', 'count' or None
+            What to do if the chunk was overwritten before it could be read
+            (only when *return_data* is True). 'raise' raises
+            StreamOverrunError; 'count' adds the number of lost samples to
+            ``overrun_samples`` and returns None in place of data. If None,
+            use the ``on_overrun`` stream parameter (default 'raise').
+        validate : bool
+            If True, the chunk is copied and checked for concurrent overwrites
+            (see :func:`RingBuffer.get_data`).
         """
         stat = self.socket.recv_multipart()[0]
-        index, size = struct.unpack('!QQ', stat)
-        if return_data:
-            data = self.buffer[index-size:index]
-        else:
+        index, size, generation = _notify_struct.unpack_from(stat)
+        self.read_trailer(stat)
+        self.last_index = index
+        self.last_size = size
+        self.last_generation = generation
+        if not return_data:
+            return index, None
+        
+        if on_overrun is None:
+            on_overrun = self.on_overrun
+        start = index - size
+        try:
+            if validate:
+                data = self.buffer.get_data(start, index, validate=True)
+            else:
+                data = self.buffer[start:index]
+                # the view is only valid if the writer had not yet advanced past it
+                if start < self.buffer._write_index - self.size:
+                    raise IndexError()
+        except IndexError:
+            # (a reset of the sender index also makes the whole chunk unavailable)
+            lost = min(size, max(int(self.buffer._write_index) - self.size - start, 0)) or size
+            if on_overrun == 'raise':
+                raise StreamOverrunError("Chunk (%d, %d) was overwritten in shared memory "
+                                         "before it could be read (%d samples lost)." %
+                                         (start, index, lost))
+            self.overrun_samples += lost
             data = None
         return index, data
 
+    def lag(self):
+        """Return the number of samples written by the sender since the last
+        notification received by :func:`recv`.
+        
+        A lag larger than ``buffer_size`` means that data has been lost.
+        """
+        return int(self.buffer.index()) - self.last_index
+
+    def queue_depth(self):
+        return self.lag_chunks()
+
+    def lag_chunks(self):
+        """Return the number of chunks written by the sender since the last
+        notification received by :func:`recv`.
+        """
+        return (self.buffer.generation() - self.last_generation) // 2
+
 
 register_transfermode('sharedmem', SharedMemSender, SharedMemReceiver)
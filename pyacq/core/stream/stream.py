@@ -4,14 +4,21 @@
 
 import random
 import string
+import time
+import asyncio
+import threading
 import zmq
+import zmq.asyncio
 import numpy as np
 import weakref
 
 from .ringbuffer import RingBuffer
 from .streamhelpers import all_transfermodes
-from ..rpc import ObjectProxy
+from ..rpc import ObjectProxy, RPCServer
 from .arraytools import fix_struct_dtype, make_dtype
+from .flowcontrol import FlowControlSender, FlowControlReceiver, make_flow_control
+from .telemetry import StreamStats
+from ..clocksync import common_time
 
 
 default_stream = dict(
@@ -25,15 +32,34 @@ default_stream = dict(
     axisorder=None,
     buffer_size=0,
     compression='',
+    compression_opts=None,
     scale=None,
     offset=None,
     units='',
     sample_rate=1.,
     double=False,#make sens only for transfermode='sharemem',
+    mirror_size=None,
     fill=None,
+    coalesce=None,
+    hwm=None,
+    flow_control=None,
+    timestamps=False,
 )
 
 
+def _async_socket(stream):
+    """Return a zmq.asyncio shadow of *stream.socket* for the running event loop.
+    
+    The shadow shares the underlying zmq socket, so the regular (blocking)
+    senders and receivers can be used as soon as the socket is ready.
+    """
+    loop = asyncio.get_running_loop()
+    if getattr(stream, '_asocket_loop', None) is not loop:
+        stream._asocket = zmq.asyncio.Socket.from_socket(stream.socket)
+        stream._asocket_loop = loop
+    return stream._asocket
+
+
 class OutputStream(object):
     """Class for streaming data to an InputStream.
     
@@ -54,11 +80,15 @@ class OutputStream(object):
         self.last_index = 0
         self.configured = False
         self.spec = spec  # this is a priori stream params, and must be change when Node.configure
+        self._stats = StreamStats()
         if node is not None:
             self.node = weakref.ref(node)
         else:
             self.node = None
         self.name = name
+        # guards the socket and staged data, which the flush thread also uses
+        self._lock = threading.RLock()
+        self._flusher = None
     
     def configure(self, **kargs):
         """
@@ -77,6 +107,7 @@ class OutputStream(object):
             
             * 'plaindata': data are sent over a plain socket in two parts: (frame index, data).
             * 'sharedmem': data are stored in shared memory in a ring buffer and the current frame index is sent over the socket.
+            * 'local': (``protocol='inproc'`` only) a read-only reference to the data is handed to receivers in the same process and only the frame index is sent over the socket.
             * 'shared_cuda_buffer': (planned) data are stored in shared Cuda buffer and the current frame index is sent over the socket.
             * 'share_opencl_buffer': (planned) data are stored in shared OpenCL buffer and the current frame index is sent over the socket.
             
@@ -91,17 +122,58 @@ class OutputStream(object):
             
             * For ``streamtype=image``, the shape should be ``(-1, H, W)`` or ``(n_frames, H, W)``.
             * For ``streamtype=analogsignal`` the shape should be ``(n_samples, n_channels)`` or ``(-1, n_channels)``.
-        compression: '', 'blosclz', 'blosc-lz4'
+        compression: '', 'blosc-blosclz', 'blosc-lz4', 'zstd', 'shuffle-lz4', ...
             The compression for the data stream. The default uses no compression.
-        scale: float
-            An optional scale factor + offset to apply to the data before it is sent over the stream.
-            ``output = offset + scale * input``
-        offset:
+            All usable methods are listed in `pyacq.core.stream.compression_methods`;
+            others can be added with `pyacq.core.stream.register_compression()`.
+        compression_opts: dict or None
+            Options for the compression method (for example ``level``,
+            ``clevel``, ``shuffle`` or ``nthreads``).
+        scale: float | list
+            An optional scale factor (scalar or one value per channel) that
+            converts the transmitted samples to physical values:
+            ``physical = offset + scale * data``.
+            Data are sent unchanged (typically as raw integers); receivers
+            apply the conversion with ``InputStream.set_buffer(scaled=True)``.
+        offset: float | list
             See *scale*.
         units: str
             Units of the stream data. Mainly used for 'analogsignal'.
         sample_rate: float or None
             Sample rate of the stream in Hz.
+        coalesce: dict or None
+            If given, consecutive chunks passed to :func:`send` are accumulated
+            and sent as a single message, which reduces the per-message
+            overhead for devices that produce many tiny chunks. The dict must
+            contain ``max_samples`` (flush once this many samples are staged)
+            and may contain ``max_latency`` (flush once the oldest staged
+            sample has waited this many ms; this is checked by a background
+            thread, so staged data is also sent when the device pauses).
+            Use :func:`flush` to send staged data immediately. Requires a
+            variable chunk size (``shape[0] == -1``).
+        hwm: int or None
+            The zmq high-water mark (number of queued messages) of the stream
+            sockets. The default uses the zmq default (1000).
+        flow_control: dict, True or None
+            If given, the stream is lossless: it uses ROUTER/DEALER sockets
+            with sequence numbers and credit-based flow control instead of
+            PUB/SUB. The dict may contain ``credit`` (chunks a receiver accepts
+            in flight, default 32), ``queue_size`` (chunks queued per receiver
+            by the sender, default 256), ``policy`` (what :func:`send` does when
+            a queue is full: 'block' (default), 'drop-oldest' or 'spill' to a
+            temporary file in ``spill_dir``) and ``timeout`` (ms before a
+            blocked send raises TimeoutError; default wait forever).
+            Queued chunks are delivered by a background thread as soon as
+            receivers grant credit, even if :func:`send` is not called again.
+            See :mod:`pyacq.core.stream.flowcontrol`.
+        timestamps: bool
+            If True, the header of each chunk carries its send time and its
+            origin: the time at which its data was produced and the id of the
+            producing node (see :func:`send`). Receivers report the resulting
+            latencies in :func:`InputStream.stats`. Times are read from the
+            monotonic ``time.perf_counter()`` clock, so both ends must run on
+            the same host unless the clock sync service of the Manager is
+            running (see :func:`Manager.start_clock_sync`).
         kwargs :
             All extra keyword arguments are passed to the DataSender constructor
             for the chosen transfermode (for example, see 
@@ -131,8 +203,14 @@ class OutputStream(object):
         else:
             self.url = '{protocol}://{interface}:{port}'.format(**self.params)
         context = zmq.Context.instance()
-        self.socket = context.socket(zmq.PUB)
+        if self.params['flow_control']:
+            self.socket = FlowControlSender(context, zmq.ROUTER)
+            self.socket.setup(make_flow_control(self.params['flow_control']))
+        else:
+            self.socket = context.socket(zmq.PUB)
         self.socket.linger = 1000  # don't let socket deadlock when exiting
+        if self.params['hwm'] is not None:
+            self.socket.sndhwm = self.params['hwm']
         self.socket.bind(self.url)
         self.addr = self.socket.getsockopt(zmq.LAST_ENDPOINT).decode()
         self.port = self.addr.rpartition(':')[2]
@@ -143,12 +221,24 @@ class OutputStream(object):
             raise ValueError("Unsupported transfer mode '%s'" % transfermode)
         sender_class = all_transfermodes[transfermode][0]
         self.sender = sender_class(self.socket, self.params)
+        
+        self._init_coalesce()
+        self._stats.reset()
+        if self.params['flow_control'] or (self._stage is not None and self._max_latency is not None):
+            self._flusher = _FlushThread(self)
+            if self._stage is not None and self._max_latency is not None:
+                self._flusher.interval = min(self._flusher.interval, self._max_latency / 2)
+            self._flusher.start()
 
         self.configured = True
+        # params may be cached by remote InputStreams
+        server = RPCServer.current()
+        if server is not None:
+            server.invalidate(self)
         if self.node and self.node():
             self.node().after_output_configure(self.name)
 
-    def send(self, data, index=None, **kargs):
+    def send(self, data, index=None, origin=None, **kargs):
         """Send a data chunk and its frame index.
         
         Parameters
@@ -157,32 +247,236 @@ class OutputStream(object):
             The absolute sample index. This is the index of the last sample + 1.
         data: np.ndarray or bytes
             The chunk of data to send.
+        origin: tuple or None
+            ``(timestamp, origin_id)`` of the data, only used with the
+            ``timestamps`` stream parameter. Nodes that process data received
+            from an InputStream pass its :attr:`InputStream.last_origin` here
+            so that the end-to-end latency can be measured downstream. By
+            default the data originates here: the timestamp is the current
+            time (see :func:`clocksync.common_time`) and the id is
+            ``'node_name.output_name'``.
         """
-        if index is None:
-            index = self.last_index + data.shape[0]
-        self.last_index = index
+        with self._lock:
+            if index is None:
+                index = self.last_index + data.shape[0]
+            self.last_index = index
+            if self._stage is None or len(kargs) > 0:
+                self.flush()
+                self._send_chunk(index, data, origin, **kargs)
+            else:
+                self._coalesce(index, data, origin)
+            if self._flusher is not None:
+                self._flusher.wake.set()
+
+    def _send_chunk(self, index, data, origin=None, **kargs):
+        if self.params['timestamps']:
+            if origin is None:
+                origin = (common_time(), self.origin_id())
+            self.sender.origin = origin
         self.sender.send(index, data, **kargs)
+        self._stats.count(index, data)
+
+    def origin_id(self):
+        """Return the id of this output used as the origin of the data it
+        produces (see :func:`send`).
+        """
+        node = self.node() if self.node else None
+        if node is None:
+            return self.name or ''
+        return '%s.%s' % (node.name, self.name)
+
+    def stats(self):
+        """Return a dict of counters describing the traffic on this stream.
+        
+        Keys are ``chunks`` and ``bytes`` (totals sent), ``chunks_per_s`` and
+        ``bytes_per_s`` (averaged since the previous call to :func:`stats`),
+        ``last_index``, ``index_gaps`` and ``missed_samples`` (discontinuities
+        in the sent indexes), ``uptime`` (s) and ``queue_depth``: the largest
+        number of chunks queued for a receiver with *flow_control*, None
+        otherwise. With *flow_control*, ``dropped_chunks`` and
+        ``spilled_chunks`` are also given.
+        """
+        stats = self._stats.snapshot()
+        for k in ('latency', 'latency_mean', 'latency_max', 'origin_latency',
+                  'origin_latency_mean', 'origin_latency_max', 'origin_latency_hist'):
+            del stats[k]
+        stats['queue_depth'] = None
+        if self.configured and self.params['flow_control']:
+            with self._lock:
+                status = list(self.socket.status().values())
+            stats['queue_depth'] = max([st['queued'] for st in status], default=0)
+            stats['dropped_chunks'] = sum(st['dropped'] for st in status)
+            stats['spilled_chunks'] = sum(st['spilled'] for st in status)
+        return stats
+
+    async def asend(self, data, index=None, **kargs):
+        """Coroutine version of :func:`send`.
+        
+        Waits without blocking the event loop until the socket can accept a
+        new message, then sends the chunk. Note that without *flow_control*
+        the zmq.PUB socket never blocks: once its high-water mark is reached,
+        messages are dropped. With ``flow_control=dict(policy='block')`` this
+        waits until all receivers have granted enough credit.
+        """
+        if self.params['flow_control']:
+            while True:
+                with self._lock:
+                    if self.socket.ready():
+                        break
+                await _async_socket(self).poll(flags=zmq.POLLIN)
+        else:
+            await _async_socket(self).poll(flags=zmq.POLLOUT)
+        self.send(data, index=index, **kargs)
+
+    def _init_coalesce(self):
+        self._stage = None
+        coalesce = self.params['coalesce']
+        if not coalesce:
+            return
+        shape = self.params['shape']
+        assert shape[0] == -1, "coalesce requires a variable chunk size (shape[0] == -1)"
+        max_samples = coalesce.get('max_samples', None)
+        max_latency = coalesce.get('max_latency', None)
+        assert max_samples is not None and max_samples > 0, \
+            "coalesce requires max_samples (the number of samples staged before sending)"
+        self._max_latency = None if max_latency is None else max_latency / 1000.
+        self._stage = np.empty((max_samples,) + tuple(shape[1:]), dtype=make_dtype(self.params['dtype']))
+        self._stage_size = 0
+        self._stage_index = 0  # index of the last staged sample + 1
+        self._stage_time = None  # time at which the first staged chunk arrived
+        self._stage_origin = None  # origin of the first staged chunk
+
+    def _coalesce(self, index, data, origin=None):
+        dsize = data.shape[0]
+        if self._stage_size > 0 and (index - dsize != self._stage_index or
+                                     self._stage_size + dsize > self._stage.shape[0]):
+            # non-consecutive chunk or not enough room left
+            self.flush()
+        if dsize >= self._stage.shape[0]:
+            self._send_chunk(index, data, origin)
+            return
+        if self._stage_size == 0:
+            self._stage_time = time.perf_counter()
+            if origin is None and self.params['timestamps']:
+                origin = (common_time(self._stage_time), self.origin_id())
+            self._stage_origin = origin
+        self._stage[self._stage_size:self._stage_size+dsize] = data
+        self._stage_size += dsize
+        self._stage_index = index
+        if self._stage_size == self._stage.shape[0] or (self._max_latency is not None and 
+                time.perf_counter() - self._stage_time >= self._max_latency):
+            self.flush()
+
+    def flush(self):
+        """Send any data staged by the *coalesce* option.
+        
+        This is called automatically when the stream is closed, when its
+        Node is stopped and when staged data is full or too old.
+        
+        With *flow_control*, this also sends queued chunks to receivers that
+        have granted new credit.
+        """
+        with self._lock:
+            if not self.configured:
+                return
+            if self.params['flow_control']:
+                self.socket.process_control()
+            if self._stage is None or self._stage_size == 0:
+                return
+            data = self._stage[:self._stage_size]
+            # the sent chunk may still be referenced (zero-copy send), so staging
+            # continues in a new buffer instead of overwriting this one
+            self._stage = np.empty_like(self._stage)
+            self._stage_size = 0
+            self._send_chunk(self._stage_index, data, self._stage_origin)
+    
+    def _background_flush(self):
+        # Called periodically by the flush thread while it is awake.
+        with self._lock:
+            if not self.configured or self._flusher is None:
+                return
+            waiting = False
+            if self._stage is not None and self._stage_size > 0 and self._max_latency is not None:
+                if time.perf_counter() - self._stage_time >= self._max_latency:
+                    self.flush()
+                else:
+                    waiting = True
+            if self.params['flow_control']:
+                self.socket.process_control()
+                waiting = waiting or self.socket.pending() > 0
+            if not waiting:
+                # nothing left to deliver; sleep until the next send()
+                self._flusher.wake.clear()
 
     def close(self):
         """Close the output.
         
         This closes the socket and releases shared memory, if necessary.
         """
-        self.sender.close()
-        self.socket.close()
-        del self.socket
-        del self.sender
+        if self._flusher is not None:
+            self._flusher.stop()
+            self._flusher = None
+        with self._lock:
+            self.flush()
+            if self.params['flow_control']:
+                # give slow receivers a chance to get the queued chunks
+                self.socket.drain(timeout=self.socket.linger)
+            self.sender.close()
+            self.socket.close()
+            del self.socket
+            del self.sender
     
     def reset_buffer_index(self):
         """
         Reset the buffer index.
         Usefull for multiple start/stop on Node to reset the index.
         """
-        self.last_index = 0
-        self.sender.reset_index()
+        with self._lock:
+            self.last_index = 0
+            if self._stage is not None:
+                self._stage_size = 0
+            self.sender.reset_index()
 
 
 
+class _FlushThread(threading.Thread):
+    """Thread that flushes an OutputStream in the background while it has
+    chunks waiting to be delivered (queued by flow control or staged by
+    *coalesce* with ``max_latency``), so that they do not wait for the next
+    call to :func:`OutputStream.send`.
+    
+    The thread sleeps while its ``wake`` event is cleared.
+    """
+    #: time (s) between two flushes while chunks are waiting
+    interval = 0.005
+    
+    def __init__(self, output):
+        threading.Thread.__init__(self, daemon=True, name='OutputStreamFlush')
+        self.output = weakref.ref(output)
+        self.wake = threading.Event()
+        self.stopped = False
+    
+    def run(self):
+        while not self.stopped:
+            if not self.wake.wait(timeout=1.):
+                # check from time to time that the stream still exists
+                if self.output() is None:
+                    return
+                continue
+            output = self.output()
+            if output is None or self.stopped:
+                return
+            output._background_flush()
+            output = None
+            time.sleep(self.interval)
+    
+    def stop(self):
+        self.stopped = True
+        self.wake.set()
+        if self is not threading.current_thread():
+            self.join()
+
+
 def _shape_equal(shape1, shape2):
     """
     Check if shape of stream are compatible.
@@ -232,6 +526,10 @@ class InputStream(object):
         self.name = name
         self.buffer = None
         self._own_buffer = False  # whether InputStream should populate buffer
+        self._stats = StreamStats()
+        # (timestamp, origin_id) of the last received chunk (see OutputStream.send)
+        self.last_origin = None
+        self._origin_index = None
     
     def connect(self, output):
         """Connect an output to this input.
@@ -249,7 +547,8 @@ class InputStream(object):
         elif isinstance(output, OutputStream):
             self.params = output.params
         elif isinstance(output, ObjectProxy):
-            self.params = output.params._get_value()
+            # cached until the output is configured again
+            self.params = output._deferred_attr('params', cache='frozen')._get_value()
         else:
             raise TypeError("Invalid type for stream: %s" % type(output))
             
@@ -276,17 +575,26 @@ class InputStream(object):
                 self.params[k] = v
         
         context = zmq.Context.instance()
-        self.socket = context.socket(zmq.SUB)
+        flow_control = self.params.get('flow_control', None)
+        if flow_control:
+            self.socket = FlowControlReceiver(context, zmq.DEALER)
+        else:
+            self.socket = context.socket(zmq.SUB)
+            self.socket.setsockopt(zmq.SUBSCRIBE, b'')
         self.socket.linger = 1000  # don't let socket deadlock when exiting
-        self.socket.setsockopt(zmq.SUBSCRIBE, b'')
+        if self.params.get('hwm', None) is not None:
+            self.socket.rcvhwm = self.params['hwm']
         #~ self.socket.setsockopt(zmq.DELAY_ATTACH_ON_CONNECT,1)
         self.socket.connect(self.url)
+        if flow_control:
+            self.socket.setup(make_flow_control(flow_control))
         
         transfermode = self.params['transfermode']
         if transfermode not in all_transfermodes:
             raise ValueError("Unsupported transfer mode '%s'" % transfermode)
         receiver_class = all_transfermodes[transfermode][1]
         self.receiver = receiver_class(self.socket, self.params)
+        self._stats.reset()
         
         self.connected = True
         if self.node and self.node():
@@ -303,6 +611,14 @@ class InputStream(object):
         """
         Receive a chunk of data.
         
+        Keyword arguments are passed to the receiver of the stream transfer mode
+        (for example ``return_data``, or ``out`` for ``transfermode='plaindata'``;
+        see :class:`PlainDataReceiver <stream.plaindatastream.PlainDataReceiver>`).
+        If a RingBuffer is attached, the chunk is copied once from the
+        received message into the buffer.
+        With the ``timestamps`` stream parameter, :attr:`last_origin` is then
+        the ``(timestamp, origin_id)`` of the received chunk.
+        
         Returns
         -------
         index: int
@@ -315,10 +631,94 @@ class InputStream(object):
             to return the received data chunk.
         """
         index, data = self.receiver.recv(**kargs)
+        origin = self.last_origin = self.receiver.last_origin
+        self._origin_index = index
+        if origin is None:
+            self._stats.count(index, data)
+        else:
+            now = common_time()
+            self._stats.count(index, data, now - self.receiver.last_send_time, now - origin[0])
         if self._own_buffer and data is not None and self.buffer is not None:
             self.buffer.new_chunk(data, index=index)
         return index, data
     
+    async def arecv(self, timeout=None, **kargs):
+        """Coroutine version of :func:`recv`.
+        
+        Waits without blocking the event loop until a packet is available,
+        then receives it. If *timeout* (ms) elapses first, raise TimeoutError.
+        """
+        ev = await _async_socket(self).poll(timeout=timeout, flags=zmq.POLLIN)
+        if ev == 0:
+            raise TimeoutError("No data received on InputStream within %s ms" % timeout)
+        return self.recv(**kargs)
+    
+    async def aiter(self, **kargs):
+        """Asynchronously iterate over incoming packets::
+        
+            async for index, data in input_stream.aiter(return_data=True):
+                ...
+        
+        Keyword arguments are passed to :func:`recv`. Packets queue up in the
+        zmq socket (up to its high-water mark) while the consumer is busy.
+        """
+        while True:
+            yield await self.arecv(**kargs)
+    
+    def stats(self):
+        """Return a dict of counters describing the traffic on this stream.
+        
+        Keys are ``chunks`` and ``bytes`` (totals received; bytes are only
+        counted for chunks whose data was returned), ``chunks_per_s`` and
+        ``bytes_per_s`` (averaged since the previous call to :func:`stats`),
+        ``last_index``, ``index_gaps`` and ``missed_samples`` (discontinuities
+        in the received indexes), ``uptime`` (s), ``latency``,
+        ``latency_mean`` and ``latency_max`` (s, from send to receive; only
+        with the ``timestamps`` stream parameter), ``origin_latency``,
+        ``origin_latency_mean``, ``origin_latency_max`` (s, from the
+        production of the data at the start of the pipeline to its reception
+        here) and ``origin_latency_hist`` (number of chunks per latency bin;
+        see :data:`telemetry.latency_bins`) and ``queue_depth``: the
+        number of chunks waiting to be received, exact for the 'sharedmem'
+        and 'local' transfer modes and otherwise estimated from the latency.
+        With *flow_control*, ``missed_chunks`` counts the chunks dropped by
+        the sender.
+        """
+        stats = self._stats.snapshot()
+        depth = self.receiver.queue_depth()
+        if depth is None and stats['latency_mean'] is not None:
+            depth = int(stats['latency_mean'] * stats['chunks_per_s'])
+        stats['queue_depth'] = depth
+        if self.params.get('flow_control', None):
+            stats['missed_chunks'] = self.socket.missed_chunks
+        return stats
+    
+    def lag(self):
+        """Return the number of samples the sender has produced beyond the
+        last chunk received by this stream.
+        
+        This is only supported by transfer modes that can observe the sender
+        position (for example ``transfermode='sharedmem'``); other modes raise
+        NotImplementedError.
+        """
+        return self.receiver.lag()
+    
+    def index_to_time(self, index):
+        """Return the time at which the sample *index* (int or array) was
+        produced, in the common timebase of :func:`clocksync.common_time`.
+        
+        The time is extrapolated with the ``sample_rate`` of the stream from
+        the origin timestamp of the last received chunk, taken as the time of
+        its last sample. This requires the ``timestamps`` stream parameter.
+        With the clock sync service of the Manager running, this aligns
+        streams produced on different hosts (see
+        :func:`Manager.start_clock_sync`).
+        """
+        if self.last_origin is None:
+            raise ValueError("index_to_time requires a stream configured with "
+                             "timestamps=True that has received data")
+        return self.last_origin[0] + (index - self._origin_index) / self.params['sample_rate']
+    
     def empty_queue(self):
         """
         Receive all pending messing in the zmq queue without consuming them.
@@ -363,21 +763,34 @@ class InputStream(object):
             raise TypeError("No ring buffer configured for this InputStream.")
         return self.buffer.get_data(*args, **kargs)
     
-    def set_buffer(self, size=None, double=True, axisorder=None, shmem=None, fill=None):
+    def set_buffer(self, size=None, double=True, axisorder=None, shmem=None, fill=None, scaled=False,
+                   mirror_size=None):
         """Ensure that this InputStream has a RingBuffer at least as large as 
         *size* and with the specified double-mode and axis order.
         
         If necessary, this will attach a new RingBuffer to the stream and remove
         any existing buffer.
+        
+        If *scaled* is True and the stream defines ``scale`` and/or ``offset``,
+        the buffer holds physical values (``offset + scale * data``) as
+        floating point; the conversion is done while each received chunk is
+        copied into the buffer.
+        
+        With ``double=False``, *mirror_size* gives the length of the segments
+        that can still be read without copy (see :class:`RingBuffer`).
         """
+        scale, offset = self.params.get('scale'), self.params.get('offset')
+        convert = scaled and (scale is not None or offset is not None)
+        
         # first see if we already have a buffer that meets requirements
         bufs = []
         if self.buffer is not None:
             bufs.append((self.buffer, self._own_buffer))
-        if self.receiver.buffer is not None:
+        if self.receiver.buffer is not None and not convert:
             bufs.append((self.receiver.buffer, False))
         for buf, own in bufs:
-            if buf.shape[0] >= size and buf.double == double and (axisorder is None or all(buf.axisorder == axisorder)):
+            if buf.shape[0] >= size and buf.double == double and (axisorder is None or all(buf.axisorder == axisorder)) \
+                    and buf._convert == convert and (mirror_size is None or (buf.mirror_size or 0) >= mirror_size):
                 self.buffer = buf
                 self._own_buffer = own
                 return
@@ -385,7 +798,12 @@ class InputStream(object):
         # attach a new buffer
         shape = (size,) + tuple(self.params['shape'][1:])
         dtype = make_dtype(self.params['dtype'])
-        self.buffer = RingBuffer(shape=shape, dtype=dtype, double=double, axisorder=axisorder, shmem=shmem, fill=fill)
+        if convert:
+            dtype = np.result_type(dtype, np.float32)
+        else:
+            scale = offset = None
+        self.buffer = RingBuffer(shape=shape, dtype=dtype, double=double, axisorder=axisorder, shmem=shmem, fill=fill,
+                                 scale=scale, offset=offset, mirror_size=mirror_size)
         self._own_buffer = True
     
     def reset_buffer_index(self):
@@ -2,11 +2,25 @@
 # Copyright (c) 2016, French National Center for Scientific Research (CNRS)
 # Distributed under the (new) BSD License. See LICENSE for more info.
 
+import struct
+
+from ..clocksync import common_time
 from .arraytools import make_dtype
 from pyacq.core.rpc.proxy import ObjectProxy
 
 all_transfermodes = {}
 
+# Optional trailer appended to the header of each chunk when a stream is
+# configured with ``timestamps=True``:
+#   send time (d), origin time (d), origin id (utf-8), origin id length (H)
+# Times are given by clocksync.common_time(): the monotonic perf_counter()
+# clock, translated to the clock of the Manager when its clock sync service
+# is running (otherwise times only compare between processes of one host). The send time is that of the last hop;
+# the origin time and id are those of the node that produced the data and are
+# forwarded unchanged by processing nodes, which gives the end-to-end latency.
+_trailer_struct = struct.Struct('!dd')
+_origin_len_struct = struct.Struct('!H')
+
 def register_transfermode(modename, sender, receiver):
     global all_transfermodes
     all_transfermodes[modename] = (sender, receiver)
@@ -25,6 +39,20 @@ class DataSender:
         #~ if 'dtype' in self.params:
             #~ self.params['dtype'] = make_dtype(self.params['dtype'])
         self.funcs = []
+        self.timestamps = self.params.get('timestamps', False)
+        # (timestamp, origin_id) of the chunk being sent; see OutputStream.send
+        self.origin = None
+    
+    def header_trailer(self):
+        """Return the bytes to append to the header of the chunk being sent.
+        """
+        if not self.timestamps:
+            return b''
+        now = common_time()
+        origin_time, origin_id = self.origin or (now, '')
+        origin_id = origin_id.encode('utf-8')
+        return (_trailer_struct.pack(now, origin_time) + origin_id +
+                _origin_len_struct.pack(len(origin_id)))
 
     def send(self, index, data):
         raise NotImplementedError()
@@ -49,9 +77,33 @@ class DataReceiver:
         #~ if 'dtype' in self.params:
             #~ self.params['dtype'] = make_dtype(self.params['dtype'])
         self.buffer = None
-            
+        self.timestamps = self.params.get('timestamps', False)
+        self.last_send_time = None
+        self.last_origin = None
+    
+    def read_trailer(self, header):
+        """Read the trailer at the end of a received chunk *header* (see
+        :func:`DataSender.header_trailer`).
+        """
+        if self.timestamps:
+            end = len(header) - _origin_len_struct.size
+            n, = _origin_len_struct.unpack_from(header, end)
+            origin_id = bytes(header[end-n:end]).decode('utf-8')
+            self.last_send_time, origin_time = _trailer_struct.unpack_from(
+                header, end - n - _trailer_struct.size)
+            self.last_origin = (origin_time, origin_id)
+    
+    def queue_depth(self):
+        """Return the number of chunks waiting to be received, or None if the
+        transfer mode cannot tell.
+        """
+        return None
+
     def recv(self, return_data=False):
         raise NotImplementedError()
     
+    def lag(self):
+        raise NotImplementedError("This transfer mode does not report lag.")
+    
     def close(self):
         pass
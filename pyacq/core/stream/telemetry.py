@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+
+import time
+import bisect
+
+#: upper edges (ms) of the bins of the end-to-end latency histogram; the last
+#: bin counts all larger latencies
+latency_bins = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+
+
+class StreamStats:
+    """Counters collected by an OutputStream or InputStream for every chunk
+    it sends or receives.
+
+    Updating the counters costs a few additions per chunk; see
+    :func:`OutputStream.stats` and :func:`InputStream.stats`.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.chunks = 0
+        self.nbytes = 0
+        self.last_index = None
+        self.index_gaps = 0
+        self.missed_samples = 0
+        self.latency = None
+        self.latency_mean = None
+        self.latency_max = None
+        self.origin_latency = None
+        self.origin_latency_mean = None
+        self.origin_latency_max = None
+        self.origin_latency_hist = [0] * (len(latency_bins) + 1)
+        self._start_time = time.perf_counter()
+        # counters at the previous call to snapshot(), used for rates
+        self._prev = (self._start_time, 0, 0)
+
+    def count(self, index, data=None, latency=None, origin_latency=None):
+        """Account for one chunk ending at *index*.
+
+        *data* (if available) gives the chunk size in bytes and samples, which
+        is used to detect discontinuities in the stream index. *latency* is the
+        time (s) since the chunk was sent and *origin_latency* the time since
+        its data was produced by the first node of the pipeline.
+        """
+        self.chunks += 1
+        if data is not None and hasattr(data, 'nbytes'):
+            self.nbytes += data.nbytes
+            start = index - data.shape[0] if data.ndim > 0 else index
+            if self.last_index is not None and start > self.last_index:
+                self.index_gaps += 1
+                self.missed_samples += start - self.last_index
+        self.last_index = index
+
+        if latency is not None:
+            self.latency = latency
+            if self.latency_mean is None:
+                self.latency_mean = self.latency_max = latency
+            else:
+                # exponential moving average over ~100 chunks
+                self.latency_mean += (latency - self.latency_mean) * 0.01
+                self.latency_max = max(self.latency_max, latency)
+
+        if origin_latency is not None:
+            self.origin_latency = origin_latency
+            if self.origin_latency_mean is None:
+                self.origin_latency_mean = self.origin_latency_max = origin_latency
+            else:
+                self.origin_latency_mean += (origin_latency - self.origin_latency_mean) * 0.01
+                self.origin_latency_max = max(self.origin_latency_max, origin_latency)
+            self.origin_latency_hist[bisect.bisect_left(latency_bins, origin_latency * 1000)] += 1
+
+    def snapshot(self):
+        """Return a dict of all counters.
+
+        Rates (``chunks_per_s`` and ``bytes_per_s``) are averaged over the time
+        elapsed since the previous call (or since the stream was created).
+        """
+        now = time.perf_counter()
+        t, chunks, nbytes = self._prev
+        dt = now - t
+        self._prev = (now, self.chunks, self.nbytes)
+        return dict(
+            chunks=self.chunks,
+            bytes=self.nbytes,
+            chunks_per_s=(self.chunks - chunks) / dt if dt > 0 else 0.,
+            bytes_per_s=(self.nbytes - nbytes) / dt if dt > 0 else 0.,
+            last_index=self.last_index,
+            index_gaps=self.index_gaps,
+            missed_samples=self.missed_samples,
+            latency=self.latency,
+            latency_mean=self.latency_mean,
+            latency_max=self.latency_max,
+            origin_latency=self.origin_latency,
+            origin_latency_mean=self.origin_latency_mean,
+            origin_latency_max=self.origin_latency_max,
+            origin_latency_hist=list(self.origin_latency_hist),
+            uptime=now - self._start_time,
+        )
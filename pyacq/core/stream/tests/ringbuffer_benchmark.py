@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+
+import time
+import numpy as np
+
+from pyacq.core.stream import RingBuffer
+
+
+def benchmark_ringbuffer(chunksize, nb_channel=16, batch=None, double=True, axisorder=None,
+                         buffer_size=10000, nchunk=20000, dtype='float32'):
+    """Write *nchunk* chunks with new_chunk(), or with new_chunks() in groups
+    of *batch* chunks, and print the write rate.
+    """
+    buf = RingBuffer(shape=(buffer_size, nb_channel), dtype=dtype, double=double, axisorder=axisorder)
+    chunks = [np.random.rand(chunksize, nb_channel).astype(dtype) for i in range(16)]
+    
+    start = time.perf_counter()
+    if batch is None:
+        for i in range(nchunk):
+            buf.new_chunk(chunks[i % 16])
+    else:
+        for i in range(0, nchunk, batch):
+            buf.new_chunks([chunks[(i+j) % 16] for j in range(batch)])
+    dt = time.perf_counter() - start
+    
+    mode = 'new_chunk' if batch is None else 'new_chunks(%d)' % batch
+    print('chunksize=%-5d double=%-5s axisorder=%-6s %-16s %8.0f chunks/s  %7.1f MB/s' % (
+        chunksize, double, axisorder, mode, nchunk / dt,
+        nchunk * chunksize * nb_channel * np.dtype(dtype).itemsize * 1e-6 / dt))
+
+
+if __name__ == '__main__':
+    for chunksize in [1, 16, 256]:
+        for double in [False, True]:
+            for axisorder in [None, (1, 0)]:
+                for batch in [None, 16]:
+                    benchmark_ringbuffer(chunksize, batch=batch, double=double, axisorder=axisorder)
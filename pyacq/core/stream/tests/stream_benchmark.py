@@ -7,8 +7,8 @@ import numpy as np
 import cProfile
 import sys
 
-from test_stream import protocols, compressions
-from pyacq.core.stream  import OutputStream, InputStream
+from test_stream import protocols
+from pyacq.core.stream  import OutputStream, InputStream, compression_methods
 
 
 def benchmark_stream(protocol, transfermode, compression, chunksize, nb_channels=16, nloop=10, profile=False):
@@ -17,15 +17,14 @@ def benchmark_stream(protocol, transfermode, compression, chunksize, nb_channels
                        transfermode=transfermode, streamtype = 'analogsignal',
                        dtype='float32', shape=(-1, nb_channels), compression=compression,
                        scale=None, offset=None, units='',
-                       # for sharedarray
-                       sharedarray_shape = ( ring_size, nb_channels), timeaxis = 0,
-                       ring_buffer_method = 'double',
+                       # for sharedmem
+                       buffer_size=ring_size, double=True,
                   )
     outstream = OutputStream()
     outstream.configure(**stream_spec)
-    time.sleep(.5)
     instream = InputStream()
     instream.connect(outstream)
+    time.sleep(.5)
 
     arr = np.random.rand(chunksize, nb_channels).astype(stream_spec['dtype'])
     
@@ -47,13 +46,42 @@ def benchmark_stream(protocol, transfermode, compression, chunksize, nb_channels
     instream.close()
     
     dt = np.min(perf)
-    print(chunksize, nloop, transfermode, protocol.ljust(6), compression.ljust(13), 'time = %0.02f ms' % (dt*1000), 'speed = ', chunksize*nb_channels*4*1e-6/dt, 'MB/s')
+    print(chunksize, nloop, transfermode, protocol.ljust(6), compression.ljust(13), 'time = %0.03f ms' % (dt*1000),
+          'speed = %0.1f MB/s' % (chunksize*nb_channels*4*1e-6/dt), '%d packets/s' % (1./np.median(perf)))
     
     return dt
 
 
 
-if len(sys.argv) > 1 and sys.argv[1] == 'profile':
+def benchmark_codecs(chunksize=2**16, nb_channels=16, nloop=10):
+    """Compression ratio and speed of every codec on a correlated int16
+    signal (similar to ADC counts from neural recordings).
+    """
+    from pyacq.core.stream.compression import compress, decompress
+    
+    noise = np.random.normal(scale=20, size=(chunksize, nb_channels))
+    arr = (np.cumsum(noise, axis=0) % 30000).astype('int16')
+    buf = arr.reshape(-1).view('uint8')
+    for method in compression_methods:
+        ct, dt = [], []
+        for i in range(nloop):
+            t0 = time.perf_counter()
+            comp = compress(buf, method, arr.itemsize)
+            t1 = time.perf_counter()
+            decompress(comp, method, arr.itemsize)
+            t2 = time.perf_counter()
+            ct.append(t1 - t0)
+            dt.append(t2 - t1)
+        ratio = buf.nbytes / len(comp)
+        print(repr(method).ljust(18), 'ratio = %0.2f' % ratio,
+              'compress = %0.1f MB/s' % (buf.nbytes*1e-6/np.min(ct)),
+              'decompress = %0.1f MB/s' % (buf.nbytes*1e-6/np.min(dt)))
+
+
+if len(sys.argv) > 1 and sys.argv[1] == 'codecs':
+    benchmark_codecs()
+
+elif len(sys.argv) > 1 and sys.argv[1] == 'profile':
     benchmark_stream(protocol='inproc', transfermode='plaindata', 
                     compression='', chunksize=100000, nb_channels=16,
                     profile=True, nloop=100)
@@ -61,13 +89,22 @@ if len(sys.argv) > 1 and sys.argv[1] == 'profile':
 
 else:
     nb_channels = 16
+    # small chunks: per-packet overhead dominates (packets/s)
+    for chunksize in [16, 32, 64, 256]:
+        print('#'*5)
+        for protocol in protocols:
+            benchmark_stream(protocol=protocol, transfermode='plaindata', 
+                            compression='', chunksize=chunksize,
+                            nb_channels=nb_channels, nloop=2000)
+    
+    # large chunks: bandwidth dominates (MB/s)
     for chunksize in [2**10, 2**14, 2**16]:
         print('#'*5)
-        for compression in compressions:
+        for compression in compression_methods:
             for protocol in protocols:
                 benchmark_stream(protocol=protocol, transfermode='plaindata', 
                                 compression=compression,
                                 chunksize=chunksize, nb_channels=nb_channels)
 
-        benchmark_stream(protocol='tcp', transfermode='sharedarray', compression='',
+        benchmark_stream(protocol='tcp', transfermode='sharedmem', compression='',
                         chunksize=chunksize, nb_channels=nb_channels)
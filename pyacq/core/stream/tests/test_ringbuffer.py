@@ -6,6 +6,7 @@ import numpy as np
 import pytest
 
 from pyacq.core.stream import RingBuffer
+from pyacq.core.stream.arraytools import channels_to_slice
 
 
 def test_ringbuffer():
@@ -144,6 +145,182 @@ def test_ringbuffer_shm():
 
 
 
+def test_ringbuffer_validate():
+    buf1 = RingBuffer(shape=(10, 3), dtype='float32', double=True, shmem=True)
+    buf2 = RingBuffer(shape=(10, 3), dtype='float32', double=True, shmem=buf1.shm_id)
+    
+    assert buf1.generation() == 0
+    buf1.new_chunk(np.arange(24).astype('float32').reshape(8, 3))
+    assert buf2.generation() == 2
+    
+    data = buf2.get_data(2, 8, validate=True)
+    assert np.all(data == buf1[2:8])
+    # validated reads always return a copy
+    assert not np.shares_memory(data, buf2.buffer)
+    
+    # already overwritten segment
+    buf1.new_chunk(np.ones((8, 3), dtype='float32'))
+    with pytest.raises(IndexError):
+        buf2.get_data(2, 8, validate=True)
+    
+    # simulate a writer that overwrites the segment while it is being read
+    class RacingRingBuffer(RingBuffer):
+        def _get_data(self, start, stop, **kwds):
+            data = RingBuffer._get_data(self, start, stop, **kwds)
+            self.new_chunk(np.zeros((5, 3), dtype='float32'))
+            return data
+    
+    buf3 = RacingRingBuffer(shape=(10, 3), dtype='float32', double=False)
+    RingBuffer.new_chunk(buf3, np.ones((10, 3), dtype='float32'))
+    with pytest.raises(IndexError):
+        buf3.get_data(0, 10, validate=True)
+    # a concurrent write that does not reach the segment is accepted
+    data = buf3.get_data(buf3.index() - 4, buf3.index(), validate=True)
+    assert data.shape == (4, 3)
+    
+    buf1.reset_index()
+    assert buf1.generation() % 2 == 0
+    assert buf2.index() == 0
+
+
+def test_ringbuffer_scale():
+    scale = np.array([0.5, 2., 1e-3], dtype='float32')
+    offset = np.array([0., -10., 1.], dtype='float32')
+    for double in (False, True):
+        buf = RingBuffer(shape=(10, 3), dtype='float32', double=double, scale=scale, offset=offset)
+        raw = np.arange(45, dtype='int16').reshape(15, 3)
+        # the second chunk wraps around the end of the buffer
+        buf.new_chunk(raw[:7])
+        buf.new_chunk(raw[7:])
+        assert buf.dtype == np.float32
+        assert np.allclose(buf[5:15], offset + scale * raw[5:15])
+        if double:
+            assert buf.get_data(5, 15).base is buf.buffer.base
+    
+    # scale alone
+    buf = RingBuffer(shape=(10, 3), dtype='float32', double=False, scale=2.)
+    buf.new_chunk(np.ones((4, 3), dtype='uint16'))
+    assert np.all(buf[0:4] == 2.)
+    
+    # values are rounded once when written to an integer buffer
+    buf = RingBuffer(shape=(10,), dtype='int16', double=False, scale=0.5, offset=0.5)
+    buf.new_chunk(np.arange(4, dtype='int16'))
+    assert buf[0:4].tolist() == [0, 1, 1, 2]
+
+
+def test_ringbuffer_channels():
+    assert channels_to_slice([3]) == slice(3, 4)
+    assert channels_to_slice([0, 2, 4]) == slice(0, 5, 2)
+    assert channels_to_slice([0, 1, 3]) is None
+    assert channels_to_slice([2, 1]) is None
+    
+    for double in (False, True):
+        buf1 = RingBuffer(shape=(10, 6), dtype='float32', double=double, shmem=True, axisorder=(1, 0))
+        buf2 = RingBuffer(shape=(10, 6), dtype='float32', double=double, shmem=buf1.shm_id,
+                          axisorder=(1, 0), channels=channels_to_slice([1, 3, 5]))
+        assert buf2.shape == (10, 3)
+        data = np.arange(84, dtype='float32').reshape(14, 6)
+        buf1.new_chunk(data[:7])
+        buf1.new_chunk(data[7:])
+        assert np.array_equal(buf2[-10:], data[-10:, 1::2])
+        assert np.array_equal(buf2[-3:], data[-3:, 1::2])
+        assert np.shares_memory(buf2[-3:], buf2.buffer)
+
+
+def test_ringbuffer_new_chunks():
+    # batched writes are equivalent to sequential writes, including gaps,
+    # wraparound and batches longer than the buffer
+    rng = np.random.RandomState(0)
+    sizes = [3, 1, 7, 2, 9, 4, 6, 8, 5]
+    gaps = [0, 2, 0, 0, 5, 0, 1, 0, 0]
+    chunks = [rng.rand(n, 3).astype('float32') for n in sizes]
+    indices = list(np.cumsum(np.array(sizes) + np.array(gaps)) + 4)
+    for double in (False, True):
+        for axisorder in (None, (1, 0)):
+            buf1 = RingBuffer(shape=(20, 3), dtype='float32', double=double, axisorder=axisorder)
+            buf2 = RingBuffer(shape=(20, 3), dtype='float32', double=double, axisorder=axisorder)
+            buf1.new_chunk(chunks[0][:2])
+            buf2.new_chunk(chunks[0][:2])
+            for chunk, index in zip(chunks, indices):
+                buf1.new_chunk(chunk, index=index)
+            buf2.new_chunks(chunks[:4], indices[:4])
+            buf2.new_chunks(chunks[4:], indices[4:])
+            assert buf2.index() == buf1.index()
+            assert buf2.generation() == 6
+            assert np.array_equal(buf1[:], buf2[:], equal_nan=True)
+            
+            # default indexes follow the previous chunk
+            buf2.new_chunks(chunks[:2])
+            assert buf2.index() == indices[-1] + sizes[0] + sizes[1]
+            assert np.array_equal(buf2[-sizes[1]:], chunks[1])
+    
+    buf = RingBuffer(shape=(20, 3), dtype='float32')
+    with pytest.raises(AssertionError):
+        buf.new_chunks(chunks[:2], [3, 3])
+    assert buf.index() == 0
+    
+    # chunks of another dtype are cast if allowed by *casting*
+    with pytest.raises(TypeError):
+        buf.new_chunks([np.ones((2, 3), dtype='float64')])
+    buf.new_chunks([np.ones((2, 3), dtype='int16')], casting='safe')
+    buf.new_chunk(np.full((2, 3), 2., dtype='float64'), casting='same_kind')
+    assert buf[-4:].tolist() == [[1.] * 3] * 2 + [[2.] * 3] * 2
+
+
+def test_ringbuffer_mirror():
+    data = np.arange(150, dtype='float32').reshape(50, 3)
+    for axisorder in (None, (1, 0)):
+        buf = RingBuffer(shape=(20, 3), dtype='float32', double=False, mirror_size=8,
+                         axisorder=axisorder)
+        assert buf.buffer.shape == (28, 3)
+        buf.new_chunk(data[:17])
+        buf.new_chunk(data[17:23])
+        
+        # spans up to mirror_size are read without copy across the break
+        for start, stop in [(15, 23), (20, 23), (16, 21), (3, 11)]:
+            d = buf.get_data(start, stop)
+            assert np.array_equal(d, data[start:stop])
+            assert np.shares_memory(d, buf.buffer)
+        d = buf.get_data(15, 23, copy=True)
+        assert np.array_equal(d, data[15:23])
+        assert not np.shares_memory(d, buf.buffer)
+        
+        # longer spans are copied
+        d = buf.get_data(10, 23)
+        assert np.array_equal(d, data[10:23])
+        assert not np.shares_memory(d, buf.buffer)
+        
+        # gaps and chunks that wrap around the mirror area
+        buf.new_chunk(data[36:42], index=42)
+        assert np.all(np.isnan(buf.get_data(34, 36)))
+        assert np.array_equal(buf.get_data(36, 42), data[36:42])
+        buf.new_chunk(data[42:48])
+        d = buf.get_data(40, 48)
+        assert np.array_equal(d, data[40:48])
+        assert np.shares_memory(d, buf.buffer)
+        assert np.array_equal(buf[-10:], data[38:48])
+    
+    # readers in other processes see the mirror
+    buf1 = RingBuffer(shape=(20, 3), dtype='float32', double=False, mirror_size=8, shmem=True)
+    buf2 = RingBuffer(shape=(20, 3), dtype='float32', double=False, mirror_size=8,
+                      shmem=buf1.shm_id, channels=slice(1, 3))
+    buf1.new_chunk(data[:12])
+    buf1.new_chunk(data[12:23])
+    d = buf2.get_data(16, 23)
+    assert np.array_equal(d, data[16:23, 1:])
+    assert np.shares_memory(d, buf2.buffer)
+    
+    with pytest.raises(ValueError):
+        RingBuffer(shape=(20, 3), dtype='float32', double=True, mirror_size=8)
+    with pytest.raises(ValueError):
+        RingBuffer(shape=(20, 3), dtype='float32', double=False, mirror_size=20)
+
+
 if __name__ =='__main__':
     test_ringbuffer()
-    test_ringbuffer_shm()
\ No newline at end of file
+    test_ringbuffer_shm()
+    test_ringbuffer_validate()
+    test_ringbuffer_scale()
+    test_ringbuffer_channels()
+    test_ringbuffer_new_chunks()
+    test_ringbuffer_mirror()
@@ -3,7 +3,8 @@
 # Distributed under the (new) BSD License. See LICENSE for more info.
 
 
-from pyacq.core.stream.sharedarray import SharedArray, SharedMem
+from pyacq.core.stream.sharedarray import SharedArray, SharedMem, shm_backends
+import os
 import numpy as np
 import pyqtgraph.multiprocess as mp
 
@@ -18,6 +19,28 @@ def test_sharedmem():
     assert not arr2.flags['WRITEABLE']
 
 
+def test_sharedmem_backends():
+    for backend in shm_backends:
+        shm1 = SharedMem(nbytes=1000, backend=backend, populate=True)
+        arr1 = shm1.to_numpy(offset=0, shape=1000, dtype='ubyte')
+        assert np.all(arr1 == 0)
+        arr1[:] = np.arange(1000) % 256
+        
+        shm2 = SharedMem(nbytes=1000, shm_id=shm1.shm_id)
+        arr2 = shm2.to_numpy(offset=0, shape=1000, dtype='ubyte')
+        assert np.all(arr1 == arr2)
+        
+        if backend == 'posix':
+            # storage is reserved when the buffer is created
+            assert os.stat(shm1.shm_id).st_blocks * 512 >= 1000
+            assert os.path.exists(shm1.shm_id)
+            shm1.unlink()
+            assert not os.path.exists(shm1.shm_id)
+            # already opened buffers remain accessible
+            arr1[:10] = 1
+            assert np.all(arr2[:10] == 1)
+
+
 def test_sharedarray():    
     sa = SharedArray(shape=(10), dtype = 'int32')
     np_a = sa.to_numpy()
@@ -47,5 +70,6 @@ def test_sharedarray_multiprocess():
     
 if __name__ == '__main__':
     test_sharedmem()
+    test_sharedmem_backends()
     test_sharedarray()
     test_sharedarray_multiprocess()
@@ -6,6 +6,7 @@ import sys
 import time
 
 import numpy as np
+import pytest
 
 from pyacq.core.stream import OutputStream, InputStream, compression_methods
 
@@ -65,6 +66,476 @@ def check_stream(chunksize=1024, chan_shape=(16,), **kwds):
     instream.close()
 
 
+def test_stream_local():
+    check_stream(transfermode='local', protocol='inproc')
+    
+    for copy in (False, True):
+        outstream = OutputStream()
+        outstream.configure(protocol='inproc', transfermode='local', dtype='float32',
+                            shape=(-1, 4), copy=copy)
+        instream = InputStream()
+        instream.connect(outstream)
+        time.sleep(.1)
+        
+        arr = np.random.rand(10, 4).astype('float32')
+        outstream.send(arr)
+        index, arr2 = instream.recv(return_data=True)
+        assert index == 10
+        assert np.all(arr2 == arr)
+        assert not arr2.flags.writeable
+        assert np.shares_memory(arr, arr2) != copy
+        
+        outstream.close()
+        instream.close()
+    
+    # receiver queue overflow
+    outstream = OutputStream()
+    outstream.configure(protocol='inproc', transfermode='local', dtype='float32',
+                        shape=(-1, 4), queue_size=5)
+    instream = InputStream()
+    instream.connect(outstream)
+    time.sleep(.1)
+    arr = np.random.rand(80, 4).astype('float32')
+    for i in range(8):
+        outstream.send(arr[i*10:(i+1)*10])
+    for i in range(8):
+        index, arr2 = instream.recv(return_data=True)
+        assert index == (i + 1) * 10
+        if i < 3:
+            assert arr2 is None
+        else:
+            assert np.all(arr2 == arr[i*10:(i+1)*10])
+    assert instream.receiver.dropped_chunks == 3
+    outstream.close()
+    instream.close()
+    
+    with pytest.raises(ValueError):
+        OutputStream().configure(protocol='tcp', transfermode='local')
+
+
+def test_stream_flow_control():
+    for transfermode in ('plaindata', 'sharedmem'):
+        check_stream(transfermode=transfermode, flow_control=True, buffer_size=4096)
+    
+    def connect(**flow_control):
+        outstream = OutputStream()
+        outstream.configure(protocol='tcp', transfermode='plaindata', dtype='int64', shape=(-1, 1),
+                            flow_control=flow_control, hwm=100)
+        instream = InputStream()
+        instream.connect(outstream)
+        time.sleep(.1)
+        return outstream, instream
+    
+    def chunk(i):
+        return np.array([[i]], dtype='int64')
+    
+    def recv(outstream, instream):
+        # queued chunks are forwarded without further calls to the sender
+        assert instream.poll(timeout=1000)
+        return instream.recv()
+    
+    # slow receiver: nothing is lost, sender is blocked once queue + credit is full
+    outstream, instream = connect(credit=4, queue_size=8, policy='block', timeout=100)
+    for i in range(12):
+        outstream.send(chunk(i))
+    with pytest.raises(TimeoutError):
+        outstream.send(chunk(12))
+    for i in range(12):
+        index, data = recv(outstream, instream)
+        assert data[0, 0] == i
+    assert instream.socket.missed_chunks == 0
+    outstream.close()
+    instream.close()
+    
+    # chunks queued while the receiver has no credit are not affected when
+    # the sender reuses its array
+    outstream, instream = connect(credit=1, queue_size=8, policy='block')
+    arr = np.zeros((1, 1), dtype='int64')
+    for i in range(5):
+        arr[:] = i
+        outstream.send(arr)
+        arr[:] = -1
+    for i in range(5):
+        index, data = recv(outstream, instream)
+        assert data[0, 0] == i
+    outstream.close()
+    instream.close()
+    
+    # drop oldest: receiver reports the gap
+    outstream, instream = connect(credit=4, queue_size=8, policy='drop-oldest')
+    for i in range(20):
+        outstream.send(chunk(i))
+    received = []
+    deadline = time.perf_counter() + 1.
+    while time.perf_counter() < deadline:
+        if instream.poll(timeout=10):
+            received.append(instream.recv()[1][0, 0])
+    assert received[:4] == [0, 1, 2, 3]
+    assert received[-1] == 19
+    assert instream.socket.missed_chunks == 20 - len(received)
+    assert instream.socket.gaps == 1
+    outstream.close()
+    instream.close()
+    
+    # spill to disk: nothing is lost and send never blocks
+    outstream, instream = connect(credit=4, queue_size=8, policy='spill')
+    for i in range(50):
+        outstream.send(chunk(i))
+    assert outstream.stats()['spilled_chunks'] == 50 - 4 - 8
+    for i in range(50):
+        index, data = recv(outstream, instream)
+        assert data[0, 0] == i
+    outstream.close()
+    instream.close()
+
+
+def test_stream_stats():
+    for transfermode, protocol in [('plaindata', 'tcp'), ('sharedmem', 'tcp'), ('local', 'inproc')]:
+        outstream = OutputStream()
+        outstream.configure(protocol=protocol, transfermode=transfermode, dtype='float32',
+                            shape=(-1, 4), buffer_size=1000, timestamps=True)
+        instream = InputStream()
+        instream.connect(outstream)
+        time.sleep(.1)
+        
+        arr = np.zeros((10, 4), dtype='float32')
+        for index in (10, 20, 40, 50):  # 10 samples are skipped
+            outstream.send(arr, index=index)
+            instream.recv(return_data=True)
+        
+        for stats in (outstream.stats(), instream.stats()):
+            assert stats['chunks'] == 4
+            assert stats['bytes'] == 4 * arr.nbytes
+            assert stats['last_index'] == 50
+            assert stats['index_gaps'] == 1
+            assert stats['missed_samples'] == 10
+            assert stats['chunks_per_s'] > 0
+        stats = instream.stats()
+        assert 0 <= stats['latency'] < 1
+        assert stats['latency_max'] >= stats['latency']
+        assert stats['origin_latency'] >= stats['latency']
+        assert sum(stats['origin_latency_hist']) == 4
+        assert instream.last_origin[1] == ''
+        if transfermode != 'plaindata':
+            assert stats['queue_depth'] == 0
+        
+        outstream.close()
+        instream.close()
+
+
+def test_plaindata_recv_out():
+    for compression in compression_methods:
+        outstream = OutputStream()
+        outstream.configure(protocol='tcp', transfermode='plaindata', dtype='int16',
+                            shape=(-1, 4), compression=compression)
+        instream = InputStream()
+        instream.connect(outstream)
+        time.sleep(.1)
+        
+        out = np.zeros((32, 4), dtype='int16')
+        for i in range(3):
+            arr = np.random.randint(-1000, 1000, size=(32, 4)).astype('int16')
+            outstream.send(arr)
+            index, arr2 = instream.recv(out=out)
+            assert arr2 is out
+            assert index == outstream.last_index
+            assert np.all(out == arr)
+        
+        # chunks sent and received in Fortran order
+        out = np.zeros((32, 4), dtype='int16', order='F')
+        arr = np.asfortranarray(arr)
+        outstream.send(arr)
+        index, arr2 = instream.recv(out=out)
+        assert arr2 is out
+        assert np.all(out == arr)
+        
+        outstream.send(arr)
+        index, arr2 = instream.recv()
+        assert not arr2.flags['WRITEABLE']
+        assert np.all(arr2 == arr)
+        
+        outstream.close()
+        instream.close()
+
+
+def test_plaindata_reuse_array():
+    # the sender may overwrite a chunk as soon as send() returns
+    outstream = OutputStream()
+    outstream.configure(protocol='tcp', transfermode='plaindata', dtype='float32',
+                        shape=(-1, 64))
+    instream = InputStream()
+    instream.connect(outstream)
+    time.sleep(.1)
+    
+    arr = np.empty((4096, 64), dtype='float32')
+    for i in range(20):
+        arr[:] = i
+        outstream.send(arr)
+        arr[:] = -1
+    for i in range(20):
+        index, chunk = instream.recv()
+        assert np.all(chunk == i)
+    
+    outstream.close()
+    instream.close()
+
+
+def test_stream_coalesce():
+    for transfermode in ('plaindata', 'sharedmem'):
+        outstream = OutputStream()
+        outstream.configure(protocol='tcp', transfermode=transfermode, dtype='float32',
+                            shape=(-1, 4), buffer_size=1000, coalesce={'max_samples': 10})
+        instream = InputStream()
+        instream.connect(outstream)
+        instream.set_buffer(1000)
+        time.sleep(.1)
+        
+        data = np.random.rand(100, 4).astype('float32')
+        # 30 chunks of 2 samples: only 6 messages of 10 samples are sent
+        for i in range(30):
+            outstream.send(data[i*2:(i+1)*2])
+        for i in range(6):
+            index, chunk = instream.recv(return_data=True)
+            assert index == (i + 1) * 10
+            assert chunk.shape == (10, 4)
+        assert not instream.poll(timeout=50)
+        
+        # a gap in indices flushes the staged data
+        outstream.send(data[60:63])
+        outstream.send(data[63:65], index=70)
+        index, chunk = instream.recv(return_data=True)
+        assert index == 63
+        assert np.all(chunk == data[60:63])
+        
+        # explicit flush
+        outstream.flush()
+        index, chunk = instream.recv(return_data=True)
+        assert index == 70
+        assert np.all(chunk == data[63:65])
+        assert np.all(instream[0:60] == data[:60])
+        
+        outstream.close()
+        instream.close()
+    
+    # staged data is sent after max_latency even if no other chunk is sent
+    outstream = OutputStream()
+    outstream.configure(protocol='tcp', transfermode='plaindata', dtype='float32',
+                        shape=(-1, 4), coalesce={'max_samples': 1000, 'max_latency': 20})
+    instream = InputStream()
+    instream.connect(outstream)
+    time.sleep(.1)
+    outstream.send(data[:2])
+    outstream.send(data[2:5])
+    assert instream.poll(timeout=1000)
+    index, chunk = instream.recv(return_data=True)
+    assert index == 5
+    assert np.all(chunk == data[:5])
+    outstream.close()
+    instream.close()
+    
+    # the stage size must be given
+    with pytest.raises(AssertionError):
+        OutputStream().configure(protocol='tcp', transfermode='plaindata', dtype='float32',
+                                 shape=(-1, 4), coalesce={'max_latency': 20})
+
+
+def test_sharedmem_overrun():
+    from pyacq.core.stream.sharedmemstream import StreamOverrunError
+    
+    outstream = OutputStream()
+    outstream.configure(protocol='tcp', transfermode='sharedmem', dtype='float32',
+                        shape=(-1, 4), buffer_size=100, double=True)
+    instream = InputStream()
+    instream.connect(outstream)
+    time.sleep(.1)
+    
+    data = np.random.rand(1000, 4).astype('float32')
+    for i in range(3):
+        outstream.send(data[i*20:(i+1)*20])
+    index, chunk = instream.recv(return_data=True)
+    assert index == 20
+    assert np.all(chunk == data[:20])
+    assert instream.lag() == 40
+    assert instream.receiver.lag_chunks() == 2
+    
+    # fall more than buffer_size behind
+    for i in range(3, 10):
+        outstream.send(data[i*20:(i+1)*20])
+    with pytest.raises(StreamOverrunError):
+        instream.recv(return_data=True)
+    index, chunk = instream.recv(return_data=True, on_overrun='count')
+    assert index == 60
+    assert chunk is None
+    assert instream.receiver.overrun_samples == 20
+    for i in range(2):
+        instream.recv(return_data=True, on_overrun='count')
+    assert instream.receiver.overrun_samples == 60
+    # partially overwritten chunk
+    outstream.send(data[200:210])
+    index, chunk = instream.recv(return_data=True, on_overrun='count')
+    assert index == 120
+    assert chunk is None
+    assert instream.receiver.overrun_samples == 70
+    # still available
+    index, chunk = instream.recv(return_data=True, validate=True)
+    assert index == 140
+    assert np.all(chunk == data[120:140])
+    
+    outstream.close()
+    instream.close()
+
+
+def test_sharedmem_mirror():
+    outstream = OutputStream()
+    outstream.configure(protocol='tcp', transfermode='sharedmem', dtype='float32',
+                        shape=(-1, 4), buffer_size=100, double=False, mirror_size=30)
+    instream = InputStream()
+    instream.connect(outstream)
+    time.sleep(.1)
+    
+    data = np.random.rand(1000, 4).astype('float32')
+    for i in range(6):
+        outstream.send(data[i*25:(i+1)*25])
+        index, chunk = instream.recv(return_data=True)
+        assert index == (i+1)*25
+        assert np.all(chunk == data[i*25:(i+1)*25])
+    
+    # chunks that wrap around the end of the buffer are not copied
+    buf = instream.receiver.buffer
+    assert buf.buffer.shape == (130, 4)
+    chunk = buf[90:110]
+    assert np.all(chunk == data[90:110])
+    assert np.shares_memory(chunk, buf.buffer)
+    
+    outstream.close()
+    instream.close()
+
+
+def test_stream_asyncio():
+    import asyncio
+    
+    async def produce(outstream, data):
+        for i in range(10):
+            await outstream.asend(data[i*10:(i+1)*10])
+            await asyncio.sleep(0.001)
+    
+    async def consume(instream, data):
+        n = 0
+        async for index, chunk in instream.aiter(return_data=True):
+            n += 1
+            assert index == n * 10
+            assert np.all(chunk == data[index-10:index])
+            if n == 10:
+                break
+        with pytest.raises(TimeoutError):
+            await instream.arecv(timeout=20)
+    
+    async def main():
+        streams = []
+        tasks = []
+        for i in range(4):
+            outstream = OutputStream()
+            outstream.configure(protocol='tcp', transfermode='plaindata', dtype='float32', shape=(-1, 2))
+            instream = InputStream()
+            instream.connect(outstream)
+            streams.extend([outstream, instream])
+            data = np.random.rand(100, 2).astype('float32')
+            tasks.append(consume(instream, data))
+            tasks.append(produce(outstream, data))
+        await asyncio.sleep(.1)
+        await asyncio.gather(*tasks)
+        for stream in streams:
+            stream.close()
+    
+    asyncio.run(main())
+
+
+def test_register_compression():
+    from pyacq.core.stream import register_compression
+    from pyacq.core.stream.compression import compress, decompress, all_compressions
+    
+    calls = []
+    def xor_compress(data, itemsize, key=None, **opts):
+        calls.append(('compress', key))
+        return (np.frombuffer(data, dtype='uint8') ^ key).tobytes()
+    def xor_decompress(data, itemsize, out=None, key=None, **opts):
+        calls.append(('decompress', key))
+        data = (np.frombuffer(data, dtype='uint8') ^ key).tobytes()
+        return decompress(data, '', itemsize, out=out)
+    
+    register_compression('test-xor', xor_compress, xor_decompress)
+    try:
+        check_stream(transfermode='plaindata', compression='test-xor',
+                     compression_opts={'key': 0x37})
+        assert ('compress', 0x37) in calls
+        assert ('decompress', 0x37) in calls
+    finally:
+        del all_compressions['test-xor']
+        compression_methods.remove('test-xor')
+    
+    with pytest.raises(ValueError):
+        compress(b'1234', 'no-such-codec')
+
+
+def test_delta_compression():
+    from pyacq.core.stream.compression import compress, decompress
+    
+    # slowly varying integer signal, including wrap-around at the dtype limits
+    sig = np.cumsum(np.random.randint(-20, 20, size=(512, 8)), axis=0).astype('int16')
+    sig[:, 0] = np.arange(512) * 300
+    flat = sig.reshape(-1).view('uint8')
+    c = compress(flat, 'delta-bitpack', 2, rowsize=8)
+    assert len(c) < sig.nbytes // 2
+    sig2 = np.frombuffer(decompress(c, 'delta-bitpack', 2), dtype='int16').reshape(sig.shape)
+    assert np.all(sig2 == sig)
+    out = np.empty_like(sig)
+    decompress(c, 'delta-bitpack', 2, out=out)
+    assert np.all(out == sig)
+    
+    # items that are not integers of a standard size are sent unchanged
+    data = np.arange(30, dtype='uint8')
+    c = compress(data, 'delta-bitpack', 3, rowsize=2)
+    assert np.all(np.frombuffer(decompress(c, 'delta-bitpack', 3), dtype='uint8') == data)
+    
+    # ... and so are chunks that packing would not make smaller
+    noise = np.random.randint(-2**31, 2**31, size=(100, 4)).astype('int32')
+    c = compress(noise.reshape(-1).view('uint8'), 'delta-bitpack', 4, rowsize=4)
+    assert len(c) <= noise.nbytes + 17
+    assert np.all(np.frombuffer(decompress(c, 'delta-bitpack', 4), dtype='int32') == noise.reshape(-1))
+    
+    # chunks longer than one block of packed rows
+    sig = np.cumsum(np.random.randint(-20, 20, size=(10000, 3)), axis=0).astype('int64')
+    c = compress(sig.reshape(-1).view('uint8'), 'delta-bitpack', 8, rowsize=3)
+    assert len(c) < sig.nbytes // 4
+    assert np.all(np.frombuffer(decompress(c, 'delta-bitpack', 8), dtype='int64') == sig.reshape(-1))
+
+
+def test_stream_scaled_buffer():
+    scale = [0.1, 0.2, 0.5, 1.]
+    offset = [-1., 0., 1., 2.]
+    outstream = OutputStream()
+    outstream.configure(protocol='tcp', transfermode='plaindata', dtype='int16',
+                        shape=(-1, 4), scale=scale, offset=offset)
+    instream = InputStream()
+    instream.connect(outstream)
+    instream.set_buffer(100, scaled=True)
+    time.sleep(.1)
+    
+    raw = np.random.randint(-1000, 1000, size=(30, 4)).astype('int16')
+    outstream.send(raw)
+    index, data = instream.recv(return_data=True)
+    # raw samples on the wire, physical values in the buffer
+    assert data.dtype == np.int16 and np.all(data == raw)
+    assert instream.buffer.dtype == np.float32
+    assert np.allclose(instream[0:30], np.array(offset) + np.array(scale) * raw)
+    
+    instream.set_buffer(100)
+    assert instream.buffer.dtype == np.int16
+    
+    outstream.close()
+    instream.close()
+
+
 def test_plaindata_ringbuffer():
     check_stream_ringbuffer(transfermode='plaindata', buffer_size=4096)
     
@@ -158,5 +629,17 @@ def check_stream_struct_dtype(**kwds):
 if __name__ == '__main__':
     #~ test_stream_plaindata()
     #~ test_stream_sharedmem()
+    #~ test_stream_local()
+    #~ test_stream_flow_control()
+    #~ test_stream_stats()
+    #~ test_plaindata_recv_out()
+    #~ test_plaindata_reuse_array()
+    #~ test_stream_coalesce()
+    #~ test_sharedmem_overrun()
+    #~ test_sharedmem_mirror()
+    #~ test_stream_asyncio()
+    #~ test_register_compression()
+    #~ test_delta_compression()
+    #~ test_stream_scaled_buffer()
     #~ test_plaindata_ringbuffer()
     test_sharedmem_ringbuffer()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+
+import time
+import numpy as np
+
+from pyacq.core import create_manager, RPCClient, OutputStream, InputStream
+from pyacq.core.clocksync import ClockModel
+
+
+def test_clock_model():
+    model = ClockModel()
+    rng = np.random.RandomState(0)
+    for t in np.arange(0, 100, 5.):
+        rtt = 1e-4 * (1 + rng.rand())
+        noise = 1e-5 * rng.randn()
+        model.add(t, 3. + 1e-5 * t + noise, rtt)
+    # one measurement delayed in a single direction
+    model.add(101., 3.1, 5e-2)
+    
+    assert abs(model.drift - 1e-5) < 1e-6
+    assert abs(model.to_remote(50.) - 53.0005) < 1e-4
+    assert abs(model.to_local(model.to_remote(120.)) - 120.) < 1e-9
+
+
+def test_clock_sync():
+    mgr = create_manager('rpc', auto_close_at_exit=False)
+    ng = mgr.create_nodegroup('nodegroup1')
+    
+    mgr.start_clock_sync(interval=.1)
+    time.sleep(1.)
+    models = mgr.clock_models()
+    assert list(models.keys()) == ['nodegroup1']
+    # all processes share the monotonic clock of this host
+    assert abs(models['nodegroup1']['offset']) < 1e-2
+    assert models['nodegroup1']['rtt'] > 0
+    mgr.stop_clock_sync()
+    assert mgr.clock_models() == {}
+    
+    client = RPCClient.get_client(ng._rpc_addr)
+    t0 = time.perf_counter()
+    local_time, offset, rtt = client.measure_clock_diff(min_rtt=True)
+    assert t0 < local_time < time.perf_counter()
+    assert abs(offset) < 1e-2 and rtt > 0
+    assert abs(client.measure_clock_diff()) < 1e-2
+    
+    clocksync = client._import('pyacq.core.clocksync')
+    t0 = time.perf_counter()
+    t = clocksync.common_time()
+    assert abs(t - t0) < 1e-2
+    
+    mgr.close()
+
+
+def test_index_to_time():
+    outstream = OutputStream()
+    outstream.configure(protocol='tcp', transfermode='plaindata', dtype='float32',
+                        shape=(-1, 2), sample_rate=1000., timestamps=True)
+    instream = InputStream()
+    instream.connect(outstream)
+    time.sleep(.1)
+    
+    t0 = time.perf_counter()
+    outstream.send(np.zeros((10, 2), dtype='float32'), index=110)
+    instream.recv()
+    t1 = time.perf_counter()
+    
+    assert t0 <= instream.index_to_time(110) <= t1
+    times = instream.index_to_time(np.array([100, 110]))
+    assert abs(times[1] - times[0] - .01) < 1e-9
+    
+    outstream.close()
+    instream.close()
+
+
+if __name__ == '__main__':
+    test_clock_model()
+    test_clock_sync()
+    test_index_to_time()
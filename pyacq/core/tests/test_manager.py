@@ -88,6 +88,14 @@ def test_close_manager_explicit():
     for ng in nodegroups:
         ng.stop_all_nodes()
     
+    # every stream in the system can be inspected from the manager
+    stats = man.stream_stats()
+    assert set(stats.keys()) == set('nodegroup{}'.format(i) for i in range(5))
+    sent = stats['nodegroup0']['sender0']['outputs']['signals']
+    received = stats['nodegroup0']['receiver 0 0']['inputs']['signals']
+    assert sent['chunks'] > 0
+    assert 0 < received['chunks'] <= sent['chunks']
+    
     man.close()
 
 
@@ -3,7 +3,8 @@
 # Distributed under the (new) BSD License. See LICENSE for more info.
 
 from pyacq.core import OutputStream, InputStream
-from pyacq.core.tools import ThreadPollInput, StreamConverter, ChannelSplitter, ChunkResizer
+from pyacq.core.tools import (ThreadPollInput, MultiInputPoller, StreamConverter,
+                              ChannelSplitter, ChunkResizer)
 from pyqtgraph.Qt import QtCore
 import pyqtgraph as pg
 
@@ -34,7 +35,8 @@ class ThreadSender(QtCore.QThread):
             arr = np.random.rand(chunksize, nb_channel).astype(stream_spec['dtype'])
             self.output_stream().send(arr, index=index)
             time.sleep(chunksize/sr)
-        self.finished.emit()
+        # QThread emits finished when run() returns; emitting it here too
+        # would call the test's terminate() again during a later test.
 
 
 def test_ThreadPollInput():
@@ -72,6 +74,48 @@ def test_ThreadPollInput():
     app.exec_()
 
 
+def test_MultiInputPoller():
+    for nb_worker in (0, 2):
+        outstreams = []
+        instreams = []
+        poller = MultiInputPoller(timeout=50, nb_worker=nb_worker)
+        received = {}
+        for i in range(5):
+            outstream = OutputStream()
+            outstream.configure(**stream_spec)
+            instream = InputStream()
+            instream.connect(outstream)
+            outstreams.append(outstream)
+            instreams.append(instream)
+            received[i] = []
+            def callback(pos, arr, i=i):
+                assert arr.shape == (chunksize, nb_channel)
+                received[i].append(pos)
+            poller.add_input(instream, return_data=True, callback=callback)
+        
+        # an error while receiving from one stream does not stop the others
+        def failing_recv(recv=instreams[0].recv, **kargs):
+            recv(**kargs)
+            if len(received[0]) == 0:
+                instreams[0].recv = recv
+                raise IndexError("simulated overrun")
+        instreams[0].recv = failing_recv
+        
+        poller.start()
+        time.sleep(.2)
+        for n in range(10):
+            for outstream in outstreams:
+                outstream.send(np.zeros((chunksize, nb_channel), dtype='float32'))
+        time.sleep(.3)
+        poller.close()
+        
+        assert received[0] == [(n + 1) * chunksize for n in range(1, 10)]
+        for i in range(1, 5):
+            assert received[i] == [(n + 1) * chunksize for n in range(10)]
+        for stream in outstreams + instreams:
+            stream.close()
+
+
 def test_streamconverter():
     app = pg.mkQApp()
     
@@ -128,6 +172,45 @@ def test_streamconverter():
     app.exec_()
 
 
+def test_streamconverter_fused():
+    # dtype, channel selection, scaling and axis order in one pass
+    scale = np.linspace(0.5, 2., nb_channel).astype('float32')
+    spec = dict(stream_spec, dtype='int16', scale=list(scale), offset=1.)
+    outstream = OutputStream()
+    outstream.configure(**spec)
+    channels = [1, 3, 5, 6]
+    
+    for transfermode in ('sharedmem', 'plaindata'):
+        conv = StreamConverter()
+        conv.configure(channels=channels, scaled=True)
+        conv.input.connect(outstream)
+        conv.output.configure(protocol='tcp', interface='127.0.0.1', transfermode=transfermode,
+                              dtype='float32', shape=(-1, len(channels)), buffer_size=1000,
+                              axisorder=[1, 0], double=True)
+        conv.initialize()
+        instream = InputStream()
+        instream.connect(conv.output)
+        conv.start()
+        time.sleep(.5)
+        
+        raw = np.random.randint(-1000, 1000, size=(5 * chunksize, nb_channel)).astype('int16')
+        for i in range(5):
+            outstream.send(raw[i*chunksize:(i+1)*chunksize], index=(i+1)*chunksize)
+            time.sleep(.01)
+        expected = 1. + raw[:, channels] * scale[channels]
+        for i in range(5):
+            assert instream.poll(timeout=1000)
+            pos, arr = instream.recv(return_data=True)
+            assert pos == (i+1) * chunksize
+            assert arr.dtype == 'float32'
+            assert np.allclose(arr, expected[i*chunksize:(i+1)*chunksize])
+        if transfermode == 'sharedmem':
+            # the samples of each channel are contiguous (axisorder=[1, 0])
+            assert arr.strides[0] == 4
+        conv.stop()
+        conv.close()
+
+
 def test_stream_splitter():
     app = pg.mkQApp()
     
@@ -174,6 +257,49 @@ def test_stream_splitter():
     app.exec_()
 
 
+def test_stream_splitter_views():
+    # outputs read their channels from the shared buffer of the input
+    spec = dict(stream_spec, transfermode='sharedmem', buffer_size=1000, double=True)
+    outstream = OutputStream()
+    outstream.configure(**spec)
+    
+    splitter = ChannelSplitter()
+    output_channels = {'out0': [0, 1, 2], 'out1': [4, 8, 12]}
+    splitter.configure(output_channels=output_channels, shared_views=True)
+    splitter.input.connect(outstream)
+    instreams = {}
+    for name, output in splitter.outputs.items():
+        output.configure()
+        instreams[name] = InputStream()
+        instreams[name].connect(output)
+    splitter.initialize()
+    splitter.start()
+    time.sleep(.5)
+    
+    sig = np.random.rand(10 * chunksize, nb_channel).astype('float32')
+    for i in range(10):
+        outstream.send(sig[i*chunksize:(i+1)*chunksize], index=(i+1)*chunksize)
+        time.sleep(.01)
+    
+    for name, instream in instreams.items():
+        for i in range(10):
+            assert instream.poll(timeout=1000)
+            pos, arr = instream.recv(return_data=True)
+            assert pos == (i+1) * chunksize
+            assert np.array_equal(arr, sig[i*chunksize:(i+1)*chunksize, output_channels[name]])
+            # a strided view of the shared buffer
+            assert np.shares_memory(arr, instream.receiver.buffer.buffer)
+            assert not arr.flags['C_CONTIGUOUS']
+    splitter.stop()
+    
+    # channels of views must be regularly spaced
+    try:
+        splitter.configure(output_channels={'out0': [0, 1, 3]}, shared_views=True)
+        assert False, "Expected ValueError"
+    except ValueError:
+        pass
+
+
 def test_ChunkResizer():
     app = pg.mkQApp()
     
@@ -191,6 +317,7 @@ def test_ChunkResizer():
     def on_new_data(pos, arr):
         #~ print('recv', arr.shape, pos)
         assert arr.shape[0] == 33
+        assert pos % 33 == 0
     
     instream = InputStream()
     instream.connect(chunkresizer.output)
@@ -216,8 +343,99 @@ def test_ChunkResizer():
     
     
 
+def test_ChunkResizer_content():
+    # input chunks larger and smaller than the output chunks
+    outstream = OutputStream()
+    outstream.configure(**stream_spec)
+    
+    chunkresizer = ChunkResizer()
+    chunkresizer.configure(chunksize=30)
+    chunkresizer.input.connect(outstream)
+    chunkresizer.output.configure()
+    chunkresizer.initialize()
+    
+    instream = InputStream()
+    instream.connect(chunkresizer.output)
+    
+    chunkresizer.start()
+    time.sleep(.5)
+    
+    sig = np.arange(2000 * nb_channel, dtype='float32').reshape(-1, nb_channel)
+    index = 0
+    for n in [100, 7, 23, 1, 95, 30, 4]:
+        outstream.send(sig[index:index+n], index=index+n)
+        index += n
+        time.sleep(.01)
+    
+    received = []
+    while instream.poll(timeout=1000):
+        pos, arr = instream.recv()
+        assert arr.shape[0] == 30
+        assert pos == (len(received) + 1) * 30
+        received.append(arr)
+    chunkresizer.stop()
+    
+    assert len(received) == index // 30
+    assert np.array_equal(np.concatenate(received), sig[:len(received)*30])
+
+
+def test_latency_tracing():
+    # the origin of the data is forwarded by ChannelSplitter and ChunkResizer
+    app = pg.mkQApp()
+    
+    outstream = OutputStream(name='source')
+    outstream.configure(timestamps=True, **stream_spec)
+    
+    splitter = ChannelSplitter()
+    splitter.configure(output_channels={'out0': [0, 1]})
+    splitter.input.connect(outstream)
+    splitter.outputs['out0'].configure(timestamps=True)
+    splitter.initialize()
+    
+    chunkresizer = ChunkResizer()
+    chunkresizer.configure(chunksize=250)
+    chunkresizer.input.connect(splitter.outputs['out0'])
+    chunkresizer.output.configure(timestamps=True)
+    chunkresizer.initialize()
+    
+    instream = InputStream()
+    instream.connect(chunkresizer.output)
+    
+    splitter.start()
+    chunkresizer.start()
+    time.sleep(.5)
+    
+    send_times = []
+    for i in range(10):
+        send_times.append(time.perf_counter())
+        outstream.send(np.zeros((chunksize, nb_channel), dtype='float32'), index=(i+1)*chunksize)
+        time.sleep(.01)
+    
+    origins = []
+    while instream.poll(timeout=1000):
+        instream.recv()
+        origins.append(instream.last_origin)
+    chunkresizer.stop()
+    splitter.stop()
+    
+    # each output chunk carries the origin of its first sample
+    assert len(origins) == 4
+    for origin, i in zip(origins, [0, 2, 5, 7]):
+        assert origin[1] == 'source'
+        assert send_times[i] <= origin[0] < send_times[i+1]
+    stats = instream.stats()
+    assert stats['origin_latency'] >= stats['latency'] > 0
+    assert sum(stats['origin_latency_hist']) == 4
+    
+
+
 if __name__ == '__main__':
     test_ThreadPollInput()
+    test_MultiInputPoller()
     test_streamconverter()
+    test_streamconverter_fused()
     test_stream_splitter()
+    test_stream_splitter_views()
     test_ChunkResizer()
+    test_ChunkResizer_content()
+    test_latency_tracing()
@@ -6,6 +6,7 @@ import time
 import weakref
 import logging
 import atexit
+import concurrent.futures
 import numpy as np
 import zmq
 from collections import OrderedDict
@@ -14,7 +15,7 @@ from pyqtgraph.util.mutex import Mutex
 
 from .node import Node, register_node_type
 from .stream import OutputStream, InputStream
-from .stream.arraytools import make_dtype
+from .stream.arraytools import make_dtype, channels_to_slice, convert_into
 
 
 class ThreadPollInput(QtCore.QThread):
@@ -103,6 +104,191 @@ class ThreadPollInput(QtCore.QThread):
             return self._pos
 
 
+class PolledInput(QtCore.QObject):
+    """Handle for one InputStream registered with a :class:`MultiInputPoller`.
+    
+    It offers the same ``new_data`` signal, `process_data()` and `pos()` API
+    as :class:`ThreadPollInput`, so code written for a dedicated poller thread
+    can use a shared poller instead.
+    
+    Parameters
+    ----------
+    input_stream : InputStream
+        The stream on which to receive data.
+    return_data : bool
+        If True, the received data array is passed on; otherwise None is
+        passed in place of data.
+    callback : callable or None
+        Optional function ``callback(pos, data)`` that is called directly from
+        the poller thread (or from a worker thread) for each received chunk, in
+        addition to emitting ``new_data``.
+    """
+    new_data = QtCore.Signal(int, object)
+    
+    def __init__(self, input_stream, return_data=None, callback=None, parent=None):
+        QtCore.QObject.__init__(self, parent)
+        self.input_stream = weakref.ref(input_stream)
+        self.return_data = return_data
+        if self.return_data is None:
+            self.return_data = input_stream._own_buffer
+        self.callback = callback
+        self.lock = Mutex()
+        self._pos = None
+        self.executor = None
+    
+    def process_data(self, pos, data):
+        """Called for each received chunk. The default implementation calls
+        *callback* (if any) and emits the `new_data` signal.
+        
+        This method can be overriden.
+        """
+        if self.callback is not None:
+            self.callback(pos, data)
+        self.new_data.emit(pos, data)
+    
+    def pos(self):
+        """Return the current stream position.
+        """
+        with self.lock:
+            return self._pos
+    
+    def _dispatch(self, pos, data):
+        try:
+            self.process_data(pos, data)
+        except Exception:
+            logging.exception("Error while processing data from %s", self.input_stream())
+
+
+class MultiInputPoller(QtCore.QThread):
+    """Thread that polls any number of InputStreams with a single zmq.Poller.
+    
+    This avoids running one :class:`ThreadPollInput` thread per stream when a
+    node (or a whole process) consumes many streams. Each registered stream
+    gets a :class:`PolledInput` handle with its own ``new_data`` signal::
+    
+        poller = MultiInputPoller()
+        for input in node.inputs.values():
+            handle = poller.add_input(input, return_data=True)
+            handle.new_data.connect(on_new_data)
+        poller.start()
+    
+    Parameters
+    ----------
+    timeout : int
+        Poll timeout in ms. The thread will unblock at this interval to check
+        for calls to `stop()` and for newly added streams.
+    nb_worker : int
+        If 0 (default), chunks are processed in the poller thread. Otherwise,
+        processing is dispatched to this many worker threads. Chunks from one
+        stream are always processed by the same worker, in order.
+    parent : QObject or None
+        QObject parent for the poller QThread.
+    """
+    def __init__(self, timeout=200, nb_worker=0, parent=None):
+        QtCore.QThread.__init__(self, parent)
+        self.timeout = timeout
+        self.executors = [concurrent.futures.ThreadPoolExecutor(max_workers=1) for i in range(nb_worker)]
+        
+        self.running = False
+        self.running_lock = Mutex()
+        self.inputs_lock = Mutex()
+        self._handles = OrderedDict()  # socket: PolledInput
+        self._changed = True
+        self._next_executor = 0
+        atexit.register(self.stop)
+    
+    def add_input(self, input_stream, return_data=None, callback=None):
+        """Register an InputStream and return its :class:`PolledInput` handle.
+        
+        Streams may be added while the poller is running. Once added, the
+        stream's socket must only be used by the poller thread.
+        """
+        handle = PolledInput(input_stream, return_data=return_data, callback=callback)
+        if len(self.executors) > 0:
+            handle.executor = self.executors[self._next_executor % len(self.executors)]
+            self._next_executor += 1
+        with self.inputs_lock:
+            self._handles[input_stream.socket] = handle
+            self._changed = True
+        return handle
+    
+    def remove_input(self, input_stream):
+        """Unregister an InputStream.
+        """
+        with self.inputs_lock:
+            self._handles.pop(input_stream.socket, None)
+            self._changed = True
+    
+    def run(self):
+        with self.running_lock:
+            self.running = True
+        
+        poller = None
+        handles = {}
+        while True:
+            with self.running_lock:
+                if not self.running:
+                    break
+            
+            with self.inputs_lock:
+                if self._changed:
+                    # rebuild the poller with the current set of sockets
+                    handles = dict(self._handles)
+                    poller = zmq.Poller()
+                    for socket in handles:
+                        poller.register(socket, zmq.POLLIN)
+                    self._changed = False
+            
+            if len(handles) == 0:
+                self.msleep(self.timeout)
+                continue
+            
+            try:
+                events = poller.poll(timeout=self.timeout)
+            except zmq.error.ContextTerminated:
+                self.stop()
+                return
+            
+            for socket, ev in events:
+                handle = handles[socket]
+                input_stream = handle.input_stream()
+                if input_stream is None:
+                    logging.info("MultiInputPoller has lost InputStream")
+                    with self.inputs_lock:
+                        self._handles.pop(socket, None)
+                        self._changed = True
+                    continue
+                try:
+                    pos, data = input_stream.recv(return_data=handle.return_data)
+                except zmq.error.ContextTerminated:
+                    self.stop()
+                    return
+                except Exception:
+                    # for example StreamOverrunError; keep polling the other streams
+                    logging.exception("Error while receiving data from %s", input_stream)
+                    continue
+                with handle.lock:
+                    handle._pos = pos
+                if handle.executor is None:
+                    handle._dispatch(pos, data)
+                else:
+                    handle.executor.submit(handle._dispatch, pos, data)
+    
+    def stop(self):
+        """Request the polling thread to stop.
+        """
+        with self.running_lock:
+            self.running = False
+    
+    def close(self):
+        """Stop the poller and shut down its worker threads.
+        """
+        self.stop()
+        self.wait()
+        for executor in self.executors:
+            executor.shutdown(wait=True)
+
+
 class ThreadPollOutput(ThreadPollInput):
     """    
     Thread that monitors an OutputStream in the background and emits a Qt signal
@@ -125,22 +311,44 @@ class ThreadPollOutput(ThreadPollInput):
 
 class ThreadStreamConverter(ThreadPollInput):
     """Thread that polls for data on an input stream and converts the transfer
-    mode or time axis of the data before relaying it through its output.
+    mode, dtype, axis order, channels and scale of the data before relaying it
+    through its output.
+    
+    All conversions are done in a single pass: with a 'sharedmem' output the
+    chunk is cast, scaled and transposed while it is written into the shared
+    ring buffer of the output; otherwise it is written once into a new array.
+    Selecting regularly spaced channels costs nothing (the input chunk is
+    viewed with strides); other channel lists cost one gather.
     """
-    def __init__(self, input_stream, output_stream, conversions,timeout=200, parent=None):
+    def __init__(self, input_stream, output_stream, conversions, channels=None,
+                 scale=None, offset=None, timeout=200, parent=None):
         ThreadPollInput.__init__(self, input_stream, timeout=timeout, return_data=True, parent=parent)
         self.output_stream = weakref.ref(output_stream)
         self.conversions = conversions
         
         self.output_dtype = make_dtype(self.output_stream().params['dtype'])
+        if channels is not None and channels_to_slice(channels) is not None:
+            channels = channels_to_slice(channels)
+        self.channels = channels
+        self.scale = scale
+        self.offset = offset
+        
+        self.fused = self.output_stream().params['transfermode'] == 'sharedmem'
+        if self.fused:
+            # the sender writes chunks of any dtype into its ring buffer with
+            # the conversion
+            self.output_stream().sender._buffer.set_conversion(scale, offset)
         
     def process_data(self, pos, data):
-        #~ if 'transfermode' in self.conversions and self.conversions['transfermode'][0]=='sharedmem':
-            #~ data = self.input_stream().get_array_slice(self, pos, None)
-        #~ if 'timeaxis' in self.conversions:
-            #~ data = data.swapaxes(*self.conversions['timeaxis'])
-        if data.dtype!=self.output_dtype:
-            data = data.astype(self.output_dtype)
+        if self.channels is not None:
+            data = data[:, self.channels]
+        if self.fused:
+            self.output_stream().send(data, index=pos)
+            return
+        if data.dtype != self.output_dtype or self.scale is not None or self.offset is not None:
+            out = np.empty(data.shape, dtype=self.output_dtype)
+            convert_into(out, data, self.scale, self.offset)
+            data = out
         self.output_stream().send(data, index=pos)
 
 
@@ -152,8 +360,14 @@ class StreamConverter(Node):
     
     * convert transfer mode 'plaindata' to 'sharedarray'. (to get a local long buffer)
     * convert dtype 'int32' to 'float64'
-    * change timeaxis 0 to 1 (in fact a transpose)
-    * ...
+    * change timeaxis 0 to 1 (in fact a transpose, with the ``axisorder``
+      of a 'sharedmem' output)
+    * select a subset of the channels
+    * convert raw values to physical values with the ``scale`` and ``offset``
+      of the input stream
+    
+    These conversions are applied together in a single pass over each chunk
+    (see :class:`ThreadStreamConverter`).
     
     Usage::
     
@@ -172,8 +386,20 @@ class StreamConverter(Node):
     def __init__(self, **kargs):
         Node.__init__(self, **kargs)
     
-    def _configure(self, **kargs):
-        pass
+    def _configure(self, channels=None, scaled=False):
+        """
+        Params
+        -----------
+        channels: list or None
+            Input channels forwarded to the output (in this order). The output
+            shape must be ``(-1, len(channels))``. Default: all channels.
+        scaled: bool
+            If True, the output carries physical values
+            (``offset + scale * data``, using the ``scale`` and ``offset`` of
+            the input stream); the output dtype should then be floating point.
+        """
+        self.channels = None if channels is None else [int(c) for c in channels]
+        self.scaled = scaled
     
     def _initialize(self):
         self.conversions = {}
@@ -189,7 +415,20 @@ class StreamConverter(Node):
         # DO some check ???
         # if 'shape' in self.conversions:
         #    assert 'timeaxis' in self.conversions        
-        self.thread = ThreadStreamConverter(self.input, self.output, self.conversions)
+        scale = offset = None
+        if self.scaled:
+            scale, offset = self.input.params.get('scale'), self.input.params.get('offset')
+        if self.channels is not None:
+            nb_channel = self.output.params['shape'][1]
+            assert nb_channel == len(self.channels), \
+                'output shape {} does not match channels {}'.format(self.output.params['shape'], self.channels)
+            # per channel scale and offset follow the channel selection
+            if scale is not None and np.ndim(scale) > 0:
+                scale = np.asarray(scale)[self.channels]
+            if offset is not None and np.ndim(offset) > 0:
+                offset = np.asarray(offset)[self.channels]
+        self.thread = ThreadStreamConverter(self.input, self.output, self.conversions,
+                                            channels=self.channels, scale=scale, offset=offset)
     
     def _start(self):
         self.thread.start()
@@ -205,15 +444,23 @@ register_node_type(StreamConverter)
 
 
 class ThreadSplitter(ThreadPollInput):
-    def __init__(self, input_stream, outputs_stream, output_channels, timeout=200, parent=None):
-        ThreadPollInput.__init__(self, input_stream, timeout=timeout, return_data=True, parent=parent)
+    def __init__(self, input_stream, outputs_stream, output_channels, shared_views=False, timeout=200, parent=None):
+        ThreadPollInput.__init__(self, input_stream, timeout=timeout, return_data=not shared_views, parent=parent)
         self.outputs_stream = weakref.WeakValueDictionary()
         self.outputs_stream.update(outputs_stream)
         self.output_channels = output_channels
+        self.shared_views = shared_views
     
     def process_data(self, pos, data):
+        origin = self.input_stream().last_origin
+        if self.shared_views:
+            # outputs are views of the input buffer; only notify them
+            size = self.input_stream().receiver.last_size
+            for k in self.output_channels:
+                self.outputs_stream[k].send(None, index=pos, origin=origin, size=size)
+            return
         for k , chans in self.output_channels.items():
-            self.outputs_stream[k].send(data[:, chans], index=pos)
+            self.outputs_stream[k].send(data[:, chans], index=pos, origin=origin)
 
 
 class ChannelSplitter(Node):
@@ -230,6 +477,12 @@ class ChannelSplitter(Node):
             output.configure(someotherspec)
         splitter.initialize()
         splitter.start()
+    
+    If the input stream uses ``transfermode='sharedmem'``, the outputs can be
+    published as channel-subset views of the shared ring buffer of the input
+    (see ``shared_views`` in :func:`configure`): no data is copied and each
+    input chunk only costs one notification per output. Receivers of these
+    outputs must run on the same machine as the input stream's sender.
         
     """
     _input_specs = {'in': {}}
@@ -238,7 +491,7 @@ class ChannelSplitter(Node):
     def __init__(self, **kargs):
         Node.__init__(self, **kargs)
     
-    def _configure(self, output_channels = {}):
+    def _configure(self, output_channels = {}, shared_views=False):
         """
         Params
         -----------
@@ -247,8 +500,21 @@ class ChannelSplitter(Node):
             Each key will be the name of each output.
         output_timeaxis: int or 'same'
             The output timeaxis is set here.
+        shared_views: bool
+            If True, the input must use ``transfermode='sharedmem'`` and the
+            outputs are 'sharedmem' streams that read their channels directly
+            from the shared buffer of the input (see the *view_of* option of
+            :class:`SharedMemSender <stream.sharedmemstream.SharedMemSender>`).
+            The channels of each output must then be increasing and regularly
+            spaced.
         """
         self.output_channels = output_channels
+        self.shared_views = shared_views
+        if shared_views:
+            for k, chans in output_channels.items():
+                if channels_to_slice(chans) is None:
+                    raise ValueError("With shared_views, output channels must be increasing "
+                                     "and regularly spaced; got %s for '%s'" % (chans, k))
     
     def after_input_connect(self, inputname):
         
@@ -262,11 +528,20 @@ class ChannelSplitter(Node):
             stream_spec['port'] = '*'
             stream_spec['nb_channel'] = len(chans)
             stream_spec['shape'] = (-1, len(chans))
+            if self.shared_views:
+                if self.input.params['transfermode'] != 'sharedmem':
+                    raise ValueError("ChannelSplitter with shared_views requires an input "
+                                     "stream with transfermode='sharedmem'")
+                stream_spec['transfermode'] = 'sharedmem'
+                stream_spec['view_of'] = {k: self.input.params[k] for k in
+                        ('shm_id', 'buffer_size', 'shape', 'double', 'mirror_size', 'axisorder', 'dtype')}
+                stream_spec['channels'] = list(chans)
             output = OutputStream(spec=stream_spec)
             self.outputs[k] = output
     
     def _initialize(self):
-        self.thread = ThreadSplitter(self.input, self.outputs, self.output_channels)
+        self.thread = ThreadSplitter(self.input, self.outputs, self.output_channels,
+                                     shared_views=self.shared_views)
     
     def _start(self):
         self.thread.start()
@@ -283,30 +558,53 @@ register_node_type(ChannelSplitter)
 
 
 class ThreadChunkResizer(ThreadPollInput):
+    """Thread that regroups the samples of its input stream into chunks of
+    *chunksize* samples.
+    
+    Whole chunks found in an input chunk are sent as views of it; other
+    samples are copied once into a staging array that is sent when full. A new
+    staging array is allocated for each such chunk because receivers may keep
+    a reference to the sent array (``transfermode='local'``).
+    """
     def __init__(self, input_stream, output_stream, chunksize, timeout=200, parent=None):
         ThreadPollInput.__init__(self, input_stream, timeout=timeout, return_data=True, parent=parent)
         self.output_stream = weakref.ref(output_stream)
         self.chunksize = chunksize
-        self.stack = []
+        self.pending = None
+        self.n_pending = 0
+        # origin (see OutputStream.send) of the pending chunk; an output
+        # chunk takes the origin of its oldest part
+        self.pending_origin = None
     
     def process_data(self, pos, data):
-        if (data.shape[0] == self.chunksize) and (len(self.stack)==0):
-            self.output_stream().send(data)
-            return
+        origin = self.input_stream().last_origin
+        chunksize = self.chunksize
+        n = data.shape[0]
+        start = pos - n  # absolute index of the first sample of data
+        
+        # complete the pending chunk
+        i = 0
+        if self.n_pending > 0:
+            i = min(chunksize - self.n_pending, n)
+            self.pending[self.n_pending:self.n_pending+i] = data[:i]
+            self.n_pending += i
+            if self.n_pending < chunksize:
+                return
+            self.output_stream().send(self.pending, index=start+i, origin=self.pending_origin)
+            self.pending = None
+            self.n_pending = 0
         
-        self.stack.append(data)
+        # whole chunks are sent without copy
+        while n - i >= chunksize:
+            self.output_stream().send(data[i:i+chunksize], index=start+i+chunksize, origin=origin)
+            i += chunksize
         
-        cumsizes = np.cumsum([d.shape[0] for d in self.stack])
-        while (len(cumsizes)>0) and (cumsizes[-1]>=self.chunksize):
-            until = np.searchsorted(cumsizes, self.chunksize) + 1
-            data_conc = np.concatenate(self.stack[:until])
-            self.output_stream().send(data_conc[:self.chunksize])
-            _stack = []
-            if data_conc.shape[0]>self.chunksize:
-                self.stack = [data_conc[self.chunksize:]] + self.stack[until:]
-            else:
-                self.stack = self.stack[until:]
-            cumsizes = np.cumsum([d.shape[0] for d in self.stack])
+        # keep the remaining samples for the next chunk
+        if i < n:
+            self.pending = np.empty((chunksize,) + data.shape[1:], dtype=data.dtype)
+            self.pending[:n-i] = data[i:]
+            self.n_pending = n - i
+            self.pending_origin = origin
 
 
 class ChunkResizer(Node):
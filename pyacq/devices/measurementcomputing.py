@@ -91,6 +91,11 @@ class MeasurementComputing(Node):
     ai_mode: str or None
         Some card can be configured with an ai mode in ('differential', 'single-ended', 'grounded')
         None by default because not all card can deal with this.
+    ai_raw: bool
+        If True, analog channels are sent as raw uint16 samples together with
+        per-channel ``scale`` and ``offset`` stream parameters (half the
+        bandwidth of float32). Receivers get Volts with
+        ``InputStream.set_buffer(scaled=True)``. Default False.
     
     """
     _output_specs = {'aichannels' : dict(streamtype = 'analogsignal'),
@@ -102,7 +107,7 @@ class MeasurementComputing(Node):
         assert HAVE_MC, "MeasurementComputing depend on MeasurementComputing DLL"
 
     def _configure(self, board_num=0, sample_rate=1000., ai_channel_index=None,
-                ai_ranges=(-5, 5), ai_mode=None):
+                ai_ranges=(-5, 5), ai_mode=None, ai_raw=False):
         
         self.board_info = self.scan_device_info(board_num)
         
@@ -122,6 +127,7 @@ class MeasurementComputing(Node):
         assert all(ai_range in range_convertion for ai_range in ai_ranges), 'Range not supported {}'.format(ai_ranges)
         
         self.ai_mode = ai_mode
+        self.ai_raw = ai_raw
         if ai_mode is not None:
             assert ai_mode in mode_convertion, 'Unknown ai mode. Not in {}'.format(mode_convertion.keys())
         
@@ -142,7 +148,12 @@ class MeasurementComputing(Node):
         self.prepare_device()
         
         self.outputs['aichannels'].spec['shape'] = (-1, self.nb_ai_channel)
-        self.outputs['aichannels'].spec['dtype'] = 'float32'
+        if ai_raw:
+            self.outputs['aichannels'].spec['dtype'] = 'uint16'
+            self.outputs['aichannels'].spec['scale'] = self.channel_gains.ravel().tolist()
+            self.outputs['aichannels'].spec['offset'] = self.channel_offsets.ravel().tolist()
+        else:
+            self.outputs['aichannels'].spec['dtype'] = 'float32'
         self.outputs['aichannels'].spec['sample_rate'] = self.real_sample_rate
         self.outputs['aichannels'].spec['nb_channel'] = self.nb_ai_channel
         
@@ -363,6 +374,7 @@ class MeasurementComputingThread(QtCore.QThread):
         di_dtype = self.node.di_dtype
         channel_gains = self.node.channel_gains
         channel_offsets = self.node.channel_offsets
+        ai_raw = self.node.ai_raw
         
         status = ctypes.c_int(0)
         cur_count = ctypes.c_long(0)
@@ -395,9 +407,12 @@ class MeasurementComputingThread(QtCore.QThread):
                 #end of internal ring buffer
                 new_samp = internal_size - last_index
                 head += new_samp
-                ai_arr = raw_arr[last_index:, ai_mask].astype('float32')
-                ai_arr *= channel_gains
-                ai_arr += channel_offsets
+                if ai_raw:
+                    ai_arr = raw_arr[last_index:, ai_mask]
+                else:
+                    ai_arr = raw_arr[last_index:, ai_mask].astype('float32')
+                    ai_arr *= channel_gains
+                    ai_arr += channel_offsets
                 outputs['aichannels'].send(ai_arr, index=head)
                 
                 if board_info['nb_di_port']>0:
@@ -407,9 +422,12 @@ class MeasurementComputingThread(QtCore.QThread):
                 
             new_samp = index - last_index
             head += new_samp
-            ai_arr = raw_arr[last_index:index, ai_mask].astype('float32')
-            ai_arr *= channel_gains
-            ai_arr += channel_offsets
+            if ai_raw:
+                ai_arr = raw_arr[last_index:index, ai_mask]
+            else:
+                ai_arr = raw_arr[last_index:index, ai_mask].astype('float32')
+                ai_arr *= channel_gains
+                ai_arr += channel_offsets
             outputs['aichannels'].send(ai_arr, index=head)
             
             
@@ -349,7 +349,7 @@ class SosFilterThread(ThreadPollInput):
     def process_data(self, pos, data):
         with self.mutex:
             chunk_filtered = self.filter_engine.compute_one_chunk(pos, data)
-        self.output_stream.send(chunk_filtered, index=pos)
+        self.output_stream.send(chunk_filtered, index=pos, origin=self.input_stream().last_origin)
         
     def set_params(self, engine, coefficients, nb_channel, dtype, chunksize):
         assert engine in sosfilter_engines
@@ -186,10 +186,10 @@ class QTimeFreq(WidgetNode):
             worker.configure(channel=i, local=self.local_workers)
             worker.input.connect(self.conv.output)
             if self.local_workers:
-                protocol = 'inproc'
+                # maps are handed over by reference in the same process
+                worker.output.configure(protocol='inproc', transfermode='local')
             else:
-                protocol = 'tcp'
-            worker.output.configure(protocol=protocol, transfermode='plaindata')
+                worker.output.configure(protocol='tcp', transfermode='plaindata')
             worker.initialize()
             self.workers.append(worker)
             